@@ -0,0 +1,112 @@
+"""
+Pre-aggregated user activity rollups
+Keeps daily counts of audit events per (day, user, action, resource type)
+"""
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from models import db, AuditLog, ActivityRollup
+
+ROLLUP_KEY_COLUMNS = ['day', 'user_id', 'action', 'resource_type']
+
+
+def rollup_key(user_id, action, resource_type, timestamp):
+    """Normalize an audit event into its rollup key"""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return ((timestamp or datetime.utcnow()).date(), user_id or 0, action, resource_type or '')
+
+
+def _upsert_statement(dialect_name):
+    """Build an INSERT ... ON CONFLICT that adds to an existing rollup count"""
+    table = ActivityRollup.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[column] for column in ROLLUP_KEY_COLUMNS],
+        set_={'count': table.c['count'] + stmt.excluded['count']}
+    )
+
+
+def apply_rollup_counts(connection, counts):
+    """Add a Counter of rollup keys to the rollup table"""
+    if not counts:
+        return
+    params = [
+        {'day': day, 'user_id': user_id, 'action': action, 'resource_type': resource_type, 'count': count}
+        for (day, user_id, action, resource_type), count in counts.items()
+    ]
+    connection.execute(_upsert_statement(connection.dialect.name), params)
+
+
+def _update_rollups_after_flush(session, flush_context):
+    """Count newly inserted audit rows into the rollup table in the same transaction"""
+    counts = Counter(
+        rollup_key(obj.user_id, obj.action, obj.resource_type, obj.timestamp)
+        for obj in session.new
+        if isinstance(obj, AuditLog)
+    )
+    if counts:
+        apply_rollup_counts(session.connection(), counts)
+
+
+def init_activity_rollups():
+    """Register the session hook that maintains rollups as audit events are written"""
+    if not event.contains(Session, 'after_flush', _update_rollups_after_flush):
+        event.listen(Session, 'after_flush', _update_rollups_after_flush)
+
+
+def backfill_activity_rollups(archive=None):
+    """
+    Rebuild the rollup table from the audit_log table and, if given, the
+    audit archive. Returns the number of rollup rows written.
+    """
+    ActivityRollup.query.delete()
+
+    day = func.date(AuditLog.timestamp)
+    user_id = func.coalesce(AuditLog.user_id, 0)
+    resource_type = func.coalesce(AuditLog.resource_type, '')
+    aggregated = db.session.query(
+        day, user_id, AuditLog.action, resource_type, func.count(AuditLog.id)
+    ).group_by(day, user_id, AuditLog.action, resource_type)
+
+    counts = Counter()
+    for row_day, row_user_id, action, row_resource_type, count in aggregated:
+        counts[(datetime.strptime(str(row_day), '%Y-%m-%d').date(), row_user_id, action, row_resource_type)] += count
+
+    if archive is not None:
+        for month in archive.months_in_range():
+            for row in archive.iter_month(month):
+                counts[rollup_key(row.get('user_id'), row.get('action'),
+                                  row.get('resource_type'), row.get('timestamp'))] += 1
+
+    apply_rollup_counts(db.session.connection(), counts)
+    db.session.commit()
+    return len(counts)
+
+
+def summarize_activity(date_from=None, date_to=None, user_id=None, action=None, group_by=('user_id', 'action')):
+    """
+    Aggregate rollup counts over a date range.
+    date_from/date_to are inclusive dates; group_by is a subset of the rollup key columns.
+    """
+    group_columns = [getattr(ActivityRollup, column) for column in group_by]
+    query = db.session.query(*group_columns, func.sum(ActivityRollup.count).label('count'))
+
+    if date_from:
+        query = query.filter(ActivityRollup.day >= date_from)
+    if date_to:
+        query = query.filter(ActivityRollup.day <= date_to)
+    if user_id is not None:
+        query = query.filter(ActivityRollup.user_id == user_id)
+    if action:
+        query = query.filter(ActivityRollup.action == action)
+
+    rows = query.group_by(*group_columns).order_by(*group_columns).all()
+    return [dict(zip(list(group_by) + ['count'], row)) for row in rows]
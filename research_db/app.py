@@ -1,13 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, send_file
+from flask import Flask, render_template, request, redirect, url_for, flash, session, Response, send_file, stream_with_context, has_request_context, g
 from flask_login import LoginManager, login_required, current_user, login_user, logout_user
+from werkzeug.exceptions import HTTPException
 from werkzeug.security import check_password_hash
-from models import db, User, Project, ProjectTeamMember, AuditLog, ProjectStatusHistory, ErrorLog, Document
+from models import db, User, Project, ProjectTeamMember, AuditLog, ProjectStatusHistory, ErrorLog, Document, ProjectStorageUsage
+from document_store import (DocumentStore, FORM_OVERHEAD_BYTES, add_blob_reference, init_document_uploads,
+                            record_blob_storage, release_blob_reference, remove_released_blob, restore_blob,
+                            storage_totals)
+from storage_backends import STORAGE_BACKENDS, backend_available, storage_backend
+from storage_compression import COMPRESSION_CODECS, codec_available
+from chunked_uploads import ChunkedUploadStore, UploadRangeError, parse_content_range
+from file_serving import FILE_SERVING_MODES, serve_file, serve_stream, stream_zip, unique_archive_name
+from document_search import DocumentIndexer, create_search_index, remove_document_text, search_documents
+from document_previews import PreviewCache, PreviewGenerator, preview_kinds
+from project_storage import (QuotaExceeded, check_project_quota, effective_quota, project_usage,
+                             record_document_usage, usage_by_project)
+from document_catalog import (CATALOG_PAGE_SIZE, InvalidCursor, catalog_page, catalog_totals,
+                              parse_catalog_filters)
+from sqlalchemy.orm import joinedload, selectinload
+from audit_archive import AuditArchive, AuditArchiveFilter, paginate_with_archive
+from activity_rollups import init_activity_rollups, summarize_activity, ROLLUP_KEY_COLUMNS
+from error_ingest import ErrorAggregator, RECORD_DROPPED, RECORDED_REPEAT, fingerprint_error, format_error_traceback
+from logging_config import setup_logging
+from instrumentation import init_instrumentation, timing_span
+from metrics import MetricsRegistry, init_metrics, count_rows
+from sql_profiler import SqlProfileStore, init_sql_profiler
+from request_profiler import ProfilerControl, PROFILE_MODES, init_request_profiler, list_profiles, sign_profile_token
+from memory_diagnostics import (RequestMemoryTracker, init_memory_diagnostics, take_snapshot, list_snapshots,
+                                top_allocations, diff_snapshots, current_rss, format_bytes)
 import os
 import csv
 import io
+import hmac
 import json
 import logging
+import re
+import time
 import traceback
+import tracemalloc
+import uuid
 from datetime import datetime, timedelta
 import sys
 import pandas as pd
@@ -15,66 +45,66 @@ import pandas as pd
 print("Initializing Marga Research Institute Management System...")
 
 # Configure logging
-def setup_logging():
-    """Configure application logging"""
-    log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-    
-    # Main application log
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(os.path.join(log_dir, 'app.log')),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    
-    # Error log
-    error_logger = logging.getLogger('error_logger')
-    error_handler = logging.FileHandler(os.path.join(log_dir, 'errors.log'))
-    error_handler.setLevel(logging.ERROR)
-    error_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s - %(pathname)s:%(lineno)d')
-    error_handler.setFormatter(error_formatter)
-    error_logger.addHandler(error_handler)
-    
-    return logging.getLogger(__name__), error_logger
+app_logger, error_logger = setup_logging(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'), __name__)
+import_logger = logging.getLogger('bulk_import')
 
-app_logger, error_logger = setup_logging()
+# Incoming X-Request-ID values are only trusted when they look like an id
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+DOCUMENT_EXTENSIONS = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'jpg', 'jpeg', 'png', 'gif'}
+DOCUMENT_TYPES = ['contract', 'report', 'deliverable']
 
 def log_error(error, context=None, user=None):
     """Log application errors with context"""
     try:
-        error_details = {
-            'error': str(error),
-            'type': type(error).__name__,
-            'traceback': traceback.format_exc(),
+        in_request = has_request_context()
+        if user is None and in_request and current_user.is_authenticated:
+            user = current_user
+        
+        fingerprint = fingerprint_error(error)
+        occurrence = {
             'context': context or {},
             'user': user.username if user else 'anonymous',
-            'timestamp': datetime.now().isoformat(),
-            'url': request.url if request else None,
-            'method': request.method if request else None,
-            'ip': request.remote_addr if request else None
+            'user_id': user.id if user else None,
+            'timestamp': datetime.utcnow().isoformat(),
+            'url': request.url if in_request else None,
+            'method': request.method if in_request else None,
+            'ip': request.remote_addr if in_request else None,
+            'user_agent': request.headers.get('User-Agent') if in_request else None
         }
         
-        # Log to file
-        error_logger.error(json.dumps(error_details, indent=2))
+        # Occurrences are aggregated per fingerprint and written to ErrorLog in batches
+        outcome = error_aggregator.record(fingerprint, error, occurrence)
+        if outcome == RECORDED_REPEAT:
+            # Already reported in this flush window - don't repeat file and audit writes
+            return
+        
+        # Log to file - the only record of an error the aggregator had no room for
+        entry = {
+            'error': str(error),
+            'type': type(error).__name__,
+            'fingerprint': fingerprint,
+            'traceback': format_error_traceback(error),
+            **occurrence
+        }
+        if outcome == RECORD_DROPPED:
+            entry['error_log'] = 'dropped'
+        error_logger.error(json.dumps(entry, default=str))
         
         # Also create audit log entry for tracking
-        if current_user and current_user.is_authenticated:
+        if user:
             audit_entry = AuditLog(
-                user_id=current_user.id,
+                user_id=user.id,
                 action='error_occurred',
                 resource_type='system',
-                resource_id=None,
+                resource_id=fingerprint,
                 details=json.dumps({
                     'error_type': type(error).__name__,
                     'error_message': str(error),
                     'context': context
-                }),
-                ip_address=request.remote_addr if request else None,
-                user_agent=request.headers.get('User-Agent') if request else None
+                }, default=str),
+                ip_address=occurrence['ip'],
+                user_agent=occurrence['user_agent']
             )
             db.session.add(audit_entry)
             db.session.commit()
@@ -111,9 +141,119 @@ def log_user_activity(action, resource_type=None, resource_id=None, details=None
             db.session.add(audit_entry)
             db.session.commit()
     except Exception as e:
-        print(f"Error logging activity: {e}")
+        app_logger.warning(f"Error logging activity: {e}")
         # Don't let audit logging failures break the application
 
+def parse_audit_date_range(date_from, date_to):
+    """Parse audit filter dates into a [from, to) datetime range, ignoring invalid values"""
+    date_from_obj = None
+    date_to_obj = None
+    
+    if date_from:
+        try:
+            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
+        except ValueError:
+            pass
+    
+    if date_to:
+        try:
+            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
+        except ValueError:
+            pass
+    
+    return date_from_obj, date_to_obj
+
+def apply_audit_log_filters(query, user_filter, action_filter, date_from_obj, date_to_obj):
+    """Apply the audit viewer filters (user, action, date range) to a query"""
+    if user_filter:
+        matching_users = db.session.query(User.id).filter(User.username.ilike(f'%{user_filter}%'))
+        query = query.filter(AuditLog.user_id.in_(matching_users))
+    
+    if action_filter:
+        query = query.filter(AuditLog.action.ilike(f'%{action_filter}%'))
+    
+    if date_from_obj:
+        query = query.filter(AuditLog.timestamp >= date_from_obj)
+    
+    if date_to_obj:
+        query = query.filter(AuditLog.timestamp < date_to_obj)
+    
+    return query
+
+AUDIT_EXPORT_FIELDS = [
+    'id', 'timestamp', 'user_id', 'username', 'action', 'resource_type',
+    'resource_id', 'details', 'ip_address', 'user_agent'
+]
+
+def iter_audit_export_rows(user_filter='', action_filter='', date_from='', date_to='', batch_size=1000):
+    """
+    Yield audit log rows as dicts in chronological order.
+    
+    Archived months covered by the date range come first, streamed straight
+    from their archive files, followed by the audit_log table read in
+    keyset batches. Each batch runs in its own short read transaction so a
+    long export never holds a lock that blocks writers.
+    """
+    date_from_obj, date_to_obj = parse_audit_date_range(date_from, date_to)
+    usernames = dict(db.session.query(User.id, User.username).all())
+    
+    archive = AuditArchive(app.config['AUDIT_ARCHIVE_DIR'])
+    if archive.archived_before and (not date_from_obj or date_from_obj < archive.archived_before):
+        row_filter = AuditArchiveFilter(user_filter, action_filter, date_from_obj, date_to_obj)
+        for month in reversed(archive.months_in_range(date_from_obj, date_to_obj)):
+            for row in archive.iter_month(month, row_filter):
+                row['username'] = usernames.get(row.get('user_id'))
+                yield row
+    
+    columns = [
+        AuditLog.id, AuditLog.timestamp, AuditLog.user_id, AuditLog.action,
+        AuditLog.resource_type, AuditLog.resource_id, AuditLog.details,
+        AuditLog.ip_address, AuditLog.user_agent
+    ]
+    base_query = apply_audit_log_filters(db.session.query(*columns), user_filter, action_filter,
+                                         date_from_obj, date_to_obj)
+    last_id = 0
+    while True:
+        batch = base_query.filter(AuditLog.id > last_id).order_by(AuditLog.id).limit(batch_size).all()
+        # End the read transaction before handing rows to the (possibly slow) client
+        db.session.rollback()
+        if not batch:
+            break
+        
+        for row in batch:
+            yield {
+                'id': row.id,
+                'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+                'user_id': row.user_id,
+                'username': usernames.get(row.user_id),
+                'action': row.action,
+                'resource_type': row.resource_type,
+                'resource_id': row.resource_id,
+                'details': row.details,
+                'ip_address': row.ip_address,
+                'user_agent': row.user_agent
+            }
+        last_id = batch[-1].id
+
+def iter_audit_export_lines(rows, export_format='csv'):
+    """Serialize audit rows as CSV or NDJSON text chunks"""
+    if export_format == 'ndjson':
+        for row in rows:
+            yield json.dumps({field: row.get(field) for field in AUDIT_EXPORT_FIELDS}) + '\n'
+        return
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(AUDIT_EXPORT_FIELDS)
+    for row in rows:
+        writer.writerow(['' if row.get(field) is None else row.get(field) for field in AUDIT_EXPORT_FIELDS])
+        # Flush the buffer every row so memory stays constant
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
 def get_valid_status_transitions():
     """Define valid status transitions"""
     return {
@@ -436,15 +576,131 @@ def create_app():
     # Configure the app directly
     app.config['SECRET_KEY'] = 'marga-research-secret-key-2024'
     
-    # Use absolute path for database to ensure consistency
+    # Use absolute path for database to ensure consistency; DATABASE_URL overrides it (e.g. benchmark databases)
     db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'research_projects.db')
-    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', f'sqlite:///{db_path}')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
     # Session timeout configuration (30 minutes)
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
     app.config['SESSION_TIMEOUT_WARNING'] = 5  # Warn 5 minutes before timeout
     
+    # Audit log retention - rows older than this are moved to monthly archives
+    app.config['AUDIT_RETENTION_DAYS'] = int(os.environ.get('AUDIT_RETENTION_DAYS', 365))
+    app.config['AUDIT_ARCHIVE_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archives', 'audit')
+    app.config['AUDIT_ARCHIVE_BATCH_SIZE'] = 1000
+    app.config['AUDIT_EXPORT_BATCH_SIZE'] = 1000
+    
+    # Error ingestion - occurrences of the same error are batched into one ErrorLog write per interval
+    app.config['ERROR_FLUSH_INTERVAL_SECONDS'] = float(os.environ.get('ERROR_FLUSH_INTERVAL_SECONDS', 5))
+    
+    # Prometheus metrics - each worker process writes its totals here and /metrics merges them
+    app.config['METRICS_DIR'] = os.environ.get(
+        'METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'metrics')
+    )
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+    
+    # Request timing breakdown - Server-Timing response header and optional logs/traces.log entries
+    app.config['SERVER_TIMING_ENABLED'] = os.environ.get('SERVER_TIMING', 'false').lower() in ['1', 'true', 'yes']
+    app.config['REQUEST_TRACE_LOG'] = os.environ.get('REQUEST_TRACE_LOG', 'false').lower() in ['1', 'true', 'yes']
+    
+    # SQL profiler (development/staging) - per-request statement capture, N+1 detection and slow query plans
+    app.config['SQL_PROFILER_ENABLED'] = os.environ.get('SQL_PROFILER', 'false').lower() in ['1', 'true', 'yes']
+    app.config['SQL_SLOW_QUERY_MS'] = float(os.environ.get('SQL_SLOW_QUERY_MS', 100))
+    app.config['SQL_N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+    
+    # On-demand request profiler - armed from the admin page or by a signed X-Profile-Token header
+    app.config['PROFILE_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'profiles')
+    app.config['PROFILER_SAMPLE_INTERVAL_MS'] = float(os.environ.get('PROFILER_SAMPLE_INTERVAL_MS', 5))
+    app.config['PROFILE_MAX_FILES'] = 100
+    app.config['PROFILE_TOKEN_LIFETIME_MINUTES'] = 60
+    
+    # Memory diagnostics - tracemalloc snapshots and peak memory of import/export requests
+    app.config['MEMORY_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'memory')
+    app.config['MEMORY_TRACE_AT_STARTUP'] = os.environ.get('MEMORY_TRACE', 'false').lower() in ['1', 'true', 'yes']
+    app.config['MEMORY_TRACE_FRAMES'] = int(os.environ.get('MEMORY_TRACE_FRAMES', 10))
+    app.config['MEMORY_TRACKED_ENDPOINTS'] = [
+        'bulk_import', 'confirm_import', 'export_projects_csv', 'export_audit_logs', 'download_template'
+    ]
+    
+    # Uploaded documents - stored once per distinct content (SHA-256), under <dir>/blobs or in an
+    # S3-compatible bucket; <dir> also holds upload temp files and the preview cache
+    app.config['DOCUMENT_STORE_DIR'] = os.environ.get(
+        'DOCUMENT_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads', 'documents')
+    )
+    app.config['DOCUMENT_STORAGE'] = os.environ.get('DOCUMENT_STORAGE', 'local').lower()
+    if app.config['DOCUMENT_STORAGE'] not in STORAGE_BACKENDS:
+        raise ValueError(f"DOCUMENT_STORAGE must be one of {', '.join(STORAGE_BACKENDS)}")
+    # S3 (or MinIO etc. via the endpoint URL); credentials come from the standard AWS variables
+    app.config['DOCUMENT_S3_BUCKET'] = os.environ.get('DOCUMENT_S3_BUCKET', '')
+    app.config['DOCUMENT_S3_PREFIX'] = os.environ.get('DOCUMENT_S3_PREFIX', 'documents/')
+    app.config['DOCUMENT_S3_ENDPOINT_URL'] = os.environ.get('DOCUMENT_S3_ENDPOINT_URL') or None
+    app.config['DOCUMENT_S3_REGION'] = os.environ.get('DOCUMENT_S3_REGION') or None
+    app.config['DOCUMENT_S3_PART_BYTES'] = int(os.environ.get('DOCUMENT_S3_PART_MB', 8)) * 1024 * 1024
+    app.config['DOCUMENT_S3_UPLOAD_CONCURRENCY'] = int(os.environ.get('DOCUMENT_S3_UPLOAD_CONCURRENCY', 4))
+    if app.config['DOCUMENT_STORAGE'] == 's3':
+        if not backend_available('s3'):
+            raise ValueError("DOCUMENT_STORAGE=s3 needs the boto3 package")
+        if not app.config['DOCUMENT_S3_BUCKET']:
+            raise ValueError("DOCUMENT_STORAGE=s3 needs DOCUMENT_S3_BUCKET")
+    
+    # Document upload limits - single-request uploads, and resumable chunked uploads for larger files
+    app.config['DOCUMENT_MAX_UPLOAD_BYTES'] = int(os.environ.get('DOCUMENT_MAX_UPLOAD_MB', 50)) * 1024 * 1024
+    app.config['DOCUMENT_MAX_CHUNKED_UPLOAD_BYTES'] = int(os.environ.get('DOCUMENT_MAX_CHUNKED_UPLOAD_MB', 1024)) * 1024 * 1024
+    app.config['DOCUMENT_UPLOAD_CHUNK_BYTES'] = int(os.environ.get('DOCUMENT_UPLOAD_CHUNK_MB', 8)) * 1024 * 1024
+    app.config['DOCUMENT_UPLOAD_TTL_HOURS'] = 24  # Unfinished chunked uploads are removed after this
+    # Default per-project storage quota (logical bytes of all its documents); 0 for no limit
+    app.config['PROJECT_STORAGE_QUOTA_BYTES'] = int(os.environ.get('PROJECT_STORAGE_QUOTA_MB', 0)) * 1024 * 1024
+    app.config['DOCUMENT_CACHE_MAX_AGE'] = int(os.environ.get('DOCUMENT_CACHE_MAX_AGE', 3600))  # Browser cache lifetime of downloads
+    
+    # Compression at rest for formats that compress well - off, gzip or zstd (needs the zstandard package)
+    app.config['DOCUMENT_COMPRESSION'] = os.environ.get('DOCUMENT_COMPRESSION', 'off').lower()
+    if app.config['DOCUMENT_COMPRESSION'] in ['off', 'none', '']:
+        app.config['DOCUMENT_COMPRESSION'] = None
+    elif app.config['DOCUMENT_COMPRESSION'] not in COMPRESSION_CODECS:
+        raise ValueError(f"DOCUMENT_COMPRESSION must be off or one of {', '.join(COMPRESSION_CODECS)}")
+    elif not codec_available(app.config['DOCUMENT_COMPRESSION']):
+        raise ValueError(f"DOCUMENT_COMPRESSION={app.config['DOCUMENT_COMPRESSION']} needs the zstandard package")
+    
+    # Archive tier - documents used only by projects closed for DOCUMENT_ARCHIVE_AFTER_MONTHS move to a
+    # separate local directory (tier_documents.py), compressed there with any codec when it saves space
+    app.config['DOCUMENT_ARCHIVE_DIR'] = os.environ.get(
+        'DOCUMENT_ARCHIVE_DIR', os.path.join(app.config['DOCUMENT_STORE_DIR'], 'archive')
+    )
+    app.config['DOCUMENT_ARCHIVE_AFTER_MONTHS'] = int(os.environ.get('DOCUMENT_ARCHIVE_AFTER_MONTHS', 12))
+    app.config['DOCUMENT_ARCHIVE_COMPRESSION'] = os.environ.get('DOCUMENT_ARCHIVE_COMPRESSION', 'gzip').lower()
+    if app.config['DOCUMENT_ARCHIVE_COMPRESSION'] in ['off', 'none', '']:
+        app.config['DOCUMENT_ARCHIVE_COMPRESSION'] = None
+    elif app.config['DOCUMENT_ARCHIVE_COMPRESSION'] not in COMPRESSION_CODECS:
+        raise ValueError(f"DOCUMENT_ARCHIVE_COMPRESSION must be off or one of {', '.join(COMPRESSION_CODECS)}")
+    elif not codec_available(app.config['DOCUMENT_ARCHIVE_COMPRESSION']):
+        raise ValueError(f"DOCUMENT_ARCHIVE_COMPRESSION={app.config['DOCUMENT_ARCHIVE_COMPRESSION']} needs the zstandard package")
+    
+    # Document full-text search - text of new uploads is extracted in a local process pool
+    app.config['DOCUMENT_SEARCH_ENABLED'] = os.environ.get('DOCUMENT_SEARCH', 'true').lower() in ['1', 'true', 'yes']
+    app.config['DOCUMENT_EXTRACTION_WORKERS'] = int(os.environ.get('DOCUMENT_EXTRACTION_WORKERS', 2))
+    
+    # Document previews - thumbnails and text previews, cached by content hash and trimmed LRU
+    app.config['PREVIEW_CACHE_DIR'] = os.environ.get(
+        'PREVIEW_CACHE_DIR', os.path.join(app.config['DOCUMENT_STORE_DIR'], 'previews')
+    )
+    app.config['PREVIEW_CACHE_MAX_BYTES'] = int(os.environ.get('PREVIEW_CACHE_MAX_MB', 512)) * 1024 * 1024
+    app.config['PREVIEW_WORKERS'] = int(os.environ.get('PREVIEW_WORKERS', 2))
+    app.config['PREVIEW_CACHE_MAX_AGE'] = 365 * 24 * 3600  # Preview URLs carry the content hash, so they never change
+    
+    app.config['BACKUP_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+    
+    # File serving - 'direct' streams from the worker; 'x-sendfile' (Apache) and 'x-accel-redirect' (nginx)
+    # hand document and backup transfers to the front-end server after the permission check
+    app.config['FILE_SERVING_MODE'] = os.environ.get('FILE_SERVING_MODE', 'direct').lower()
+    if app.config['FILE_SERVING_MODE'] not in FILE_SERVING_MODES:
+        raise ValueError(f"FILE_SERVING_MODE must be one of {', '.join(FILE_SERVING_MODES)}")
+    # Local directory -> nginx internal location serving it
+    app.config['X_ACCEL_LOCATIONS'] = {
+        app.config['DOCUMENT_STORE_DIR']: os.environ.get('X_ACCEL_DOCUMENTS_URI', '/protected/documents'),
+        app.config['BACKUP_DIR']: os.environ.get('X_ACCEL_BACKUPS_URI', '/protected/backups'),
+    }
+    
     # Initialize extensions
     db.init_app(app)
     
@@ -475,6 +731,20 @@ def create_app():
         app_logger.warning(f"403 error: {request.url} - User: {current_user.username if current_user.is_authenticated else 'Anonymous'}")
         return render_template('errors/403.html'), 403
     
+    @app.errorhandler(413)
+    def request_entity_too_large(error):
+        app_logger.warning(f"413 error: {request.url} - Content-Length: {request.content_length}")
+        if request.endpoint == 'upload_document':
+            limit_mb = app.config['DOCUMENT_MAX_UPLOAD_BYTES'] // (1024 * 1024)
+            flash(f'The file is too large. Documents are limited to {limit_mb} MB per upload.', 'error')
+            return redirect(request.url)
+        return {'status': 'error', 'message': 'Request body too large.'}, 413
+    
+    @app.errorhandler(416)
+    def range_not_satisfiable(error):
+        # Werkzeug's response carries Content-Range: bytes */<size>, e.g. for resuming a finished download
+        return error
+    
     @app.errorhandler(Exception)
     def handle_exception(error):
         """Handle all unhandled exceptions"""
@@ -489,11 +759,84 @@ def create_app():
 # Create application instance
 app = create_app()
 
+# Content-addressed storage for uploaded documents; uploads stream straight into it
+document_store = DocumentStore(app.config['DOCUMENT_STORE_DIR'], app.config['DOCUMENT_COMPRESSION'],
+                               storage_backend(app.config['DOCUMENT_STORAGE'], app.config),
+                               archive_dir=app.config['DOCUMENT_ARCHIVE_DIR'],
+                               archive_compression=app.config['DOCUMENT_ARCHIVE_COMPRESSION'])
+chunked_uploads = ChunkedUploadStore(os.path.join(document_store.temp_dir, 'uploads'),
+                                     app.config['DOCUMENT_UPLOAD_TTL_HOURS'])
+document_indexer = DocumentIndexer(app, document_store.backend, app.config['DOCUMENT_EXTRACTION_WORKERS'])
+preview_cache = PreviewCache(app.config['PREVIEW_CACHE_DIR'], app.config['PREVIEW_CACHE_MAX_BYTES'])
+preview_generator = PreviewGenerator(preview_cache, document_store.backend, app.config['PREVIEW_WORKERS'])
+app.add_template_global(preview_kinds, 'document_preview_kinds')
+init_document_uploads(app, document_store, ['upload_document'], {
+    'upload_document': app.config['DOCUMENT_MAX_UPLOAD_BYTES'] + FORM_OVERHEAD_BYTES,
+    'upload_document_chunk': app.config['DOCUMENT_UPLOAD_CHUNK_BYTES'],
+})
+
+# Per-request SQL and template timings, collected before any other request hook runs
+init_instrumentation(app)
+
+# Per-endpoint Prometheus metrics, served at /metrics
+metrics_registry = MetricsRegistry(app.config['METRICS_DIR'])
+init_metrics(app, metrics_registry)
+
+# SQL profiler, only active when SQL_PROFILER_ENABLED is set
+sql_profile_store = SqlProfileStore()
+init_sql_profiler(app, sql_profile_store)
+
+# On-demand request profiler, shared across worker processes through PROFILE_DIR
+profiler_control = ProfilerControl(app.config['PROFILE_DIR'])
+init_request_profiler(app, profiler_control)
+
+# Per-request memory of import and export routes
+memory_tracker = RequestMemoryTracker()
+init_memory_diagnostics(app, memory_tracker)
+
+# Maintain daily activity rollups as audit events are written
+init_activity_rollups()
+
+# Aggregate repeated errors into ErrorLog, writing at most once per flush interval
+error_aggregator = ErrorAggregator(app, flush_interval=app.config['ERROR_FLUSH_INTERVAL_SECONDS'])
+
+@app.before_request
+def start_request_timer():
+    """Assign a request id and start the latency timer for structured request logging"""
+    incoming_id = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming_id if REQUEST_ID_PATTERN.match(incoming_id) else uuid.uuid4().hex
+    g.request_started_at = time.perf_counter()
+
+@app.after_request
+def log_request_completion(response):
+    """Log request latency and echo the request id back to the client"""
+    started_at = g.get('request_started_at')
+    if started_at is not None:
+        latency_ms = round((time.perf_counter() - started_at) * 1000, 2)
+        # Read from the session cookie: current_user may need a query, and a handler
+        # that caught a failed flush leaves the database session awaiting rollback
+        user_id = session.get('_user_id')
+        app_logger.log(
+            logging.DEBUG if request.endpoint == 'static' else logging.INFO,
+            f"{request.method} {request.path} {response.status_code} {latency_ms}ms",
+            extra={
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'latency_ms': latency_ms,
+                'user_id': int(user_id) if user_id else None
+            }
+        )
+    if g.get('request_id'):
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
 @app.before_request
 def check_session_timeout():
     """Check if session has timed out"""
     # Skip timeout check for login/logout pages and static files
-    exempt_endpoints = ['login', 'logout', 'static', 'health_check']
+    exempt_endpoints = ['login', 'logout', 'static', 'health_check', 'metrics']
     
     if request.endpoint in exempt_endpoints or request.endpoint is None:
         return
@@ -590,6 +933,7 @@ def generate_project_id(start_date=None, end_date=None):
 # Create tables when app starts
 with app.app_context():
     db.create_all()
+    create_search_index()
     
     # Clean up old temporary import files on startup
     try:
@@ -606,11 +950,11 @@ with app.app_context():
                 if current_time - os.path.getmtime(temp_file) > 3600:  # 1 hour
                     try:
                         os.remove(temp_file)
-                        print(f"Cleaned up old temp file: {temp_file}")
+                        app_logger.info(f"Cleaned up old temp file: {temp_file}")
                     except:
                         pass
     except Exception as e:
-        print(f"Warning: Could not clean up temp files: {e}")
+        app_logger.warning(f"Could not clean up temp files: {e}")
 
 @app.route('/')
 def home():
@@ -926,40 +1270,43 @@ def export_projects_csv():
     writer.writerow(header)
     
     # Write project data
-    for project in projects:
-        if current_user.can_view_budget():
-            row = [
-                project.project_id or '',
-                project.title or '',
-                project.description or '',
-                project.category or '',
-                project.theme or '',
-                project.principal_investigator or '',
-                project.team_members or '',
-                project.start_date.strftime('%Y-%m-%d') if project.start_date else '',
-                project.end_date.strftime('%Y-%m-%d') if project.end_date else '',
-                project.status or '',
-                f'{project.budget:.2f}' if project.budget else '',
-                project.currency or 'Rs',
-                project.funding_source or '',
-                project.created_at.strftime('%Y-%m-%d %H:%M:%S') if project.created_at else ''
-            ]
-        else:
-            row = [
-                project.project_id or '',
-                project.title or '',
-                project.description or '',
-                project.category or '',
-                project.theme or '',
-                project.principal_investigator or '',
-                project.team_members or '',
-                project.start_date.strftime('%Y-%m-%d') if project.start_date else '',
-                project.end_date.strftime('%Y-%m-%d') if project.end_date else '',
-                project.status or '',
-                project.funding_source or '',
-                project.created_at.strftime('%Y-%m-%d %H:%M:%S') if project.created_at else ''
-            ]
-        writer.writerow(row)
+    with timing_span('csv'):
+        for project in projects:
+            if current_user.can_view_budget():
+                row = [
+                    project.project_id or '',
+                    project.title or '',
+                    project.description or '',
+                    project.category or '',
+                    project.theme or '',
+                    project.principal_investigator or '',
+                    project.team_members or '',
+                    project.start_date.strftime('%Y-%m-%d') if project.start_date else '',
+                    project.end_date.strftime('%Y-%m-%d') if project.end_date else '',
+                    project.status or '',
+                    f'{project.budget:.2f}' if project.budget else '',
+                    project.currency or 'Rs',
+                    project.funding_source or '',
+                    project.created_at.strftime('%Y-%m-%d %H:%M:%S') if project.created_at else ''
+                ]
+            else:
+                row = [
+                    project.project_id or '',
+                    project.title or '',
+                    project.description or '',
+                    project.category or '',
+                    project.theme or '',
+                    project.principal_investigator or '',
+                    project.team_members or '',
+                    project.start_date.strftime('%Y-%m-%d') if project.start_date else '',
+                    project.end_date.strftime('%Y-%m-%d') if project.end_date else '',
+                    project.status or '',
+                    project.funding_source or '',
+                    project.created_at.strftime('%Y-%m-%d %H:%M:%S') if project.created_at else ''
+                ]
+            writer.writerow(row)
+    
+    metrics_registry.observe('marga_export_rows', {'export': 'projects_csv'}, len(projects))
     
     # Create response
     output.seek(0)
@@ -1187,8 +1534,43 @@ def add_project():
 @app.route('/projects/<int:id>')
 @login_required
 def view_project(id):
+    # Load team members and documents with their users up front instead of one query per row
+    project = Project.query.options(
+        selectinload(Project.team_memberships).joinedload(ProjectTeamMember.user),
+        selectinload(Project.documents).joinedload(Document.uploader)
+    ).get_or_404(id)
+    return render_template('view_project.html', project=project,
+                         storage=project_usage(project.id),
+                         storage_quota=effective_quota(project, app.config['PROJECT_STORAGE_QUOTA_BYTES']),
+                         format_bytes=format_bytes)
+
+@app.route('/projects/<int:id>/storage-quota', methods=['POST'])
+@login_required
+def set_project_storage_quota(id):
+    """Set a project's document storage quota in MB; blank uses the default and 0 means unlimited"""
+    if not current_user.can_edit_projects():
+        flash('You do not have permission to edit projects.', 'error')
+        return redirect(url_for('view_project', id=id))
+    
     project = Project.query.get_or_404(id)
-    return render_template('view_project.html', project=project)
+    value = request.form.get('quota_mb', '').strip()
+    try:
+        quota_mb = int(value) if value else None
+        if quota_mb is not None and quota_mb < 0:
+            raise ValueError
+    except ValueError:
+        flash('The storage quota must be a whole number of MB.', 'error')
+        return redirect(url_for('view_project', id=id))
+    
+    old_quota = project.storage_quota_bytes
+    project.storage_quota_bytes = quota_mb * 1024 * 1024 if quota_mb is not None else None
+    db.session.commit()
+    log_user_activity('set_storage_quota', 'project', project.project_id, {
+        'old_quota_bytes': old_quota,
+        'new_quota_bytes': project.storage_quota_bytes
+    })
+    flash('Storage quota updated.', 'success')
+    return redirect(url_for('view_project', id=id))
 
 @app.route('/projects/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -1310,6 +1692,7 @@ def delete_project(id):
             'budget': float(project.budget) if project.budget else None
         })
         
+        ProjectStorageUsage.query.filter_by(project_id=project.id).delete()
         db.session.delete(project)
         db.session.commit()
         flash(f'Project "{project_title}" has been deleted successfully.', 'success')
@@ -1372,7 +1755,9 @@ def change_status(id):
 @login_required
 def project_status_history(id):
     """View project status change history"""
-    project = Project.query.get_or_404(id)
+    project = Project.query.options(
+        selectinload(Project.status_history).joinedload(ProjectStatusHistory.user)
+    ).get_or_404(id)
     
     # Check permissions
     if not current_user.can_view_projects():
@@ -1405,58 +1790,41 @@ def bulk_import():
                 preview_mode = 'preview_mode' in request.form
                 skip_duplicates = 'skip_duplicates' in request.form
                 
-                # Process the uploaded file
-                import pandas as pd
-                
                 # Read the file based on extension
-                if file.filename.lower().endswith('.csv'):
-                    df = pd.read_csv(file)
-                else:
-                    df = pd.read_excel(file)
+                with timing_span('parse'):
+                    df = read_import_file(file, file.filename)
                 
                 # Validate bulk import data first
-                validation_issues = validate_bulk_import_data(df)
+                with timing_span('validate'):
+                    validation_issues = validate_bulk_import_data(df)
                 if validation_issues:
                     for issue in validation_issues:
                         flash(issue, 'error')
                     return render_template('bulk_import.html')
                 
                 # Process and validate data
-                processed_projects = process_import_data(df, skip_duplicates)
-                print(f"DEBUG: Processed {len(processed_projects)} projects from import file")
+                with timing_span('process'):
+                    processed_projects = process_import_data(df, skip_duplicates)
+                import_logger.debug(f"Processed {len(processed_projects)} projects from import file")
+                metrics_registry.observe('marga_bulk_import_rows', {'stage': 'parsed'}, len(df))
+                metrics_registry.observe('marga_bulk_import_rows', {'stage': 'processed'}, len(processed_projects))
                 
                 if preview_mode:
                     # Instead of storing full data in session, store a temporary file
-                    import tempfile
-                    import pickle
-                    import uuid
-                    
-                    # Generate unique identifier for this import
-                    import_id = str(uuid.uuid4())
-                    
-                    # Create temporary file to store import data
-                    temp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp')
-                    if not os.path.exists(temp_dir):
-                        os.makedirs(temp_dir)
-                    
-                    temp_file = os.path.join(temp_dir, f'import_{import_id}.pkl')
-                    
-                    # Serialize projects to temporary file
-                    serialized_data = [serialize_project_for_session(proj) for proj in processed_projects]
-                    with open(temp_file, 'wb') as f:
-                        pickle.dump(serialized_data, f)
+                    with timing_span('stage'):
+                        import_id = stage_import_preview(processed_projects)
                     
                     # Store only the import ID in session (much smaller)
                     session['import_id'] = import_id
                     session.permanent = True
                     
-                    print(f"DEBUG: Stored import data in temp file: {temp_file}")
-                    print(f"DEBUG: Session now contains import_id: {import_id}")
+                    import_logger.debug(f"Session now contains import_id: {import_id}")
                     
                     return render_template('bulk_import.html', preview_data=processed_projects)
                 else:
                     # Direct import
-                    results = import_projects_to_db(processed_projects)
+                    with timing_span('import'):
+                        results = import_projects_to_db(processed_projects)
                     return render_template('bulk_import.html', import_results=results)
                     
             except Exception as e:
@@ -1477,55 +1845,35 @@ def confirm_import():
         return redirect(url_for('projects'))
     
     # Debug: Check session contents
-    print(f"DEBUG: Session keys: {list(session.keys())}")
-    print(f"DEBUG: 'import_id' in session: {'import_id' in session}")
+    import_logger.debug(f"Session keys: {list(session.keys())}")
+    import_logger.debug(f"'import_id' in session: {'import_id' in session}")
     
     if 'import_id' not in session:
         flash('No import data found. Please upload a file first.', 'error')
-        print("DEBUG: No import_id in session - redirecting to bulk_import")
+        import_logger.debug("No import_id in session - redirecting to bulk_import")
         return redirect(url_for('bulk_import'))
     
     try:
         # Get import ID from session
         import_id = session.pop('import_id')
-        print(f"DEBUG: Retrieved import_id from session: {import_id}")
+        import_logger.debug(f"Retrieved import_id from session: {import_id}")
         
         # Load data from temporary file
-        import pickle
-        temp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp')
-        temp_file = os.path.join(temp_dir, f'import_{import_id}.pkl')
+        with timing_span('stage'):
+            processed_projects = load_import_preview(import_id)
         
-        if not os.path.exists(temp_file):
+        if processed_projects is None:
             flash('Import data not found. Please upload the file again.', 'error')
-            print(f"DEBUG: Temp file not found: {temp_file}")
             return redirect(url_for('bulk_import'))
         
-        # Load serialized data
-        with open(temp_file, 'rb') as f:
-            import_data = pickle.load(f)
-        
-        print(f"DEBUG: Loaded {len(import_data)} projects from temp file")
-        
-        # Clean up temporary file
-        try:
-            os.remove(temp_file)
-            print(f"DEBUG: Cleaned up temp file: {temp_file}")
-        except:
-            pass  # Don't fail if cleanup fails
-        
-        # Reconstruct project objects from loaded data
-        processed_projects = [deserialize_project_from_session(proj_data) for proj_data in import_data]
-        print(f"DEBUG: Deserialized {len(processed_projects)} projects")
-        
         # Import to database
-        results = import_projects_to_db(processed_projects)
-        print(f"DEBUG: Import results: {results}")
+        with timing_span('import'):
+            results = import_projects_to_db(processed_projects)
+        import_logger.debug(f"Import results: {results}")
         return render_template('bulk_import.html', import_results=results)
         
     except Exception as e:
-        print(f"DEBUG: Exception in confirm_import: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        import_logger.exception(f"Exception in confirm_import: {str(e)}")
         flash(f'Error during import: {str(e)}', 'error')
         return redirect(url_for('bulk_import'))
 
@@ -1608,6 +1956,56 @@ def deserialize_project_from_session(data):
     
     return project
 
+def import_staging_path(import_id):
+    """Temporary file holding the processed rows of a previewed import"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', f'import_{import_id}.pkl')
+
+def stage_import_preview(processed_projects):
+    """Store processed projects until the preview is confirmed; returns the import id"""
+    import pickle
+    
+    import_id = str(uuid.uuid4())
+    temp_file = import_staging_path(import_id)
+    os.makedirs(os.path.dirname(temp_file), exist_ok=True)
+    
+    serialized_data = [serialize_project_for_session(proj) for proj in processed_projects]
+    with open(temp_file, 'wb') as f:
+        pickle.dump(serialized_data, f)
+    
+    import_logger.debug(f"Stored import data in temp file: {temp_file}")
+    return import_id
+
+def load_import_preview(import_id):
+    """Load and remove a staged import; returns Project objects, or None if the staged file is gone"""
+    import pickle
+    
+    temp_file = import_staging_path(import_id)
+    if not os.path.exists(temp_file):
+        import_logger.debug(f"Temp file not found: {temp_file}")
+        return None
+    
+    with open(temp_file, 'rb') as f:
+        import_data = pickle.load(f)
+    import_logger.debug(f"Loaded {len(import_data)} projects from temp file")
+    
+    # Clean up temporary file
+    try:
+        os.remove(temp_file)
+        import_logger.debug(f"Cleaned up temp file: {temp_file}")
+    except:
+        pass  # Don't fail if cleanup fails
+    
+    # Reconstruct project objects from loaded data
+    processed_projects = [deserialize_project_from_session(proj_data) for proj_data in import_data]
+    import_logger.debug(f"Deserialized {len(processed_projects)} projects")
+    return processed_projects
+
+def read_import_file(file, filename):
+    """Read an uploaded CSV or Excel import file into a DataFrame"""
+    if filename.lower().endswith('.csv'):
+        return pd.read_csv(file)
+    return pd.read_excel(file)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     allowed_extensions = {'xlsx', 'xls', 'csv'}
@@ -1776,15 +2174,18 @@ def check_project_duplicate(title, start_date_str, end_date_str):
     new_start_date = None
     new_end_date = None
     
+    # Unparseable values ('TBD', 'n/a') become NaT and are treated as missing dates
     if start_date_str:
         try:
-            new_start_date = pd.to_datetime(start_date_str).date()
+            parsed = pd.to_datetime(start_date_str)
+            new_start_date = parsed.date() if pd.notna(parsed) else None
         except:
             pass
     
     if end_date_str:
         try:
-            new_end_date = pd.to_datetime(end_date_str).date()
+            parsed = pd.to_datetime(end_date_str)
+            new_end_date = parsed.date() if pd.notna(parsed) else None
         except:
             pass
     
@@ -1855,7 +2256,7 @@ def normalize_status_value(status_value):
             return value
     
     # If no match found, default to Active
-    print(f"Warning: Unknown status '{status_str}' found in import, defaulting to 'Active'")
+    import_logger.warning(f"Unknown status '{status_str}' found in import, defaulting to 'Active'")
     return 'Active'
 
 def process_import_data(df, skip_duplicates=False):
@@ -1941,7 +2342,7 @@ def process_import_data(df, skip_duplicates=False):
             processed_projects.append(project)
             
         except Exception as e:
-            print(f"Error processing row {index}: {e}")
+            import_logger.warning(f"Error processing row {index}: {e}")
             continue
     
     # Generate unique project IDs for the entire batch
@@ -2011,6 +2412,10 @@ def import_projects_to_db(projects):
             results['error_count'] += 1
             results['errors'].append(f"Project '{project.title}': {str(e)}")
     
+    metrics_registry.observe('marga_bulk_import_rows', {'stage': 'imported'}, results['success_count'])
+    metrics_registry.observe('marga_bulk_import_rows', {'stage': 'skipped'}, results['skipped_count'])
+    metrics_registry.observe('marga_bulk_import_rows', {'stage': 'failed'}, results['error_count'])
+    
     return results
 
 @app.route('/users', methods=['GET', 'POST'])
@@ -2170,7 +2575,7 @@ def backup_system():
         return redirect(url_for('dashboard'))
     
     # Get backup directory info
-    backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+    backup_dir = app.config['BACKUP_DIR']
     if not os.path.exists(backup_dir):
         os.makedirs(backup_dir)
     
@@ -2198,7 +2603,9 @@ def backup_system():
     return render_template('backup_system.html', 
                          backups=backups, 
                          project_count=project_count, 
-                         user_count=user_count)
+                         user_count=user_count,
+                         project_storage=usage_by_project(app.config['PROJECT_STORAGE_QUOTA_BYTES'], limit=20),
+                         format_bytes=format_bytes)
 
 @app.route('/admin/backup/create', methods=['POST'])
 @login_required
@@ -2212,7 +2619,7 @@ def create_backup():
         import shutil
         from datetime import datetime
         
-        backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+        backup_dir = app.config['BACKUP_DIR']
         if not os.path.exists(backup_dir):
             os.makedirs(backup_dir)
         
@@ -2256,7 +2663,7 @@ def download_backup(filename):
         return redirect(url_for('dashboard'))
     
     try:
-        backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+        backup_dir = app.config['BACKUP_DIR']
         file_path = os.path.join(backup_dir, filename)
         
         # Security check - ensure file is in backup directory
@@ -2264,9 +2671,12 @@ def download_backup(filename):
             flash('Backup file not found.', 'error')
             return redirect(url_for('backup_system'))
         
-        from flask import send_file
-        return send_file(file_path, as_attachment=True)
+        response, _ = serve_file(file_path, app.config['FILE_SERVING_MODE'], app.config['X_ACCEL_LOCATIONS'],
+                                 as_attachment=True)
+        return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         flash(f'Error downloading backup: {str(e)}', 'error')
         return redirect(url_for('backup_system'))
@@ -2282,7 +2692,7 @@ def restore_backup(filename):
     try:
         import shutil
         
-        backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+        backup_dir = app.config['BACKUP_DIR']
         backup_path = os.path.join(backup_dir, filename)
         
         # Security check
@@ -2323,7 +2733,7 @@ def delete_backup(filename):
         return redirect(url_for('dashboard'))
     
     try:
-        backup_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backups')
+        backup_dir = app.config['BACKUP_DIR']
         file_path = os.path.join(backup_dir, filename)
         
         # Security check
@@ -2427,7 +2837,7 @@ def error_logs():
     if date_from:
         try:
             date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-            query = query.filter(ErrorLog.occurred_at >= date_from_obj)
+            query = query.filter(db.func.coalesce(ErrorLog.last_seen_at, ErrorLog.occurred_at) >= date_from_obj)
         except ValueError:
             pass
     
@@ -2438,8 +2848,8 @@ def error_logs():
         except ValueError:
             pass
     
-    # Order by most recent first and paginate
-    errors = query.order_by(ErrorLog.occurred_at.desc()).paginate(
+    # Order by most recently seen first and paginate
+    errors = query.order_by(db.func.coalesce(ErrorLog.last_seen_at, ErrorLog.occurred_at).desc()).paginate(
         page=page, per_page=25, error_out=False
     )
     
@@ -2496,32 +2906,23 @@ def audit_logs():
     page = request.args.get('page', 1, type=int)
     
     # Build query
-    query = AuditLog.query
-    
-    if user_filter:
-        query = query.join(User).filter(User.username.ilike(f'%{user_filter}%'))
+    date_from_obj, date_to_obj = parse_audit_date_range(date_from, date_to)
+    query = apply_audit_log_filters(AuditLog.query, user_filter, action_filter, date_from_obj, date_to_obj)
     
-    if action_filter:
-        query = query.filter(AuditLog.action.ilike(f'%{action_filter}%'))
-    
-    if date_from:
-        try:
-            date_from_obj = datetime.strptime(date_from, '%Y-%m-%d')
-            query = query.filter(AuditLog.timestamp >= date_from_obj)
-        except ValueError:
-            pass
+    # Order by most recent first and paginate
+    query = query.order_by(AuditLog.timestamp.desc())
     
-    if date_to:
-        try:
-            date_to_obj = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
-            query = query.filter(AuditLog.timestamp < date_to_obj)
-        except ValueError:
-            pass
+    # Include archived months when the requested date range reaches back into them
+    archive = AuditArchive(app.config['AUDIT_ARCHIVE_DIR'])
+    archived_months = []
+    if date_from_obj and archive.archived_before and date_from_obj < archive.archived_before:
+        archived_months = archive.months_in_range(date_from_obj, date_to_obj)
     
-    # Order by most recent first and paginate
-    logs = query.order_by(AuditLog.timestamp.desc()).paginate(
-        page=page, per_page=50, error_out=False
-    )
+    if archived_months:
+        row_filter = AuditArchiveFilter(user_filter, action_filter, date_from_obj, date_to_obj)
+        logs = paginate_with_archive(query, archive, row_filter, archived_months, max(page, 1), 50)
+    else:
+        logs = query.paginate(page=page, per_page=50, error_out=False)
     
     # Get available actions for filter dropdown
     available_actions = db.session.query(AuditLog.action.distinct()).all()
@@ -2530,6 +2931,8 @@ def audit_logs():
     return render_template('audit_logs.html', 
                          logs=logs, 
                          available_actions=available_actions,
+                         archived_before=archive.archived_before,
+                         archived_months=archived_months,
                          filters={
                              'user': user_filter,
                              'action': action_filter,
@@ -2537,6 +2940,381 @@ def audit_logs():
                              'date_to': date_to
                          })
 
+@app.route('/audit-logs/export')
+@login_required
+def export_audit_logs():
+    """Stream audit logs as CSV or NDJSON using the audit viewer filters"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Administrator privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ['csv', 'ndjson']:
+        flash('Invalid export format. Choose CSV or NDJSON.', 'error')
+        return redirect(url_for('audit_logs'))
+    
+    filters = {
+        'user_filter': request.args.get('user', ''),
+        'action_filter': request.args.get('action', ''),
+        'date_from': request.args.get('date_from', ''),
+        'date_to': request.args.get('date_to', '')
+    }
+    
+    log_user_activity('export_audit_logs', 'system', None, {
+        'format': export_format,
+        'filters': filters
+    })
+    
+    rows = count_rows(
+        metrics_registry, 'marga_export_rows', {'export': f'audit_logs_{export_format}'},
+        iter_audit_export_rows(batch_size=app.config['AUDIT_EXPORT_BATCH_SIZE'], **filters)
+    )
+    filename = f'marga_audit_logs_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{"ndjson" if export_format == "ndjson" else "csv"}'
+    
+    return Response(
+        stream_with_context(iter_audit_export_lines(rows, export_format)),
+        mimetype='application/x-ndjson' if export_format == 'ndjson' else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/activity')
+@login_required
+def activity_summary():
+    """User activity summary built from the daily rollup table (admin only)"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Administrator privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    try:
+        date_from, date_to, user_id = parse_activity_filters(request.args)
+    except ValueError:
+        flash('Invalid filter values. Dates must use YYYY-MM-DD.', 'error')
+        return redirect(url_for('activity_summary'))
+    
+    per_user_action = summarize_activity(date_from, date_to, user_id, group_by=('user_id', 'action'))
+    per_day = summarize_activity(date_from, date_to, user_id, group_by=('day',))
+    
+    # Pivot into one row per user with a column per action (most frequent actions first)
+    action_totals = {}
+    user_rows = {}
+    for row in per_user_action:
+        action_totals[row['action']] = action_totals.get(row['action'], 0) + row['count']
+        user_row = user_rows.setdefault(row['user_id'], {'user_id': row['user_id'], 'actions': {}, 'total': 0})
+        user_row['actions'][row['action']] = row['count']
+        user_row['total'] += row['count']
+    actions = sorted(action_totals, key=lambda action: action_totals[action], reverse=True)
+    
+    users = {user.id: user for user in User.query.all()}
+    for user_row in user_rows.values():
+        user_row['user'] = users.get(user_row['user_id'])
+    
+    return render_template('activity_summary.html',
+                         user_rows=sorted(user_rows.values(), key=lambda row: row['total'], reverse=True),
+                         actions=actions,
+                         action_totals=action_totals,
+                         per_day=per_day,
+                         users=sorted(users.values(), key=lambda user: user.username),
+                         filters={
+                             'date_from': date_from.isoformat(),
+                             'date_to': date_to.isoformat(),
+                             'user_id': user_id if user_id is not None else ''
+                         })
+
+@app.route('/api/activity/summary')
+@login_required
+def api_activity_summary():
+    """JSON activity counts from the daily rollup table"""
+    if not current_user.can_edit_projects():
+        return {'status': 'error', 'message': 'Administrator privileges required'}, 403
+    
+    try:
+        date_from, date_to, user_id = parse_activity_filters(request.args)
+        action = request.args.get('action', '').strip() or None
+        
+        group_by = [column for column in request.args.get('group_by', 'day,user_id,action').split(',') if column]
+        invalid = [column for column in group_by if column not in ROLLUP_KEY_COLUMNS]
+        if invalid or not group_by:
+            return {
+                'status': 'error',
+                'message': f"group_by must be a comma-separated subset of: {', '.join(ROLLUP_KEY_COLUMNS)}"
+            }, 400
+        
+        results = summarize_activity(date_from, date_to, user_id, action, group_by=tuple(group_by))
+        for row in results:
+            if 'day' in row:
+                row['day'] = row['day'].isoformat()
+        
+        return {
+            'status': 'success',
+            'date_from': date_from.isoformat(),
+            'date_to': date_to.isoformat(),
+            'group_by': group_by,
+            'count': len(results),
+            'results': results
+        }, 200
+        
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}, 400
+
+@app.route('/admin/sql-profiler')
+@login_required
+def sql_profiler():
+    """Endpoints with the most SQL per request, probable N+1 patterns and slow queries"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    return render_template('sql_profiler.html',
+                         enabled=app.config['SQL_PROFILER_ENABLED'],
+                         endpoints=sql_profile_store.worst_endpoints(),
+                         findings=sql_profile_store.recent_findings(),
+                         started_at=datetime.fromtimestamp(sql_profile_store.started_at),
+                         slow_query_ms=app.config['SQL_SLOW_QUERY_MS'],
+                         n_plus_one_threshold=app.config['SQL_N_PLUS_ONE_THRESHOLD'])
+
+@app.route('/admin/sql-profiler/reset', methods=['POST'])
+@login_required
+def reset_sql_profiler():
+    """Clear the collected SQL profile"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    sql_profile_store.reset()
+    flash('SQL profile cleared.', 'success')
+    return redirect(url_for('sql_profiler'))
+
+@app.route('/admin/profiler')
+@login_required
+def request_profiler():
+    """Arm the request profiler and list stored profiles"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    endpoints = sorted({rule.endpoint for rule in app.url_map.iter_rules() if rule.endpoint != 'static'})
+    return render_template('request_profiler.html',
+                         endpoints=endpoints,
+                         modes=PROFILE_MODES,
+                         armed=profiler_control.armed(),
+                         profiles=list_profiles(app.config['PROFILE_DIR']))
+
+@app.route('/admin/profiler/arm', methods=['POST'])
+@login_required
+def arm_request_profiler():
+    """Profile the next N requests to an endpoint"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    endpoint = request.form.get('endpoint', '')
+    mode = request.form.get('mode', 'sample')
+    try:
+        count = int(request.form.get('count', 1))
+    except ValueError:
+        count = 0
+    
+    if endpoint not in app.view_functions or endpoint == 'static':
+        flash('Unknown endpoint.', 'error')
+    elif mode not in PROFILE_MODES:
+        flash('Invalid profiler mode.', 'error')
+    elif not 1 <= count <= 100:
+        flash('Number of requests must be between 1 and 100.', 'error')
+    else:
+        profiler_control.arm(endpoint, count, mode)
+        log_user_activity('arm_profiler', 'system', None, {'endpoint': endpoint, 'count': count, 'mode': mode})
+        flash(f'Profiling the next {count} request(s) to {endpoint}.', 'success')
+    
+    return redirect(url_for('request_profiler'))
+
+@app.route('/admin/profiler/disarm', methods=['POST'])
+@login_required
+def disarm_request_profiler():
+    """Stop profiling an endpoint"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    profiler_control.disarm(request.form.get('endpoint', ''))
+    flash('Profiler disarmed.', 'success')
+    return redirect(url_for('request_profiler'))
+
+@app.route('/admin/profiler/token', methods=['POST'])
+@login_required
+def create_profile_token():
+    """Issue a signed header that profiles any request carrying it until it expires"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    lifetime = app.config['PROFILE_TOKEN_LIFETIME_MINUTES']
+    token = sign_profile_token(app.config['SECRET_KEY'], int(time.time()) + lifetime * 60)
+    log_user_activity('create_profile_token', 'system', None, {'lifetime_minutes': lifetime})
+    flash(f'X-Profile-Token: {token} (valid for {lifetime} minutes; add X-Profile-Mode: cprofile for cProfile output)', 'info')
+    return redirect(url_for('request_profiler'))
+
+@app.route('/admin/profiler/download/<filename>')
+@login_required
+def download_profile(filename):
+    """Download a stored profile"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    profile_dir = app.config['PROFILE_DIR']
+    file_path = os.path.join(profile_dir, filename)
+    
+    # Security check - ensure file is a profile in the profile directory
+    if os.path.dirname(file_path) != profile_dir \
+            or filename not in {profile['filename'] for profile in list_profiles(profile_dir)}:
+        flash('Profile not found.', 'error')
+        return redirect(url_for('request_profiler'))
+    
+    return send_file(file_path, as_attachment=True,
+                     mimetype='text/plain' if filename.endswith('.folded') else 'application/octet-stream')
+
+@app.route('/admin/profiler/delete/<filename>', methods=['POST'])
+@login_required
+def delete_profile(filename):
+    """Delete a stored profile"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    profile_dir = app.config['PROFILE_DIR']
+    file_path = os.path.join(profile_dir, filename)
+    
+    if os.path.dirname(file_path) != profile_dir \
+            or filename not in {profile['filename'] for profile in list_profiles(profile_dir)}:
+        flash('Profile not found.', 'error')
+        return redirect(url_for('request_profiler'))
+    
+    os.remove(file_path)
+    flash(f'Profile {filename} deleted.', 'success')
+    return redirect(url_for('request_profiler'))
+
+@app.route('/admin/storage')
+@login_required
+def storage_usage():
+    """Document storage: logical size against bytes on disk after deduplication and compression"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    return render_template('storage_usage.html',
+                         totals=storage_totals(),
+                         compression=app.config['DOCUMENT_COMPRESSION'],
+                         format_bytes=format_bytes)
+
+@app.route('/admin/memory')
+@login_required
+def memory_diagnostics():
+    """Memory usage of this worker, tracemalloc snapshots and import/export peaks"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    memory_dir = app.config['MEMORY_DIR']
+    key_type = request.args.get('group_by', 'lineno')
+    if key_type not in ['lineno', 'filename', 'traceback']:
+        key_type = 'lineno'
+    older = request.args.get('older', '')
+    newer = request.args.get('newer', '')
+    
+    report = None
+    report_title = None
+    try:
+        if older and newer:
+            report = diff_snapshots(memory_dir, older, newer, key_type)
+            report_title = f'Growth from {older} to {newer}'
+        elif newer:
+            report = top_allocations(memory_dir, newer, key_type)
+            report_title = f'Largest allocations in {newer}'
+    except ValueError as e:
+        flash(str(e), 'error')
+    
+    endpoint_summary, recent_requests = memory_tracker.summary()
+    traced_current, traced_peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (None, None)
+    
+    return render_template('memory_diagnostics.html',
+                         pid=os.getpid(),
+                         tracing=tracemalloc.is_tracing(),
+                         rss=current_rss(),
+                         traced_current=traced_current,
+                         traced_peak=traced_peak,
+                         snapshots=list_snapshots(memory_dir),
+                         report=report,
+                         report_title=report_title,
+                         older=older,
+                         newer=newer,
+                         group_by=key_type,
+                         endpoint_summary=endpoint_summary,
+                         recent_requests=recent_requests,
+                         format_bytes=format_bytes)
+
+@app.route('/admin/memory/tracing', methods=['POST'])
+@login_required
+def toggle_memory_tracing():
+    """Start or stop tracemalloc in this worker"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if request.form.get('action') == 'stop':
+        tracemalloc.stop()
+        flash('Memory tracing stopped.', 'success')
+    elif not tracemalloc.is_tracing():
+        tracemalloc.start(app.config['MEMORY_TRACE_FRAMES'])
+        flash('Memory tracing started. Allocations made from now on are tracked.', 'success')
+    
+    log_user_activity('toggle_memory_tracing', 'system', None, {'tracing': tracemalloc.is_tracing(), 'pid': os.getpid()})
+    return redirect(url_for('memory_diagnostics'))
+
+@app.route('/admin/memory/snapshot', methods=['POST'])
+@login_required
+def create_memory_snapshot():
+    """Store a tracemalloc snapshot of this worker"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    try:
+        filename = take_snapshot(app.config['MEMORY_DIR'], request.form.get('label', ''))
+        flash(f'Snapshot {filename} saved.', 'success')
+    except RuntimeError as e:
+        flash(str(e), 'error')
+    
+    return redirect(url_for('memory_diagnostics'))
+
+@app.route('/admin/memory/snapshot/delete/<filename>', methods=['POST'])
+@login_required
+def delete_memory_snapshot(filename):
+    """Delete a stored snapshot"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Full access privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    memory_dir = app.config['MEMORY_DIR']
+    if filename not in {snapshot['filename'] for snapshot in list_snapshots(memory_dir)}:
+        flash('Snapshot not found.', 'error')
+        return redirect(url_for('memory_diagnostics'))
+    
+    os.remove(os.path.join(memory_dir, filename))
+    flash(f'Snapshot {filename} deleted.', 'success')
+    return redirect(url_for('memory_diagnostics'))
+
+def parse_activity_filters(args):
+    """Parse activity date range (defaults to the last 30 days) and user filters"""
+    today = datetime.utcnow().date()
+    date_from_str = args.get('date_from', '').strip()
+    date_to_str = args.get('date_to', '').strip()
+    
+    date_to = datetime.strptime(date_to_str, '%Y-%m-%d').date() if date_to_str else today
+    date_from = datetime.strptime(date_from_str, '%Y-%m-%d').date() if date_from_str else date_to - timedelta(days=29)
+    
+    user_id = args.get('user_id', '').strip()
+    return date_from, date_to, int(user_id) if user_id else None
+
 @app.route('/api/search/projects')
 @login_required
 def api_search_projects():
@@ -2610,12 +3388,158 @@ def api_search_projects():
             'message': str(e)
         }, 500
 
+@app.route('/documents/search')
+@login_required
+def document_search():
+    """Full-text search over the contents of uploaded documents"""
+    query = request.args.get('q', '').strip()
+    document_type = request.args.get('type', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = 20
+    
+    results, total = search_documents(query, document_type=document_type if document_type in DOCUMENT_TYPES else None,
+                                      limit=per_page, offset=(page - 1) * per_page)
+    return render_template('document_search.html',
+                         query=query,
+                         document_type=document_type,
+                         document_types=DOCUMENT_TYPES,
+                         results=results,
+                         total=total,
+                         page=page,
+                         pages=(total + per_page - 1) // per_page)
+
+@app.route('/api/search/documents')
+@login_required
+def api_search_documents():
+    """API endpoint for document full-text search with JSON response"""
+    try:
+        query = request.args.get('q', '').strip()
+        project_id = request.args.get('project_id', type=int)
+        document_type = request.args.get('type', '')
+        limit = min(int(request.args.get('limit', 10)), 50)  # Max 50 results
+        
+        results, total = search_documents(query, project_id=project_id,
+                                          document_type=document_type if document_type in DOCUMENT_TYPES else None,
+                                          limit=limit)
+        return {
+            'status': 'success',
+            'query': query,
+            'count': len(results),
+            'total': total,
+            'results': [{
+                'id': document.id,
+                'filename': document.original_filename,
+                'document_type': document.document_type,
+                'file_type': document.file_type,
+                'project_id': document.project_id,
+                'project_title': document.project.title,
+                'uploaded_at': document.uploaded_at.isoformat(),
+                'snippet': snippet,
+                'url': url_for('download_document', document_id=document.id)
+            } for document, snippet in results]
+        }, 200
+        
+    except Exception as e:
+        return {
+            'status': 'error',
+            'message': str(e)
+        }, 500
+
+@app.route('/documents')
+@login_required
+def document_catalog():
+    """Browse documents across all projects (admin only)"""
+    if not current_user.can_edit_projects():
+        flash('Access denied. Administrator privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    filters = parse_catalog_filters(request.args, DOCUMENT_TYPES)
+    cursor = request.args.get('cursor', '')
+    try:
+        documents, next_cursor = catalog_page(filters, cursor or None, CATALOG_PAGE_SIZE)
+    except InvalidCursor:
+        flash('That page link is no longer valid. Showing the newest documents.', 'warning')
+        return redirect(url_for('document_catalog', **{k: v for k, v in filters.items() if v}))
+    total_count, total_bytes = catalog_totals(filters)
+    
+    return render_template('document_catalog.html',
+                         documents=documents,
+                         next_cursor=next_cursor,
+                         first_page=not cursor,
+                         total_count=total_count,
+                         total_bytes=total_bytes,
+                         document_types=DOCUMENT_TYPES,
+                         filters=filters,
+                         active_filters={k: v for k, v in filters.items() if v},
+                         format_bytes=format_bytes)
+
+@app.route('/api/storage/projects')
+@login_required
+def api_project_storage():
+    """Document storage per project, largest first, as JSON (admin only)"""
+    if not current_user.can_edit_projects():
+        return {'status': 'error', 'message': 'Access denied. Administrator privileges required.'}, 403
+    
+    default_quota = app.config['PROJECT_STORAGE_QUOTA_BYTES']
+    projects = usage_by_project(default_quota, limit=request.args.get('limit', type=int))
+    return {'status': 'success', 'default_quota_bytes': default_quota or None, 'projects': projects}, 200
+
+@app.route('/api/projects/<int:id>/storage')
+@login_required
+def api_project_storage_detail(id):
+    """Document count and bytes of one project per document type, with its quota, as JSON"""
+    project = Project.query.get_or_404(id)
+    usage = project_usage(project.id)
+    quota = effective_quota(project, app.config['PROJECT_STORAGE_QUOTA_BYTES'])
+    return {'status': 'success', 'project_id': project.project_id, 'quota_bytes': quota, **usage}, 200
+
+@app.route('/api/documents')
+@login_required
+def api_documents():
+    """Cursor-paginated document catalogue as JSON (admin only)"""
+    if not current_user.can_edit_projects():
+        return {'status': 'error', 'message': 'Access denied. Administrator privileges required.'}, 403
+    
+    filters = parse_catalog_filters(request.args, DOCUMENT_TYPES)
+    cursor = request.args.get('cursor', '')
+    limit = request.args.get('limit', CATALOG_PAGE_SIZE, type=int)
+    try:
+        documents, next_cursor = catalog_page(filters, cursor or None, limit)
+    except InvalidCursor as e:
+        return {'status': 'error', 'message': str(e)}, 400
+    
+    result = {
+        'status': 'success',
+        'count': len(documents),
+        'next_cursor': next_cursor,
+        'documents': [{
+            'id': document.id,
+            'filename': document.original_filename,
+            'document_type': document.document_type,
+            'file_type': document.file_type,
+            'file_size': document.file_size,
+            'content_hash': document.content_hash,
+            'project_id': document.project_id,
+            'project_code': document.project.project_id,
+            'project_title': document.project.title,
+            'uploaded_by': document.uploader.username,
+            'uploaded_at': document.uploaded_at.isoformat(),
+            'url': url_for('download_document', document_id=document.id)
+        } for document in documents]
+    }
+    # Totals only on the first page; later pages of the same listing don't need them recounted
+    if not cursor:
+        result['total_count'], result['total_bytes'] = catalog_totals(filters)
+    return result, 200
+
 # Document Management Routes
 @app.route('/project/<int:project_id>/documents')
 @login_required
 def project_documents(project_id):
     """View all documents for a project"""
-    project = Project.query.get_or_404(project_id)
+    project = Project.query.options(
+        selectinload(Project.documents).joinedload(Document.uploader)
+    ).get_or_404(project_id)
     
     # Check permissions
     if not current_user.can_view_projects():
@@ -2634,6 +3558,136 @@ def project_documents(project_id):
                          project=project, 
                          documents_by_type=documents_by_type)
 
+def validate_document_upload(filename, document_type):
+    """Return an error message for an unacceptable upload, or None"""
+    if not filename or '.' not in filename or filename.rsplit('.', 1)[1].lower() not in DOCUMENT_EXTENSIONS:
+        return 'Invalid file type. Allowed types: PDF, Word, Excel, PowerPoint, Text, Images.'
+    if not document_type or document_type not in DOCUMENT_TYPES:
+        return 'Please select a valid document type.'
+    return None
+
+def save_received_document(project_id, temp_path, content_hash, file_size, original_filename, document_type, description):
+    """
+    Store a received and hashed upload and create its Document row. The temp
+    file is consumed either way. Raises QuotaExceeded when the project has no
+    room for the file.
+    """
+    file_type = original_filename.rsplit('.', 1)[1].lower()
+    quota = effective_quota(db.session.get(Project, project_id), app.config['PROJECT_STORAGE_QUOTA_BYTES'])
+    try:
+        # Refused before anything is stored; checked again below once the file is counted
+        check_project_quota(project_id, quota, file_size)
+        # Compressing or uploading a large file outlasts the database busy timeout, so the
+        # blob is stored before the transaction below takes the write lock. A duplicate's
+        # temp file is kept until the document has committed (see restore_blob)
+        stored = document_store.place(temp_path, content_hash, file_type, discard_duplicate=False)
+    except Exception:
+        document_store.discard(temp_path)
+        raise
+    if stored.created:
+        temp_path = None
+    
+    try:
+        # Counted before the check: the counter update takes the write lock, so
+        # concurrent uploads to the same project can't both slip under the quota
+        record_document_usage(project_id, document_type, file_size)
+        check_project_quota(project_id, quota)
+        
+        # Identical content already uploaded (to any project) is stored once and shared
+        add_blob_reference(content_hash, file_size)
+        record_blob_storage(content_hash, stored)
+        
+        document = Document(
+            project_id=project_id,
+            filename=content_hash,
+            original_filename=original_filename,
+            file_path=stored.storage_key,
+            file_type=file_type,
+            file_size=file_size,
+            uploaded_by=current_user.id,
+            document_type=document_type,
+            description=description,
+            content_hash=content_hash
+        )
+        db.session.add(document)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # A new blob stays: a concurrent upload of the same content may have found it and be
+        # about to commit. Unclaimed, check_document_storage.py reports it as an orphan
+        if temp_path:
+            document_store.discard(temp_path)
+        raise
+    
+    if temp_path:
+        try:
+            if restore_blob(document_store, content_hash, temp_path, file_type):
+                app_logger.warning(f"Restored blob {content_hash} released by a concurrent delete")
+        except Exception as e:
+            db.session.rollback()
+            app_logger.error(f"Could not check blob {content_hash} after upload: {e}")
+    
+    log_user_activity('upload_document', 'document', str(document.id), {
+        'project_id': project_id,
+        'filename': original_filename,
+        'document_type': document_type
+    })
+    
+    # Text extraction for search runs in the background; failing to queue it must not fail the upload
+    try:
+        document_indexer.submit(document)
+    except Exception as e:
+        app_logger.warning(f"Could not queue text extraction for document {document.id}: {e}")
+    try:
+        preview_generator.submit_document(document)
+    except Exception as e:
+        app_logger.warning(f"Could not queue previews for document {document.id}: {e}")
+    return document
+
+@app.route('/project/<int:project_id>/documents/download-all')
+@login_required
+def download_project_documents(project_id):
+    """Download all documents of a project (optionally one document type) as a streamed ZIP"""
+    project = Project.query.get_or_404(project_id)
+    
+    if not current_user.can_view_projects():
+        flash('You do not have permission to download documents.', 'error')
+        return redirect(url_for('dashboard'))
+    
+    document_type = request.args.get('type', '')
+    query = db.session.query(Document.original_filename, Document.document_type, Document.file_path,
+                             Document.file_size, Document.uploaded_at).filter(Document.project_id == project_id)
+    if document_type in DOCUMENT_TYPES:
+        query = query.filter(Document.document_type == document_type)
+    
+    # One folder per document type; repeated file names are numbered
+    entries, used_names, missing = [], set(), 0
+    for original_filename, doc_type, file_path, file_size, uploaded_at in query.order_by(Document.document_type, Document.uploaded_at):
+        if not document_store.exists(file_path):
+            missing += 1
+            continue
+        arcname = unique_archive_name(f'{doc_type}/{os.path.basename(original_filename)}', used_names)
+        entries.append((arcname, file_path, file_size, uploaded_at))
+    
+    if not entries:
+        flash('There are no documents to download.', 'warning')
+        return redirect(url_for('project_documents', project_id=project_id))
+    if missing:
+        app_logger.warning(f"Project {project_id} ZIP download skipped {missing} documents with missing files")
+    
+    log_user_activity('download_project_documents', 'project', str(project_id), {
+        'document_type': document_type or 'all',
+        'document_count': len(entries),
+        'missing_count': missing
+    })
+    
+    suffix = f'_{document_type}s' if document_type in DOCUMENT_TYPES else '_documents'
+    return Response(
+        stream_with_context(stream_zip(entries, document_store.open)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={project.project_id}{suffix}.zip'}
+    )
+
 @app.route('/project/<int:project_id>/documents/upload', methods=['GET', 'POST'])
 @login_required
 def upload_document(project_id):
@@ -2646,7 +3700,16 @@ def upload_document(project_id):
         return redirect(url_for('view_project', id=project_id))
     
     if request.method == 'POST':
-        # Check if file was uploaded
+        # Turned away before the body is read when even its smallest possible file can't fit
+        quota = effective_quota(project, app.config['PROJECT_STORAGE_QUOTA_BYTES'])
+        try:
+            check_project_quota(project_id, quota, (request.content_length or 0) - FORM_OVERHEAD_BYTES)
+        except QuotaExceeded as e:
+            flash(str(e), 'error')
+            return redirect(request.url)
+        
+        # The file part is written to the document store's temp directory and
+        # hashed while the form is parsed (see init_document_uploads)
         if 'document' not in request.files:
             flash('No file selected.', 'error')
             return redirect(request.url)
@@ -2656,67 +3719,140 @@ def upload_document(project_id):
             flash('No file selected.', 'error')
             return redirect(request.url)
         
-        # Validate file
-        allowed_extensions = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'jpg', 'jpeg', 'png', 'gif'}
-        if not file or '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
-            flash('Invalid file type. Allowed types: PDF, Word, Excel, PowerPoint, Text, Images.', 'error')
-            return redirect(request.url)
-        
         # Get form data
         document_type = request.form.get('document_type')
         description = request.form.get('description', '').strip()
         
-        if not document_type or document_type not in ['contract', 'report', 'deliverable']:
-            flash('Please select a valid document type.', 'error')
+        error = validate_document_upload(file.filename, document_type)
+        if error:
+            flash(error, 'error')
             return redirect(request.url)
         
         try:
-            # Create uploads directory if it doesn't exist
-            uploads_dir = os.path.join(app.root_path, 'uploads', 'documents')
-            os.makedirs(uploads_dir, exist_ok=True)
-            
-            # Generate unique filename
-            import uuid
-            file_extension = file.filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{uuid.uuid4()}.{file_extension}"
-            file_path = os.path.join(uploads_dir, unique_filename)
-            
-            # Save file
-            file.save(file_path)
-            
-            # Create database record
-            document = Document(
-                project_id=project_id,
-                filename=unique_filename,
-                original_filename=file.filename,
-                file_path=file_path,
-                file_type=file_extension,
-                file_size=os.path.getsize(file_path),
-                uploaded_by=current_user.id,
-                document_type=document_type,
-                description=description
-            )
-            
-            db.session.add(document)
-            db.session.commit()
-            
-            # Log activity
-            log_user_activity('upload_document', 'document', str(document.id), {
-                'project_id': project_id,
-                'filename': file.filename,
-                'document_type': document_type
-            })
+            with timing_span('file'):
+                temp_path, content_hash, file_size = document_store.receive(file.stream)
+            save_received_document(project_id, temp_path, content_hash, file_size, file.filename,
+                                   document_type, description)
             
             flash(f'Document "{file.filename}" uploaded successfully.', 'success')
             return redirect(url_for('project_documents', project_id=project_id))
             
+        except QuotaExceeded as e:
+            flash(str(e), 'error')
+            return redirect(request.url)
         except Exception as e:
-            db.session.rollback()
             log_error(e, {'function': 'upload_document', 'project_id': project_id}, current_user)
             flash('Failed to upload document. Please try again.', 'error')
             return redirect(request.url)
     
-    return render_template('upload_document.html', project=project)
+    return render_template('upload_document.html', project=project,
+                         max_upload_bytes=app.config['DOCUMENT_MAX_UPLOAD_BYTES'],
+                         max_chunked_upload_bytes=app.config['DOCUMENT_MAX_CHUNKED_UPLOAD_BYTES'],
+                         chunk_size=app.config['DOCUMENT_UPLOAD_CHUNK_BYTES'],
+                         storage=project_usage(project.id),
+                         storage_quota=effective_quota(project, app.config['PROJECT_STORAGE_QUOTA_BYTES']),
+                         format_bytes=format_bytes)
+
+@app.route('/project/<int:project_id>/documents/uploads', methods=['POST'])
+@login_required
+def create_chunked_upload(project_id):
+    """Start a resumable upload; the file is then sent with PUT requests of Content-Range chunks"""
+    project = Project.query.get_or_404(project_id)
+    if not current_user.can_edit_projects():
+        return {'status': 'error', 'message': 'You do not have permission to upload documents.'}, 403
+    
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename', '')).strip()
+    document_type = data.get('document_type')
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return {'status': 'error', 'message': 'File size is required.'}, 400
+    
+    error = validate_document_upload(filename, document_type)
+    if error:
+        return {'status': 'error', 'message': error}, 400
+    if size <= 0:
+        return {'status': 'error', 'message': 'The file is empty.'}, 400
+    if size > app.config['DOCUMENT_MAX_CHUNKED_UPLOAD_BYTES']:
+        limit_mb = app.config['DOCUMENT_MAX_CHUNKED_UPLOAD_BYTES'] // (1024 * 1024)
+        return {'status': 'error', 'message': f'Documents are limited to {limit_mb} MB.'}, 413
+    try:
+        check_project_quota(project.id, effective_quota(project, app.config['PROJECT_STORAGE_QUOTA_BYTES']), size)
+    except QuotaExceeded as e:
+        return {'status': 'error', 'message': str(e)}, 413
+    
+    upload_id = chunked_uploads.create(size, {
+        'project_id': project.id,
+        'user_id': current_user.id,
+        'filename': filename,
+        'document_type': document_type,
+        'description': str(data.get('description', '')).strip()
+    })
+    return {
+        'status': 'success',
+        'upload_id': upload_id,
+        'chunk_size': app.config['DOCUMENT_UPLOAD_CHUNK_BYTES'],
+        'received': 0,
+        'upload_url': url_for('upload_document_chunk', upload_id=upload_id)
+    }, 201
+
+@app.route('/documents/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def upload_document_chunk(upload_id):
+    """Resumable upload: GET reports bytes received, PUT appends a chunk, DELETE cancels"""
+    upload = chunked_uploads.status(upload_id)
+    if upload is None or upload['user_id'] != current_user.id or not current_user.can_edit_projects():
+        return {'status': 'error', 'message': 'Upload not found or expired.'}, 404
+    
+    if request.method == 'GET':
+        return {'status': 'success', 'received': upload['received'], 'size': upload['size']}
+    
+    if request.method == 'DELETE':
+        chunked_uploads.discard(upload_id)
+        return {'status': 'success'}
+    
+    try:
+        start, end, total = parse_content_range(request.headers.get('Content-Range'))
+        if total != upload['size']:
+            raise UploadRangeError('Content-Range total does not match the declared file size.')
+        if request.content_length is not None and request.content_length != end - start:
+            raise UploadRangeError('Chunk length does not match its Content-Range.')
+        with timing_span('file'):
+            received = chunked_uploads.append(upload_id, start, end, request.stream)
+    except KeyError:
+        return {'status': 'error', 'message': 'Upload not found or expired.'}, 404
+    except UploadRangeError as e:
+        current = chunked_uploads.status(upload_id)
+        return {'status': 'error', 'message': str(e), 'received': current['received'] if current else None}, 409
+    
+    if received < upload['size']:
+        return {'status': 'success', 'received': received, 'size': upload['size']}
+    
+    try:
+        temp_path, content_hash, file_size, metadata = chunked_uploads.complete(upload_id)
+        document = save_received_document(metadata['project_id'], temp_path, content_hash, file_size,
+                                          metadata['filename'], metadata['document_type'], metadata['description'])
+    except KeyError:
+        # A concurrent request for the same final chunk completed the upload first
+        return {'status': 'error', 'message': 'Upload not found or expired.'}, 404
+    except UploadRangeError as e:
+        current = chunked_uploads.status(upload_id)
+        return {'status': 'error', 'message': str(e), 'received': current['received'] if current else None}, 409
+    except QuotaExceeded as e:
+        return {'status': 'error', 'message': str(e)}, 413
+    except Exception as e:
+        log_error(e, {'function': 'upload_document_chunk', 'upload_id': upload_id}, current_user)
+        return {'status': 'error', 'message': 'Failed to store the uploaded document.'}, 500
+    
+    flash(f'Document "{document.original_filename}" uploaded successfully.', 'success')
+    return {
+        'status': 'success',
+        'received': received,
+        'size': upload['size'],
+        'document_id': document.id,
+        'redirect': url_for('project_documents', project_id=document.project_id)
+    }
 
 @app.route('/document/<int:document_id>/download')
 @login_required
@@ -2730,25 +3866,92 @@ def download_document(document_id):
         return redirect(url_for('dashboard'))
     
     try:
-        # Log download activity
-        log_user_activity('download_document', 'document', str(document_id), {
-            'filename': document.original_filename,
-            'project_id': document.project_id
-        })
-        
-        # Send file
-        return send_file(
-            document.file_path,
+        # Send file - Range requests get 206 partial content, and a matching
+        # If-None-Match a 304. Stored content never changes, so its hash is a strong ETag.
+        send_options = dict(
             as_attachment=True,
             download_name=document.original_filename,
-            mimetype=f'application/{document.file_type}' if document.file_type in ['pdf', 'doc', 'docx', 'xls', 'xlsx'] else 'application/octet-stream'
+            mimetype=f'application/{document.file_type}' if document.file_type in ['pdf', 'doc', 'docx', 'xls', 'xlsx'] else 'application/octet-stream',
+            etag=document.content_hash or True,
+            last_modified=document.uploaded_at,
+            max_age=app.config['DOCUMENT_CACHE_MAX_AGE']
         )
+        local_path = document_store.local_path(document.file_path)
+        if local_path is None:
+            # Compressed at rest or in object storage - streamed through the worker, never offloaded
+            response, full_transfer = serve_stream(document_store.open(document.file_path), document.file_size,
+                                                   **send_options)
+        else:
+            response, full_transfer = serve_file(
+                local_path,
+                app.config['FILE_SERVING_MODE'],
+                app.config['X_ACCEL_LOCATIONS'],
+                **send_options
+            )
+        # Browsers may keep documents; shared caches must not
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.accept_ranges = 'bytes'
+        
+        # Log download activity - revalidations and partial (resumed or previewed) ranges are not downloads
+        if full_transfer:
+            log_user_activity('download_document', 'document', str(document_id), {
+                'filename': document.original_filename,
+                'project_id': document.project_id
+            })
+        
+        return response
         
+    except HTTPException:
+        # A Range past the end gets its 416 with Content-Range, e.g. resuming a finished download
+        raise
     except Exception as e:
         log_error(e, {'function': 'download_document', 'document_id': document_id}, current_user)
         flash('Failed to download document.', 'error')
         return redirect(url_for('project_documents', project_id=document.project_id))
 
+def send_document_preview(document_id, kind, mimetype):
+    """
+    Serve a cached preview. One that isn't generated yet is queued and
+    answered with 202 so the page can retry; 404 when there is none.
+    """
+    document = Document.query.get_or_404(document_id)
+    if not current_user.can_view_projects():
+        return Response(status=403)
+    # Plain 404s: pages fall back to the file type icon, so these are expected and not worth logging
+    if not document.content_hash or kind not in preview_kinds(document.file_type):
+        return Response(status=404)
+    
+    path = preview_cache.get(document.content_hash, kind)
+    if path is None:
+        preview_generator.submit(document.content_hash, document.file_path, document.file_type, kind)
+        response = Response(status=202)
+        response.headers['Retry-After'] = '2'
+        response.cache_control.no_store = True
+        return response
+    if os.path.getsize(path) == 0:
+        return Response(status=404)
+    
+    response = send_file(path, mimetype=mimetype, conditional=True,
+                         etag=f'{document.content_hash}-{kind}',
+                         max_age=app.config['PREVIEW_CACHE_MAX_AGE'])
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/document/<int:document_id>/thumbnail')
+@login_required
+def document_thumbnail(document_id):
+    """JPEG thumbnail of an image or Office document"""
+    return send_document_preview(document_id, 'thumbnail', 'image/jpeg')
+
+@app.route('/document/<int:document_id>/preview')
+@login_required
+def document_text_preview(document_id):
+    """Plain-text preview of the start of a document"""
+    return send_document_preview(document_id, 'text', 'text/plain; charset=utf-8')
+
 @app.route('/document/<int:document_id>/delete', methods=['POST'])
 @login_required
 def delete_document(document_id):
@@ -2763,15 +3966,23 @@ def delete_document(document_id):
     try:
         project_id = document.project_id
         filename = document.original_filename
+        content_hash = document.content_hash
         
-        # Delete file from disk
-        if os.path.exists(document.file_path):
-            os.remove(document.file_path)
-        
-        # Delete database record
+        # Delete database record and its search text, releasing its share of the stored file
+        remove_document_text(document_id)
+        record_document_usage(project_id, document.document_type, -document.file_size, count=-1)
         db.session.delete(document)
+        db.session.flush()
+        released_key = release_blob_reference(content_hash) if content_hash else None
         db.session.commit()
         
+        # Files go only after the commit, and only when no other document still uses them
+        if released_key:
+            remove_released_blob(document_store, content_hash, released_key)
+            preview_cache.remove(content_hash)
+        elif not content_hash and os.path.exists(document.file_path):
+            os.remove(document.file_path)
+        
         # Log activity
         log_user_activity('delete_document', 'document', str(document_id), {
             'project_id': project_id,
@@ -2822,6 +4033,17 @@ def session_status():
     except Exception as e:
         return {'status': 'error', 'message': str(e)}, 500
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for all worker processes"""
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        # Route and query statistics are not public: scraping needs a token
+        return Response('Set METRICS_TOKEN to enable /metrics\n', status=404, mimetype='text/plain')
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/health')
 def health_check():
     """Health check endpoint for load balancers and monitoring"""
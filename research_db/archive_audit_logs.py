@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Audit Log Archival Script
+Moves audit log entries older than the retention window into
+compressed monthly archive files and removes them from the database
+"""
+import argparse
+import os
+import sys
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from audit_archive import archive_audit_logs
+
+
+def main():
+    """Run the audit log archival"""
+    parser = argparse.ArgumentParser(description='Archive old audit log entries')
+    parser.add_argument('--days', type=int, default=None,
+                        help='Retention window in days (default: AUDIT_RETENTION_DAYS)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='Rows moved per batch (default: AUDIT_ARCHIVE_BATCH_SIZE)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Report what would be archived without changing anything')
+    args = parser.parse_args()
+
+    with app.app_context():
+        retention_days = args.days if args.days is not None else app.config['AUDIT_RETENTION_DAYS']
+        batch_size = args.batch_size or app.config['AUDIT_ARCHIVE_BATCH_SIZE']
+        archive_dir = app.config['AUDIT_ARCHIVE_DIR']
+
+        print(f"Archiving audit logs older than {retention_days} days into {archive_dir}")
+        try:
+            results = archive_audit_logs(archive_dir, retention_days, batch_size, dry_run=args.dry_run)
+        except Exception as e:
+            print(f"❌ Archival failed: {e}")
+            return False
+
+        verb = 'Would archive' if args.dry_run else 'Archived'
+        print(f"✅ {verb} {results['archived_count']} entries older than {results['cutoff']}")
+        for month in results['months']:
+            print(f"   - {month}")
+        return True
+
+
+if __name__ == "__main__":
+    main()
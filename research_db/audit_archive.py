@@ -0,0 +1,422 @@
+"""
+Audit log retention and archival
+Moves old audit_log rows into compressed monthly NDJSON archives
+"""
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+
+from models import db, AuditLog, User
+
+MANIFEST_NAME = 'manifest.json'
+
+# Number of (month, filter) match counts kept in memory between viewer requests
+_COUNT_CACHE_SIZE = 256
+_count_cache = {}
+
+
+def month_key(timestamp):
+    """Return the archive month key (YYYY-MM) for a timestamp"""
+    return timestamp.strftime('%Y-%m')
+
+
+def month_bounds(month):
+    """Return the [start, end) datetimes covered by an archive month"""
+    start = datetime.strptime(month, '%Y-%m')
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+def archive_file_path(archive_dir, month):
+    """Return the archive file path for a month"""
+    return os.path.join(archive_dir, f'audit_{month.replace("-", "_")}.ndjson.gz')
+
+
+def load_manifest(archive_dir):
+    """Load the archive manifest, returning an empty one if none exists"""
+    manifest_path = os.path.join(archive_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'months': {}, 'archived_before': None}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(archive_dir, manifest):
+    """Atomically write the archive manifest"""
+    manifest_path = os.path.join(archive_dir, MANIFEST_NAME)
+    temp_path = manifest_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, manifest_path)
+
+
+def serialize_audit_row(log):
+    """Convert an AuditLog row to a JSON-serializable dict"""
+    return {
+        'id': log.id,
+        'user_id': log.user_id,
+        'action': log.action,
+        'resource_type': log.resource_type,
+        'resource_id': log.resource_id,
+        'details': log.details,
+        'ip_address': log.ip_address,
+        'user_agent': log.user_agent,
+        'timestamp': log.timestamp.isoformat() if log.timestamp else None
+    }
+
+
+def _append_rows(path, rows):
+    """Append rows to a month archive as a new gzip member and fsync it"""
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+            for row in rows:
+                gz.write((json.dumps(row, separators=(',', ':')) + '\n').encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def _month_summary(path, rows):
+    """What appending rows to a month file adds to its manifest entry"""
+    ids = [row['id'] for row in rows]
+    timestamps = [row['timestamp'] for row in rows]
+    return {
+        'file': os.path.basename(path),
+        'size_before': os.path.getsize(path) if os.path.exists(path) else 0,
+        'row_count': len(rows),
+        'min_id': min(ids),
+        'max_id': max(ids),
+        'first_timestamp': min(timestamps),
+        'last_timestamp': max(timestamps)
+    }
+
+
+def _record_batch(archive_dir, manifest, pending):
+    """Add a batch whose hot rows are deleted to the month entries of the manifest"""
+    for month, summary in pending['months'].items():
+        entry = manifest['months'].setdefault(month, {
+            'file': summary['file'],
+            'row_count': 0,
+            'min_id': None,
+            'max_id': None,
+            'first_timestamp': None,
+            'last_timestamp': None
+        })
+        entry['row_count'] += summary['row_count']
+        entry['min_id'] = min(value for value in [entry['min_id'], summary['min_id']] if value is not None)
+        entry['max_id'] = max(value for value in [entry['max_id'], summary['max_id']] if value is not None)
+        entry['first_timestamp'] = min(value for value in [entry['first_timestamp'], summary['first_timestamp']] if value)
+        entry['last_timestamp'] = max(value for value in [entry['last_timestamp'], summary['last_timestamp']] if value)
+        entry['file_size'] = os.path.getsize(os.path.join(archive_dir, summary['file']))
+        entry['updated_at'] = datetime.utcnow().isoformat()
+    previous_horizon = manifest.get('archived_before')
+    if not previous_horizon or previous_horizon < pending['cutoff']:
+        manifest['archived_before'] = pending['cutoff']
+
+
+def _recover_pending(archive_dir, manifest):
+    """
+    Finish the batch an interrupted run left pending: record it if its hot
+    rows were deleted, otherwise cut what it appended off the month files so
+    the rows are archived once, by this run.
+    """
+    pending = manifest.pop('pending', None)
+    if pending is None:
+        return
+    if AuditLog.query.filter(AuditLog.id.in_(pending['ids'])).first() is None:
+        _record_batch(archive_dir, manifest, pending)
+    else:
+        for summary in pending['months'].values():
+            path = os.path.join(archive_dir, summary['file'])
+            if summary['size_before']:
+                # Appends are whole gzip members, so the file ends cleanly at its old size
+                os.truncate(path, summary['size_before'])
+            elif os.path.exists(path):
+                os.remove(path)
+    save_manifest(archive_dir, manifest)
+
+
+def archive_audit_logs(archive_dir, retention_days=365, batch_size=1000, dry_run=False):
+    """
+    Move audit rows older than the retention window into monthly archives.
+
+    Rows are read in id order in batches. Each batch is noted in the
+    manifest as pending, appended to its month files and only then deleted
+    from the hot table, so an interrupted run never loses rows. The next run
+    records a pending batch whose rows were deleted, or removes what it
+    appended when they were not, so no row is archived twice.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    os.makedirs(archive_dir, exist_ok=True)
+    manifest = load_manifest(archive_dir)
+    if not dry_run:
+        _recover_pending(archive_dir, manifest)
+
+    results = {
+        'cutoff': cutoff.isoformat(),
+        'archived_count': 0,
+        'months': set(),
+        'dry_run': dry_run
+    }
+
+    last_id = 0
+    while True:
+        batch = AuditLog.query.filter(
+            AuditLog.timestamp < cutoff,
+            AuditLog.id > last_id
+        ).order_by(AuditLog.id).limit(batch_size).all()
+
+        if not batch:
+            break
+
+        last_id = batch[-1].id
+        rows_by_month = {}
+        for log in batch:
+            rows_by_month.setdefault(month_key(log.timestamp), []).append(serialize_audit_row(log))
+
+        results['archived_count'] += len(batch)
+        results['months'].update(rows_by_month.keys())
+
+        if dry_run:
+            db.session.expunge_all()
+            continue
+
+        pending = {
+            'cutoff': cutoff.isoformat(),
+            'ids': [log.id for log in batch],
+            'months': {
+                month: _month_summary(archive_file_path(archive_dir, month), rows)
+                for month, rows in rows_by_month.items()
+            }
+        }
+        manifest['pending'] = pending
+        save_manifest(archive_dir, manifest)
+
+        for month, rows in rows_by_month.items():
+            _append_rows(archive_file_path(archive_dir, month), rows)
+
+        # Only delete once the rows are safely on disk
+        AuditLog.query.filter(
+            AuditLog.id.in_(pending['ids'])
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+
+        del manifest['pending']
+        _record_batch(archive_dir, manifest, pending)
+        save_manifest(archive_dir, manifest)
+
+    results['months'] = sorted(results['months'])
+    return results
+
+
+class ArchivedAuditEntry:
+    """Read-only audit entry loaded from an archive file (mirrors AuditLog)"""
+
+    is_archived = True
+
+    def __init__(self, row, user=None):
+        self.id = row['id']
+        self.user_id = row.get('user_id')
+        self.action = row.get('action')
+        self.resource_type = row.get('resource_type')
+        self.resource_id = row.get('resource_id')
+        self.details = row.get('details')
+        self.ip_address = row.get('ip_address')
+        self.user_agent = row.get('user_agent')
+        self.timestamp = datetime.fromisoformat(row['timestamp']) if row.get('timestamp') else None
+        self.user = user
+
+    def get_details_dict(self):
+        """Parse details JSON string to dictionary"""
+        if self.details:
+            try:
+                return json.loads(self.details)
+            except ValueError:
+                return {}
+        return {}
+
+
+class AuditArchiveFilter:
+    """Filter applied to archived rows, matching the audit viewer filters"""
+
+    def __init__(self, user=None, action=None, date_from=None, date_to=None):
+        self.user = user or ''
+        self.action = action or ''
+        self.date_from = date_from
+        self.date_to = date_to
+        self.user_ids = None
+        if self.user:
+            matches = User.query.filter(User.username.ilike(f'%{self.user}%')).all()
+            self.user_ids = {user.id for user in matches}
+
+    def cache_key(self):
+        return (self.user, self.action,
+                self.date_from.isoformat() if self.date_from else None,
+                self.date_to.isoformat() if self.date_to else None)
+
+    def matches(self, row):
+        if self.user_ids is not None and row.get('user_id') not in self.user_ids:
+            return False
+        if self.action and self.action.lower() not in (row.get('action') or '').lower():
+            return False
+        if self.date_from or self.date_to:
+            timestamp = row.get('timestamp') or ''
+            if self.date_from and timestamp < self.date_from.isoformat():
+                return False
+            if self.date_to and timestamp >= self.date_to.isoformat():
+                return False
+        return True
+
+
+class AuditArchive:
+    """Read access to the monthly audit archives described by the manifest"""
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.manifest = load_manifest(archive_dir)
+
+    @property
+    def archived_before(self):
+        """Datetime before which audit rows may live in the archive"""
+        value = self.manifest.get('archived_before')
+        return datetime.fromisoformat(value) if value else None
+
+    def months_in_range(self, date_from=None, date_to=None):
+        """Return archived months overlapping [date_from, date_to), newest first"""
+        months = []
+        for month in self.manifest.get('months', {}):
+            start, end = month_bounds(month)
+            if date_from and end <= date_from:
+                continue
+            if date_to and start >= date_to:
+                continue
+            months.append(month)
+        return sorted(months, reverse=True)
+
+    def iter_month(self, month, row_filter=None):
+        """Stream rows of one archived month in file order, skipping duplicates"""
+        path = archive_file_path(self.archive_dir, month)
+        if not os.path.exists(path):
+            return
+        seen_ids = set()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if row['id'] in seen_ids:
+                    continue
+                seen_ids.add(row['id'])
+                if row_filter is None or row_filter.matches(row):
+                    yield row
+
+    def count_month(self, month, row_filter):
+        """Count matching rows in a month, cached by file size and filter"""
+        path = archive_file_path(self.archive_dir, month)
+        if not os.path.exists(path):
+            return 0
+        key = (path, os.path.getsize(path), os.path.getmtime(path), row_filter.cache_key())
+        if key not in _count_cache:
+            if len(_count_cache) >= _COUNT_CACHE_SIZE:
+                _count_cache.pop(next(iter(_count_cache)))
+            _count_cache[key] = sum(1 for _ in self.iter_month(month, row_filter))
+        return _count_cache[key]
+
+    def fetch(self, months, row_filter, offset, limit, month_counts=None):
+        """
+        Return up to `limit` matching entries, newest first, skipping `offset`.
+        Only months that overlap the requested window are decompressed.
+        """
+        entries = []
+        users = {}
+        for month in months:
+            count = month_counts[month] if month_counts else self.count_month(month, row_filter)
+            if offset >= count:
+                offset -= count
+                continue
+
+            rows = sorted(self.iter_month(month, row_filter),
+                          key=lambda row: (row.get('timestamp') or '', row['id']),
+                          reverse=True)
+            for row in rows[offset:offset + limit - len(entries)]:
+                user_id = row.get('user_id')
+                if user_id is not None and user_id not in users:
+                    users[user_id] = User.query.get(user_id)
+                entries.append(ArchivedAuditEntry(row, users.get(user_id)))
+            offset = 0
+            if len(entries) >= limit:
+                break
+        return entries
+
+
+class CombinedPagination:
+    """Pagination over hot audit rows followed by archived rows"""
+
+    def __init__(self, items, page, per_page, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def pages(self):
+        if self.total == 0:
+            return 0
+        return (self.total + self.per_page - 1) // self.per_page
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=4, right_edge=2):
+        """Yield page numbers for a pagination widget, None marks a gap"""
+        last = 0
+        for num in range(1, self.pages + 1):
+            if (num <= left_edge
+                    or self.page - left_current - 1 < num < self.page + right_current
+                    or num > self.pages - right_edge):
+                if last + 1 != num:
+                    yield None
+                yield num
+                last = num
+
+
+def paginate_with_archive(hot_query, archive, row_filter, months, page, per_page):
+    """
+    Paginate a hot AuditLog query (newest first) followed by archived months.
+    Hot rows are always newer than archived ones, so the archive only has to
+    be read once the requested page runs past the end of the hot table.
+    """
+    hot_total = hot_query.count()
+    month_counts = {month: archive.count_month(month, row_filter) for month in months}
+    total = hot_total + sum(month_counts.values())
+
+    offset = (page - 1) * per_page
+    items = []
+    if offset < hot_total:
+        items = hot_query.offset(offset).limit(per_page).all()
+
+    remaining = per_page - len(items)
+    if remaining > 0:
+        archive_offset = max(0, offset - hot_total)
+        items.extend(archive.fetch(months, row_filter, archive_offset, remaining, month_counts))
+
+    return CombinedPagination(items, page, per_page, total)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Activity Rollup Backfill Script
+Rebuilds the daily activity rollup table from the audit log and its archives
+"""
+import os
+import sys
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from activity_rollups import backfill_activity_rollups
+from audit_archive import AuditArchive
+
+
+def main():
+    """Rebuild activity rollups"""
+    with app.app_context():
+        print("Rebuilding activity rollups from audit logs and archives...")
+        try:
+            rollup_count = backfill_activity_rollups(AuditArchive(app.config['AUDIT_ARCHIVE_DIR']))
+        except Exception as e:
+            print(f"❌ Backfill failed: {e}")
+            return False
+        print(f"✅ Wrote {rollup_count} rollup rows")
+        return True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Project Storage Usage Backfill Script
+Rebuilds the per-project document storage counters from the document table.
+Run it once after upgrading, and whenever the counters are suspected to have
+drifted (for example after restoring a database backup by hand).
+"""
+import os
+import sys
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from models import db
+from project_storage import backfill_storage_usage
+
+
+def main():
+    """Rebuild project storage usage"""
+    with app.app_context():
+        print("Rebuilding project storage usage from documents...")
+        try:
+            row_count = backfill_storage_usage()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Backfill failed: {e}")
+            return False
+        print(f"✅ Wrote {row_count} usage rows")
+        return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
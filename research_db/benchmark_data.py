@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Benchmark Data Generator
+Fills a database with realistic synthetic projects, team memberships, status
+history, audit and error logs and documents, and provides the measurement and
+result helpers shared by the benchmark scripts
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BENCHMARK_ADMIN_USERNAME = 'bench_admin'
+BENCHMARK_ADMIN_PASSWORD = 'bench-admin-password'
+
+STATUSES = ['Active', 'Active', 'Active', 'On Hold', 'Completed', 'Completed', 'Cancelled']
+CURRENCIES = ['Rs', 'Rs', 'Rs', 'USD', 'USD', 'EUR', 'GBP', 'INR', 'AUD']
+CATEGORIES = ['Economics', 'Social Policy', 'Environment', 'Health', 'Education', 'Governance', 'Agriculture']
+THEMES = ['Poverty', 'Water Security', 'Gender', 'Climate Adaptation', 'Labour Markets', 'Trade', 'Nutrition',
+          'Urbanisation', 'Microfinance', 'Public Finance']
+FUNDING_SOURCES = ['World Bank', 'UNDP', 'Asian Development Bank', 'USAID', 'Ford Foundation', 'Government of Sri Lanka',
+                   'European Union', 'Internal', 'IDRC', 'Gates Foundation']
+TITLE_WORDS = ['Assessment', 'Study', 'Survey', 'Evaluation', 'Analysis', 'Review', 'Impact', 'Baseline', 'Mapping',
+               'Household', 'Rural', 'Urban', 'Regional', 'National', 'Community', 'Coastal', 'Youth', 'Women']
+FIRST_NAMES = ['Anura', 'Chamari', 'Dilan', 'Fathima', 'Gayan', 'Hiruni', 'Ishan', 'Kavindi', 'Lahiru', 'Malini',
+               'Nuwan', 'Priya', 'Ruwan', 'Sanduni', 'Tharindu', 'Udari']
+LAST_NAMES = ['Perera', 'Fernando', 'Silva', 'Jayasinghe', 'Wickramasinghe', 'Bandara', 'Rajapaksa', 'Kumar',
+              'Ranasinghe', 'Herath']
+TEAM_ROLES = ['Co-Investigator', 'Research Assistant', 'Data Analyst', 'Field Coordinator', 'Consultant']
+AUDIT_ACTIONS = ['login', 'logout', 'view_project', 'create_project', 'edit_project', 'change_project_status',
+                 'export_projects_csv', 'upload_document', 'download_document', 'bulk_import']
+DOCUMENT_TYPES = ['contract', 'report', 'deliverable']
+DOCUMENT_FILE_TYPES = ['pdf', 'pdf', 'docx', 'xlsx', 'pptx', 'txt']
+ERROR_TYPES = ['ValueError', 'KeyError', 'OperationalError', 'IntegrityError', 'TypeError', 'FileNotFoundError']
+
+
+def person_name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def random_date(rng, start, end):
+    return start + timedelta(days=rng.randrange((end - start).days + 1))
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_latencies(seconds):
+    """Latency summary in milliseconds"""
+    milliseconds = [value * 1000 for value in seconds]
+    return {
+        'count': len(milliseconds),
+        'mean_ms': round(sum(milliseconds) / len(milliseconds), 3) if milliseconds else None,
+        'min_ms': round(min(milliseconds), 3) if milliseconds else None,
+        'p50_ms': round(percentile(milliseconds, 50), 3) if milliseconds else None,
+        'p90_ms': round(percentile(milliseconds, 90), 3) if milliseconds else None,
+        'p95_ms': round(percentile(milliseconds, 95), 3) if milliseconds else None,
+        'p99_ms': round(percentile(milliseconds, 99), 3) if milliseconds else None,
+        'max_ms': round(max(milliseconds), 3) if milliseconds else None
+    }
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_metadata():
+    return {
+        'generated_at': datetime.now().isoformat(),
+        'git_commit': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def write_results(path, results):
+    """Write benchmark results as JSON (atomically, so a crashed run never leaves a partial file)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, default=str)
+    os.replace(temp_path, path)
+
+
+def compare_results(baseline, current, metrics, threshold_pct):
+    """
+    Compare two result sets scenario by scenario.
+    `metrics` maps a label to a function extracting a number from a scenario
+    result (higher is worse). Returns (rows, regressions), where regressions
+    are rows that got worse by more than threshold_pct.
+    """
+    rows = []
+    for name, scenario in current.get('scenarios', {}).items():
+        old_scenario = baseline.get('scenarios', {}).get(name)
+        if old_scenario is None:
+            continue
+        for label, extract in metrics.items():
+            old_value, new_value = extract(old_scenario), extract(scenario)
+            if old_value is None or new_value is None:
+                continue
+            change_pct = ((new_value - old_value) / old_value * 100) if old_value else 0.0
+            rows.append({
+                'scenario': name, 'metric': label, 'baseline': old_value, 'current': new_value,
+                'change_pct': round(change_pct, 1), 'regression': change_pct > threshold_pct
+            })
+    return rows, [row for row in rows if row['regression']]
+
+
+def print_comparison(rows):
+    print(f"{'Scenario':<28} {'Metric':<16} {'Baseline':>12} {'Current':>12} {'Change':>9}")
+    for row in rows:
+        flag = '  ⚠️' if row['regression'] else ''
+        print(f"{row['scenario']:<28} {row['metric']:<16} {row['baseline']:>12.2f} {row['current']:>12.2f} "
+              f"{row['change_pct']:>8.1f}%{flag}")
+
+
+def _insert_batches(db, table, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(table.insert(), rows[start:start + batch_size])
+
+
+def generate_dataset(projects=1000, seed=42, batch_size=5000, audit_per_project=5, log=print):
+    """
+    Generate a synthetic dataset in the current app's database (call inside an
+    app context on an empty or previously generated database). Rows are written
+    with bulk Core inserts in batches of batch_size, so a million projects fit
+    in bounded memory. Returns row counts per table.
+    """
+    from werkzeug.security import generate_password_hash
+    from models import db, User, Project, ProjectTeamMember, ProjectStatusHistory, AuditLog, ErrorLog, Document
+    from activity_rollups import backfill_activity_rollups
+
+    rng = random.Random(seed)
+    db.create_all()
+    today = date.today()
+    counts = {'users': 0, 'projects': 0, 'team_members': 0, 'status_history': 0,
+              'audit_logs': 0, 'error_logs': 0, 'documents': 0}
+
+    # Users - one benchmark admin plus a pool of researchers to reference
+    if not User.query.filter_by(username=BENCHMARK_ADMIN_USERNAME).first():
+        db.session.add(User(username=BENCHMARK_ADMIN_USERNAME,
+                            password_hash=generate_password_hash(BENCHMARK_ADMIN_PASSWORD),
+                            full_name='Benchmark Admin', role='full_access'))
+        counts['users'] += 1
+    user_count = min(500, max(10, projects // 200))
+    shared_hash = generate_password_hash(f'bench-{seed}')
+    existing_usernames = {username for (username,) in db.session.query(User.username)}
+    new_users = [
+        {'username': f'bench_user_{i}', 'password_hash': shared_hash, 'full_name': person_name(rng),
+         'role': rng.choice(['view_all', 'view_all', 'view_limited', 'full_access']), 'created_at': datetime.utcnow()}
+        for i in range(user_count) if f'bench_user_{i}' not in existing_usernames
+    ]
+    _insert_batches(db, User.__table__, new_users, batch_size)
+    counts['users'] += len(new_users)
+    db.session.commit()
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+
+    next_project_id = (db.session.query(db.func.max(Project.id)).scalar() or 0) + 1
+    year_sequence = {}
+    for (project_code,) in db.session.query(Project.project_id):
+        parts = project_code.split('-')
+        if len(parts) == 3 and parts[2].isdigit():
+            year_sequence[parts[1]] = max(year_sequence.get(parts[1], 0), int(parts[2]))
+
+    error_fingerprints = set(fp for (fp,) in db.session.query(ErrorLog.fingerprint) if fp)
+    started = time.perf_counter()
+
+    for batch_start in range(0, projects, batch_size):
+        batch_count = min(batch_size, projects - batch_start)
+        project_rows, member_rows, history_rows, audit_rows, document_rows, error_rows = [], [], [], [], [], []
+
+        for offset in range(batch_count):
+            project_pk = next_project_id + batch_start + offset
+            start_date = random_date(rng, date(2010, 1, 1), today) if rng.random() > 0.03 else None
+            end_date = (start_date or today) + timedelta(days=rng.randint(60, 1460)) if rng.random() > 0.05 else None
+            year = str((start_date or end_date or today).year)
+            year_sequence[year] = year_sequence.get(year, 0) + 1
+            status = rng.choice(STATUSES)
+            created_at = datetime.combine(start_date or today, datetime.min.time()) + timedelta(hours=rng.randint(8, 18))
+            theme = rng.choice(THEMES)
+
+            project_rows.append({
+                'id': project_pk,
+                'project_id': f'PROJ-{year}-{year_sequence[year]:03d}',
+                'title': f'{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)} of {theme} in {rng.choice(LAST_NAMES)} District',
+                'description': f'{rng.choice(TITLE_WORDS)} covering {theme.lower()} outcomes. ' * rng.randint(1, 6),
+                'start_date': start_date,
+                'end_date': end_date,
+                'status': status,
+                'principal_investigator': person_name(rng),
+                'team_members': ', '.join(person_name(rng) for _ in range(rng.randint(0, 4))),
+                'budget': round(rng.uniform(50_000, 25_000_000), 2) if rng.random() > 0.15 else None,
+                'currency': rng.choice(CURRENCIES),
+                'funding_source': rng.choice(FUNDING_SOURCES),
+                'category': rng.choice(CATEGORIES),
+                'theme': theme,
+                'created_at': created_at,
+                'updated_at': created_at
+            })
+
+            for _ in range(rng.randint(0, 5)):
+                member_rows.append({'project_id': project_pk, 'user_id': rng.choice(user_ids),
+                                    'role': rng.choice(TEAM_ROLES), 'assigned_at': created_at})
+
+            history_rows.append({'project_id': project_pk, 'user_id': rng.choice(user_ids), 'from_status': None,
+                                 'to_status': 'Active', 'reason': 'Project created', 'changed_at': created_at})
+            if status != 'Active':
+                history_rows.append({'project_id': project_pk, 'user_id': rng.choice(user_ids), 'from_status': 'Active',
+                                     'to_status': status, 'reason': 'Status review',
+                                     'changed_at': created_at + timedelta(days=rng.randint(30, 700))})
+
+            for _ in range(rng.randint(0, audit_per_project * 2)):
+                action = rng.choice(AUDIT_ACTIONS)
+                audit_rows.append({
+                    'user_id': rng.choice(user_ids), 'action': action, 'resource_type': 'project',
+                    'resource_id': str(project_pk), 'details': json.dumps({'source': 'benchmark'}),
+                    'ip_address': f'10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}', 'user_agent': 'benchmark',
+                    'timestamp': datetime.utcnow() - timedelta(minutes=rng.randint(0, 60 * 24 * 720))
+                })
+
+            for index in range(rng.choice([0, 0, 1, 1, 2, 3])):
+                file_type = rng.choice(DOCUMENT_FILE_TYPES)
+                filename = f'bench_{project_pk}_{index}.{file_type}'
+                document_rows.append({
+                    'project_id': project_pk, 'filename': filename, 'original_filename': f'Report {index + 1}.{file_type}',
+                    'file_path': os.path.join('uploads', 'benchmark', filename), 'file_type': file_type,
+                    'file_size': rng.randint(20_000, 20_000_000), 'uploaded_by': rng.choice(user_ids),
+                    'uploaded_at': created_at + timedelta(days=rng.randint(0, 365)),
+                    'document_type': rng.choice(DOCUMENT_TYPES), 'description': None
+                })
+
+            if rng.random() < 0.01:
+                fingerprint = hashlib.sha1(f'{seed}-{project_pk}'.encode('utf-8')).hexdigest()
+                if fingerprint not in error_fingerprints:
+                    error_fingerprints.add(fingerprint)
+                    first_seen = datetime.utcnow() - timedelta(days=rng.randint(1, 365))
+                    error_type = rng.choice(ERROR_TYPES)
+                    error_rows.append({
+                        'error_type': error_type, 'error_message': f'{error_type} while handling project {project_pk}',
+                        'traceback': 'Traceback (most recent call last):\n  File "app.py", line 1, in view\n',
+                        'context': json.dumps({'samples': []}), 'user_id': rng.choice(user_ids),
+                        'url': f'/projects/{project_pk}', 'method': 'GET', 'severity': 'error',
+                        'resolved': rng.random() < 0.5, 'occurred_at': first_seen, 'fingerprint': fingerprint,
+                        'occurrence_count': rng.randint(1, 500),
+                        'last_seen_at': first_seen + timedelta(days=rng.randint(0, 30))
+                    })
+
+        _insert_batches(db, Project.__table__, project_rows, batch_size)
+        _insert_batches(db, ProjectTeamMember.__table__, member_rows, batch_size)
+        _insert_batches(db, ProjectStatusHistory.__table__, history_rows, batch_size)
+        _insert_batches(db, AuditLog.__table__, audit_rows, batch_size)
+        _insert_batches(db, Document.__table__, document_rows, batch_size)
+        _insert_batches(db, ErrorLog.__table__, error_rows, batch_size)
+        db.session.commit()
+
+        counts['projects'] += len(project_rows)
+        counts['team_members'] += len(member_rows)
+        counts['status_history'] += len(history_rows)
+        counts['audit_logs'] += len(audit_rows)
+        counts['documents'] += len(document_rows)
+        counts['error_logs'] += len(error_rows)
+        done = batch_start + batch_count
+        log(f"   {done}/{projects} projects ({done / (time.perf_counter() - started):.0f} rows/s)")
+
+    # Bulk inserts bypass the ORM flush hook, so rebuild the activity rollups once at the end
+    backfill_activity_rollups()
+    return counts
+
+
+def main():
+    """Generate a benchmark database"""
+    parser = argparse.ArgumentParser(description='Generate a synthetic benchmark database')
+    parser.add_argument('--projects', type=int, default=1000, help='Number of projects to generate (1k to 1M)')
+    parser.add_argument('--database', default=None,
+                        help='SQLite file to fill (default: marga_bench_<projects>.db in the temp directory)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducible data')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert')
+    args = parser.parse_args()
+
+    database = args.database or os.path.join(tempfile.gettempdir(), f'marga_bench_{args.projects}.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(database)}'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    from app import app
+
+    print(f"Generating {args.projects} projects into {database}")
+    with app.app_context():
+        counts = generate_dataset(args.projects, seed=args.seed, batch_size=args.batch_size)
+    print(f"✅ Generated: {', '.join(f'{count} {table}' for table, count in counts.items())}")
+
+
+if __name__ == "__main__":
+    main()
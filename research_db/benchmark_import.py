@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Bulk Import Benchmark
+Generates messy CSV/XLSX import files (mixed date formats, currencies in the
+budget text, inconsistent statuses, repeated titles and rows already in the
+database) and measures the import pipeline stage by stage for preview and
+direct mode. Every case runs in a fresh process so peak RSS is per case.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_data import (CATEGORIES, FUNDING_SOURCES, LAST_NAMES, THEMES, TITLE_WORDS, benchmark_metadata,
+                            compare_results, peak_rss, person_name, print_comparison, write_results)
+
+MESSY_STATUSES = ['Active', 'active', 'ACTIVE', 'Completed', 'completed', 'done', 'On Hold', 'on hold', 'paused',
+                  'Cancelled', 'canceled', 'terminated', 'in progress', '']
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%d-%m-%Y', '%Y/%m/%d', '%d.%m.%Y', '%B %d, %Y', '%b %d, %Y']
+
+
+def messy_date(rng, value):
+    """Render a date the way spreadsheets in the wild do"""
+    roll = rng.random()
+    if roll < 0.05:
+        return ''
+    if roll < 0.07:
+        return rng.choice(['TBD', 'ongoing', 'n/a'])
+    return value.strftime(rng.choice(DATE_FORMATS))
+
+
+def messy_budget(rng):
+    """Budget text with the currency embedded in varying styles; returns (budget, currency column)"""
+    amount = rng.uniform(10_000, 50_000_000)
+    roll = rng.random()
+    if roll < 0.1:
+        return '', ''
+    if roll < 0.3:
+        return f'Rs {amount:,.0f}', ''
+    if roll < 0.45:
+        return f'${amount:,.2f}', ''
+    if roll < 0.55:
+        return f'{amount:.0f} USD', ''
+    if roll < 0.6:
+        return f'€{amount:,.0f}', ''
+    if roll < 0.65:
+        return f'{amount:,.0f} Sri Lankan Rupees', ''
+    return f'{amount:.2f}', rng.choice(['Rs', 'USD', 'EUR', 'GBP', 'INR', ''])
+
+
+def generate_import_rows(rows, seed, duplicate_rate, title_repeat_rate):
+    """
+    Build import rows. Returns (rows, existing) where `existing` are rows that
+    should already be in the database, so duplicate detection finds them.
+    Repeated titles use start dates far apart, as validation rejects near-identical rows.
+    """
+    rng = random.Random(seed)
+    records, existing = [], []
+    today = date.today()
+    for index in range(rows):
+        theme = rng.choice(THEMES)
+        if records and rng.random() < title_repeat_rate:
+            title = rng.choice(records)['Title']
+            start = date(rng.randint(1995, 2005), rng.randint(1, 12), rng.randint(1, 28)) + timedelta(days=index % 365)
+        else:
+            title = f'{rng.choice(TITLE_WORDS)} of {theme} in {rng.choice(LAST_NAMES)} District #{seed}-{index}'
+            start = date(2010, 1, 1) + timedelta(days=rng.randrange((today - date(2010, 1, 1)).days))
+        end = start + timedelta(days=rng.randint(90, 1500))
+        budget, currency = messy_budget(rng)
+        record = {
+            'Title': f'  {title} ' if rng.random() < 0.05 else title,
+            'Principal Investigator': person_name(rng),
+            'Description': f'{theme} study. ' * rng.randint(1, 8),
+            'Category': rng.choice(CATEGORIES),
+            'Theme': theme,
+            'Status': rng.choice(MESSY_STATUSES),
+            'Start Date': messy_date(rng, start),
+            'End Date': messy_date(rng, end),
+            'Team Members': ', '.join(person_name(rng) for _ in range(rng.randint(0, 5))),
+            'Funding Source': rng.choice(FUNDING_SOURCES),
+            'Budget': budget,
+            'Currency': currency
+        }
+        records.append(record)
+        if rng.random() < duplicate_rate:
+            existing.append({'title': title.strip(), 'principal_investigator': record['Principal Investigator'],
+                             'start_date': start, 'end_date': end})
+    return records, existing
+
+
+def write_import_file(records, path, file_format):
+    import pandas as pd
+    df = pd.DataFrame.from_records(records)
+    if file_format == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        df.to_excel(path, index=False, engine='openpyxl')
+
+
+def run_case(case, result_queue):
+    """Run one (file, mode) case in a fresh process against its own database"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{case['database']}"
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Per-row import warnings (unknown statuses etc.) would otherwise dominate console output
+    os.environ.setdefault('IMPORT_LOG_LEVEL', 'ERROR')
+    os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'marga_bench_metrics'))
+
+    from memory_diagnostics import current_rss
+    from app import (app, read_import_file, validate_bulk_import_data, process_import_data, import_projects_to_db,
+                     stage_import_preview, load_import_preview)
+    from models import db, Project
+
+    timings, rss_after = {}, {}
+
+    def timed(stage, func, *args):
+        started = time.perf_counter()
+        value = func(*args)
+        timings[stage] = round(time.perf_counter() - started, 4)
+        rss_after[stage] = current_rss()
+        return value
+
+    with app.app_context():
+        db.create_all()
+        if case['existing']:
+            db.session.execute(Project.__table__.insert(), [
+                dict(row, project_id=f'PROJ-EXIST-{index:07d}', status='Active', currency='Rs')
+                for index, row in enumerate(case['existing'])
+            ])
+            db.session.commit()
+        rss_start = current_rss()
+
+        started = time.perf_counter()
+        df = timed('read', read_import_file, case['path'], case['path'])
+        issues = timed('validate', validate_bulk_import_data, df)
+        processed = timed('process', process_import_data, df, case['skip_duplicates'])
+        if case['mode'] == 'preview':
+            import_id = timed('stage', stage_import_preview, processed)
+            processed = timed('load_staged', load_import_preview, import_id)
+        results = timed('import', import_projects_to_db, processed)
+        total = time.perf_counter() - started
+
+    result_queue.put({
+        'rows': case['rows'],
+        'format': case['format'],
+        'mode': case['mode'],
+        'file_bytes': os.path.getsize(case['path']),
+        'validation_issues': len(issues),
+        'processed_rows': len(processed),
+        'imported': results['success_count'],
+        'skipped_duplicates': results['skipped_count'],
+        'failed': results['error_count'],
+        'total_seconds': round(total, 4),
+        'rows_per_second': round(case['rows'] / total, 1) if total else None,
+        'stage_seconds': timings,
+        'stage_rows_per_second': {stage: round(case['rows'] / seconds, 1) if seconds else None
+                                  for stage, seconds in timings.items()},
+        'rss_start_bytes': rss_start,
+        'rss_after_stage_bytes': rss_after,
+        'peak_rss_bytes': peak_rss()
+    })
+
+
+def run_in_fresh_process(context, case):
+    """Run a case in a child process; returns its result, or None if the child died"""
+    result_queue = context.Queue()
+    process = context.Process(target=run_case, args=(case, result_queue))
+    process.start()
+    while True:
+        try:
+            result = result_queue.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                print(f"   child process exited with code {process.exitcode}")
+                return None
+    process.join()
+    return result
+
+
+def main():
+    """Run the bulk import benchmark"""
+    parser = argparse.ArgumentParser(description='Benchmark the bulk import pipeline')
+    parser.add_argument('--rows', type=int, action='append',
+                        help='Rows per generated file, repeatable (default: 1000 and 10000; up to 500000)')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], action='append', help='File formats (default: both)')
+    parser.add_argument('--mode', choices=['preview', 'direct'], action='append', help='Import modes (default: both)')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05,
+                        help='Share of rows already present in the database')
+    parser.add_argument('--title-repeat-rate', type=float, default=0.02,
+                        help='Share of rows reusing an earlier title with different dates')
+    parser.add_argument('--no-skip-duplicates', action='store_true',
+                        help='Import without the "skip duplicates" option')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for generated files')
+    parser.add_argument('--work-dir', default=None, help='Directory for generated files and databases')
+    parser.add_argument('-o', '--output', default='benchmark_import.json', help='Results file')
+    parser.add_argument('--compare', default=None, help='Baseline results file to compare against')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='Exit with status 1 when time per row or peak RSS regresses by more than this percentage')
+    args = parser.parse_args()
+
+    row_counts = args.rows or [1000, 10000]
+    formats = args.format or ['csv', 'xlsx']
+    modes = args.mode or ['preview', 'direct']
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='marga_import_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+
+    results = {'benchmark': 'bulk_import', 'metadata': benchmark_metadata(), 'settings': {
+        'duplicate_rate': args.duplicate_rate, 'title_repeat_rate': args.title_repeat_rate,
+        'skip_duplicates': not args.no_skip_duplicates, 'seed': args.seed
+    }, 'scenarios': {}}
+
+    # spawn gives every case a fresh interpreter, so peak RSS is not inherited from earlier cases
+    context = multiprocessing.get_context('spawn')
+    print(f"{'Case':<24} {'rows/s':>10} {'total':>9} {'validate':>9} {'process':>9} {'import':>9} {'peak RSS':>10}")
+    for rows in row_counts:
+        records, existing = generate_import_rows(rows, args.seed, args.duplicate_rate, args.title_repeat_rate)
+        for file_format in formats:
+            path = os.path.join(work_dir, f'import_{rows}.{file_format}')
+            write_import_file(records, path, file_format)
+            for mode in modes:
+                name = f'{file_format}_{rows}_{mode}'
+                database = os.path.join(work_dir, f'{name}.db')
+                if os.path.exists(database):
+                    os.remove(database)
+                case = {'path': path, 'rows': rows, 'format': file_format, 'mode': mode, 'database': database,
+                        'existing': existing, 'skip_duplicates': not args.no_skip_duplicates}
+
+                result = run_in_fresh_process(context, case)
+                if result is None:
+                    print(f"❌ {name} failed")
+                    continue
+
+                results['scenarios'][name] = result
+                stages = result['stage_seconds']
+                print(f"{name:<24} {result['rows_per_second']:>10.0f} {result['total_seconds']:>8.2f}s "
+                      f"{stages['validate']:>8.2f}s {stages['process']:>8.2f}s {stages['import']:>8.2f}s "
+                      f"{(result['peak_rss_bytes'] or 0) / 1024 / 1024:>8.0f}MB")
+                os.remove(database)
+        del records, existing
+
+    write_results(args.output, results)
+    print(f"✅ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = compare_results(baseline, results, {
+            'ms_per_1k_rows': lambda scenario: scenario['total_seconds'] * 1_000_000 / scenario['rows'],
+            'peak_rss_mb': lambda scenario: (scenario['peak_rss_bytes'] or 0) / 1024 / 1024 or None,
+        }, args.threshold)
+        print_comparison(rows)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) above {args.threshold}%")
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
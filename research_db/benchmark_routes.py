@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Route Benchmark Suite
+Generates (or reuses) a synthetic database and drives the main pages through
+the Flask test client, reporting latency percentiles, SQL query counts and
+memory per route as JSON that can be compared across commits
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark_data import (BENCHMARK_ADMIN_USERNAME, BENCHMARK_ADMIN_PASSWORD, benchmark_metadata, compare_results,
+                            generate_dataset, peak_rss, print_comparison, summarize_latencies, write_results)
+
+
+def route_scenarios(project_ids, rng):
+    """(name, url factory) pairs; factories are called once per request"""
+    return [
+        ('dashboard', lambda: '/dashboard'),
+        ('projects', lambda: '/projects'),
+        ('projects_filtered', lambda: '/projects?status=Active&category=Economics&currency=USD&sort=budget&order=desc'),
+        ('projects_search', lambda: '/projects?search=Water&start_date=2018-01-01&end_date=2024-12-31'),
+        ('api_search_projects', lambda: f"/api/search/projects?q={rng.choice(['water', 'poverty', 'Perera', 'PROJ-2020'])}&limit=20"),
+        ('export_projects_csv', lambda: '/projects/export/csv?status=Completed'),
+        ('view_project', lambda: f'/projects/{rng.choice(project_ids)}'),
+        ('audit_logs', lambda: '/audit-logs'),
+        ('audit_logs_filtered', lambda: '/audit-logs?action=edit_project&date_from=2024-01-01'),
+    ]
+
+
+def run_scenario(client, name, url_factory, iterations, warmup, query_counter):
+    """Time one route; heap peak is measured on a separate traced request so tracing never skews latency"""
+    for _ in range(warmup):
+        client.get(url_factory()).get_data()
+
+    latencies, query_counts, statuses = [], [], {}
+    for _ in range(iterations):
+        url = url_factory()
+        queries_before = query_counter[0]
+        started = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        latencies.append(time.perf_counter() - started)
+        query_counts.append(query_counter[0] - queries_before)
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    tracemalloc.start()
+    client.get(url_factory()).get_data()
+    heap_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'latency': summarize_latencies(latencies),
+        'queries_per_request': {
+            'mean': round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+            'max': max(query_counts) if query_counts else None
+        },
+        'heap_peak_bytes': heap_peak,
+        'process_peak_rss_bytes': peak_rss(),
+        'status_codes': statuses
+    }
+
+
+def main():
+    """Run the route benchmarks"""
+    parser = argparse.ArgumentParser(description='Benchmark the main application routes')
+    parser.add_argument('--projects', type=int, default=1000, help='Dataset size in projects (1k to 1M)')
+    parser.add_argument('--database', default=None,
+                        help='SQLite file to use (default: marga_bench_<projects>.db in the temp directory)')
+    parser.add_argument('--reuse', action='store_true', help='Reuse an existing benchmark database instead of regenerating it')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed requests per route')
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per route before timing')
+    parser.add_argument('--scenario', action='append', help='Only run the named scenario (repeatable)')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for data and request parameters')
+    parser.add_argument('-o', '--output', default='benchmark_routes.json', help='Results file')
+    parser.add_argument('--compare', default=None, help='Baseline results file to compare against')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='Exit with status 1 when p95 latency or query count regresses by more than this percentage')
+    args = parser.parse_args()
+
+    database = os.path.abspath(args.database or os.path.join(tempfile.gettempdir(), f'marga_bench_{args.projects}.db'))
+    if os.path.exists(database) and not args.reuse:
+        os.remove(database)
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'marga_bench_metrics'))
+
+    from sqlalchemy import event
+    from app import app
+    from models import db, Project, AuditLog
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        if not (args.reuse and Project.query.count()):
+            print(f"Generating {args.projects} projects into {database}")
+            started = time.perf_counter()
+            generate_dataset(args.projects, seed=args.seed)
+            print(f"   Generated in {time.perf_counter() - started:.1f}s")
+        dataset = {'projects': Project.query.count(), 'audit_logs': AuditLog.query.count()}
+        project_ids = [project_id for (project_id,) in db.session.query(Project.id).limit(10000)]
+
+        query_counter = [0]
+
+        def count_query(*_):
+            query_counter[0] += 1
+
+        event.listen(db.engine, 'after_cursor_execute', count_query)
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': BENCHMARK_ADMIN_USERNAME, 'password': BENCHMARK_ADMIN_PASSWORD})
+    if response.status_code != 302:
+        print("❌ Could not log in as the benchmark admin")
+        return False
+
+    scenarios = route_scenarios(project_ids, rng)
+    if args.scenario:
+        scenarios = [scenario for scenario in scenarios if scenario[0] in args.scenario]
+
+    results = {'benchmark': 'routes', 'metadata': benchmark_metadata(), 'database': database, 'dataset': dataset,
+               'iterations': args.iterations, 'scenarios': {}}
+    print(f"{'Route':<24} {'p50':>10} {'p95':>10} {'p99':>10} {'queries':>8} {'heap peak':>11}")
+    for name, url_factory in scenarios:
+        result = run_scenario(client, name, url_factory, args.iterations, args.warmup, query_counter)
+        results['scenarios'][name] = result
+        latency = result['latency']
+        print(f"{name:<24} {latency['p50_ms']:>8.1f}ms {latency['p95_ms']:>8.1f}ms {latency['p99_ms']:>8.1f}ms "
+              f"{result['queries_per_request']['mean']:>8.1f} {result['heap_peak_bytes'] / 1024 / 1024:>9.1f}MB")
+
+    write_results(args.output, results)
+    print(f"✅ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = compare_results(baseline, results, {
+            'p95_ms': lambda scenario: scenario['latency']['p95_ms'],
+            'queries': lambda scenario: scenario['queries_per_request']['mean'],
+        }, args.threshold)
+        print_comparison(rows)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) above {args.threshold}%")
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
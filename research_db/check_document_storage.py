@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Document Storage Check Script
+Verifies every stored document against the database in parallel (exists,
+size, SHA-256 of its content) and finds orphaned files that no row refers
+to, such as the blob of an upload whose transaction failed. Orphans are only
+reported unless --quarantine moves them aside for review. The archive tier
+is only checked with --archive.
+"""
+import argparse
+import os
+import sys
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, document_store
+from document_integrity import ORPHAN_GRACE_SECONDS, scan_storage
+from memory_diagnostics import format_bytes
+from models import db
+
+ISSUE_LABELS = {
+    'missing': 'Missing',
+    'size_mismatch': 'Wrong size',
+    'checksum_mismatch': 'Checksum mismatch',
+    'unreadable': 'Unreadable',
+    'ref_count': 'Reference count',
+    'orphan': 'Orphan',
+}
+
+
+def print_issue(issue):
+    icon = '⚠️ ' if issue.kind in ('orphan', 'ref_count') else '❌'
+    print(f"   {icon} {ISSUE_LABELS[issue.kind]}: {issue.location} {issue.detail or ''}".rstrip())
+
+
+def main():
+    """Run the document storage check"""
+    parser = argparse.ArgumentParser(description='Verify stored documents and find orphaned files')
+    parser.add_argument('--workers', type=int, default=8, help='Files checked at a time')
+    parser.add_argument('--batch-size', type=int, default=500, help='Rows read per query')
+    parser.add_argument('--quick', action='store_true', help='Check existence and size only, without reading files')
+    parser.add_argument('--skip-orphans', action='store_true', help='Do not look for orphaned files')
+    parser.add_argument('--quarantine', action='store_true', help='Move orphaned files to quarantine/<timestamp>/')
+    parser.add_argument('--archive', action='store_true', help='Check the archive tier too')
+    parser.add_argument('--grace-minutes', type=int, default=ORPHAN_GRACE_SECONDS // 60,
+                        help='Ignore files younger than this, which uploads in progress may still claim')
+    args = parser.parse_args()
+
+    with app.app_context():
+        checks = 'existence and size' if args.quick else 'existence, size and checksum'
+        print(f"Checking {checks} of documents in {document_store.backend.describe()} with {args.workers} workers")
+        try:
+            results = scan_storage(document_store, args.workers, args.batch_size,
+                                   verify_checksums=not args.quick, orphans=not args.skip_orphans,
+                                   quarantine=args.quarantine, grace_seconds=args.grace_minutes * 60,
+                                   report=print_issue, include_archive=args.archive)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Check failed: {e}")
+            return False
+
+        damaged = [issue for issue in results['issues'] if issue.kind not in ('orphan', 'ref_count')]
+        drifted = [issue for issue in results['issues'] if issue.kind == 'ref_count']
+        print(f"{'✅' if not damaged else '❌'} Checked {results['checked']} files: {len(damaged)} missing or damaged, "
+              f"{len(drifted)} reference counts off")
+        if not args.skip_orphans:
+            verb = 'quarantined' if args.quarantine else 'found'
+            count = results['quarantined'] if args.quarantine else results['orphans']
+            print(f"   {count} orphaned files {verb} ({format_bytes(results['orphan_bytes'])})")
+        return not damaged
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
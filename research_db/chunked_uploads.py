@@ -0,0 +1,198 @@
+"""
+Resumable chunked uploads
+A large document is sent as a sequence of Content-Range PUTs appended to a
+part file; after a dropped connection the client asks how much arrived and
+continues from there. State lives on disk, so any worker can take any chunk;
+each upload's part file is locked while a chunk is appended or the upload
+completes, so a chunk retried while the first attempt is still streaming
+waits and is then recognized as already received.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+
+from document_store import CHUNK_SIZE, hash_file
+from file_locks import file_lock
+
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadRangeError(ValueError):
+    """A chunk that does not continue the upload where it stands"""
+
+
+def parse_content_range(header):
+    """Parse 'bytes start-end/total' into (start, end_exclusive, total)"""
+    match = CONTENT_RANGE_PATTERN.match(header or '')
+    if not match:
+        raise UploadRangeError('A Content-Range header of the form "bytes start-end/total" is required.')
+    start, end, total = (int(value) for value in match.groups())
+    if end < start or end >= total:
+        raise UploadRangeError('Invalid Content-Range.')
+    return start, end + 1, total
+
+
+class ChunkedUploadStore:
+    """
+    Part files and their metadata under upload_dir. The running SHA-256 of an
+    upload is kept in memory by the worker that received its chunks in order;
+    when chunks were spread over workers the finished file is hashed once more.
+    """
+
+    def __init__(self, upload_dir, ttl_hours=24):
+        self.upload_dir = upload_dir
+        self.ttl_seconds = ttl_hours * 3600
+        self._lock = threading.Lock()
+        self._hashers = {}  # upload_id -> (bytes hashed, sha256 object)
+
+    def _paths(self, upload_id):
+        if not UPLOAD_ID_PATTERN.match(upload_id or ''):
+            raise KeyError(upload_id)
+        base = os.path.join(self.upload_dir, upload_id)
+        return base + '.json', base + '.part'
+
+    @contextmanager
+    def _locked(self, upload_id):
+        """Hold an upload's part file locked across processes; KeyError when the upload is gone"""
+        _, part_path = self._paths(upload_id)
+        with ExitStack() as stack:
+            try:
+                stack.enter_context(file_lock(part_path, create=False))
+            except FileNotFoundError:
+                raise KeyError(upload_id) from None
+            yield
+
+    def create(self, size, metadata):
+        """Start an upload of `size` bytes; metadata is kept for when it completes"""
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.cleanup_expired()
+        upload_id = uuid.uuid4().hex
+        meta_path, part_path = self._paths(upload_id)
+        open(part_path, 'wb').close()
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(metadata, size=size, created=time.time()), f)
+        with self._lock:
+            self._hashers[upload_id] = (0, hashlib.sha256())
+        return upload_id
+
+    def status(self, upload_id):
+        """Metadata plus bytes received so far, or None for an unknown or expired upload"""
+        try:
+            meta_path, part_path = self._paths(upload_id)
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            metadata['received'] = os.path.getsize(part_path)
+        except (KeyError, OSError, ValueError):
+            return None
+        metadata['upload_id'] = upload_id
+        return metadata
+
+    def append(self, upload_id, start, end, stream, chunk_size=CHUNK_SIZE):
+        """
+        Append bytes [start, end) read from stream. A chunk the upload already
+        has (a retry after a lost response) is accepted without writing it again.
+        Returns the number of bytes received so far.
+        """
+        with self._locked(upload_id):
+            return self._append(upload_id, start, end, stream, chunk_size)
+
+    def _append(self, upload_id, start, end, stream, chunk_size):
+        # Read under the lock: a concurrent request for the same chunk may just have written it
+        metadata = self.status(upload_id)
+        if metadata is None:
+            raise KeyError(upload_id)
+        received = metadata['received']
+        if end > metadata['size']:
+            raise UploadRangeError('Chunk extends past the declared file size.')
+        if end <= received:
+            return received
+        if start > received:
+            raise UploadRangeError(f'Expected a chunk starting at byte {received}.')
+
+        _, part_path = self._paths(upload_id)
+        skip = received - start
+        with self._lock:
+            hashed, hasher = self._hashers.get(upload_id, (None, None))
+        if hashed != received:
+            hasher = None
+
+        remaining = end - start
+        with open(part_path, 'r+b') as f:
+            f.seek(received)
+            f.truncate()
+            while remaining:
+                chunk = stream.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                if skip:
+                    dropped = min(skip, len(chunk))
+                    chunk, skip = chunk[dropped:], skip - dropped
+                if chunk:
+                    f.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+            received = f.tell()
+
+        with self._lock:
+            if hasher is not None:
+                self._hashers[upload_id] = (received, hasher)
+            else:
+                self._hashers.pop(upload_id, None)
+        if remaining:
+            raise UploadRangeError(f'Chunk ended early; {received} bytes received so far.')
+        return received
+
+    def complete(self, upload_id):
+        """
+        Hand over a fully received upload. Returns (part_path, sha256, size,
+        metadata); the caller owns the part file from here on.
+        """
+        with self._locked(upload_id):
+            return self._complete(upload_id)
+
+    def _complete(self, upload_id):
+        metadata = self.status(upload_id)
+        if metadata is None:
+            raise KeyError(upload_id)
+        if metadata['received'] != metadata['size']:
+            raise UploadRangeError(f"Upload incomplete: {metadata['received']} of {metadata['size']} bytes received.")
+        meta_path, part_path = self._paths(upload_id)
+        with self._lock:
+            hashed, hasher = self._hashers.pop(upload_id, (None, None))
+        if hashed == metadata['size']:
+            content_hash = hasher.hexdigest()
+        else:
+            content_hash, _ = hash_file(part_path)
+        os.remove(meta_path)
+        return part_path, content_hash, metadata['size'], metadata
+
+    def discard(self, upload_id):
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def cleanup_expired(self):
+        """Remove uploads that have not received a chunk for longer than the TTL"""
+        if not os.path.isdir(self.upload_dir):
+            return
+        cutoff = time.time() - self.ttl_seconds
+        for filename in os.listdir(self.upload_dir):
+            upload_id, extension = os.path.splitext(filename)
+            if extension != '.part':
+                continue
+            try:
+                if os.path.getmtime(os.path.join(self.upload_dir, filename)) < cutoff:
+                    self.discard(upload_id)
+            except (KeyError, OSError):
+                pass
@@ -0,0 +1,122 @@
+"""
+Document catalogue
+Cross-project listing of uploaded documents, newest first, with filters that
+line up with the composite (project_id, uploaded_at) and (document_type,
+uploaded_at) indexes. Pages are fetched by keyset cursor rather than OFFSET,
+so paging deep into a large catalogue costs the same as the first page.
+"""
+import base64
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, Document, Project, User
+
+CATALOG_PAGE_SIZE = 50
+CATALOG_MAX_PAGE_SIZE = 500
+
+CATALOG_FILTER_FIELDS = ['document_type', 'file_type', 'uploader', 'project', 'project_id',
+                         'date_from', 'date_to', 'min_size', 'max_size']
+
+
+class InvalidCursor(ValueError):
+    """A cursor that was not produced by encode_cursor"""
+
+
+def encode_cursor(document):
+    """Opaque cursor pointing just past document in catalogue order"""
+    raw = f'{document.uploaded_at.isoformat()}|{document.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(uploaded_at, id) of a cursor from encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        uploaded_at, document_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(uploaded_at), int(document_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor('Invalid cursor.') from e
+
+
+def _parse_int(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else None
+    except ValueError:
+        return None
+
+
+def parse_catalog_filters(args, document_types):
+    """
+    Catalogue filters from request args, as strings for echoing back into
+    forms and links. Unknown document types and malformed values are dropped.
+    """
+    filters = {field: (args.get(field) or '').strip() for field in CATALOG_FILTER_FIELDS}
+    if filters['document_type'] not in document_types:
+        filters['document_type'] = ''
+    filters['file_type'] = filters['file_type'].lower().lstrip('.')
+    for field in ['project_id', 'min_size', 'max_size']:
+        if _parse_int(filters[field]) is None:
+            filters[field] = ''
+    for field in ['date_from', 'date_to']:
+        if _parse_date(filters[field]) is None:
+            filters[field] = ''
+    return filters
+
+
+def apply_catalog_filters(query, filters):
+    """Apply parsed catalogue filters to a Document query"""
+    if filters['project_id']:
+        query = query.filter(Document.project_id == int(filters['project_id']))
+    if filters['project']:
+        # Resolved to ids up front so the (project_id, uploaded_at) index does the work
+        project_ids = [row[0] for row in db.session.query(Project.id).filter(Project.project_id == filters['project'])]
+        query = query.filter(Document.project_id.in_(project_ids))
+    if filters['document_type']:
+        query = query.filter(Document.document_type == filters['document_type'])
+    if filters['file_type']:
+        query = query.filter(Document.file_type == filters['file_type'])
+    if filters['uploader']:
+        matching_users = db.session.query(User.id).filter(User.username.ilike(f"%{filters['uploader']}%"))
+        query = query.filter(Document.uploaded_by.in_(matching_users))
+    if filters['date_from']:
+        query = query.filter(Document.uploaded_at >= _parse_date(filters['date_from']))
+    if filters['date_to']:
+        query = query.filter(Document.uploaded_at < _parse_date(filters['date_to']) + timedelta(days=1))
+    if filters['min_size']:
+        query = query.filter(Document.file_size >= int(filters['min_size']))
+    if filters['max_size']:
+        query = query.filter(Document.file_size <= int(filters['max_size']))
+    return query
+
+
+def catalog_page(filters, cursor=None, limit=CATALOG_PAGE_SIZE):
+    """
+    One page of matching documents, newest first, with project and uploader
+    loaded. Returns (documents, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(limit, CATALOG_MAX_PAGE_SIZE))
+    query = apply_catalog_filters(Document.query, filters)
+    if cursor:
+        query = query.filter(tuple_(Document.uploaded_at, Document.id) < tuple_(*decode_cursor(cursor)))
+    documents = (query.options(joinedload(Document.project), joinedload(Document.uploader))
+                 .order_by(Document.uploaded_at.desc(), Document.id.desc())
+                 .limit(limit + 1).all())
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return documents[:limit], next_cursor
+
+
+def catalog_totals(filters):
+    """Number and total size in bytes of the documents matching filters"""
+    count, total_bytes = apply_catalog_filters(
+        db.session.query(func.count(Document.id), func.coalesce(func.sum(Document.file_size), 0)), filters
+    ).one()
+    return count, total_bytes
@@ -0,0 +1,236 @@
+"""
+Document storage integrity
+Checks stored files against the database with a thread pool: every blob for
+existence, stored size and (optionally) the SHA-256 of its content, and
+documents from before the blob store for existence and size. Also finds
+files no row refers to, which can be reported or moved to quarantine. The
+archive tier is left out unless asked for: its files only change when
+tier_documents.py moves them. Rows are read in keyset batches and file
+listings matched against the database a batch at a time, so memory stays
+flat however many documents there are.
+"""
+import hashlib
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import func
+
+from document_store import CHUNK_SIZE
+from models import db, Document, DocumentBlob
+from storage_backends import ARCHIVE_PREFIX
+
+# Blobs are placed before their upload's row commits; younger unreferenced files may still be claimed
+ORPHAN_GRACE_SECONDS = 3600
+
+QUARANTINE_DIR = 'quarantine'
+
+# kind: missing, size_mismatch, checksum_mismatch, unreadable, ref_count or orphan
+IntegrityIssue = namedtuple('IntegrityIssue', ['kind', 'location', 'detail'])
+
+
+def _check_blob(store, blob, verify_checksums):
+    """(kind, detail) of a problem with one blob, or None when it is intact"""
+    storage_key, sha256, size, stored_size = blob
+    try:
+        actual_size = store.backend.size(storage_key)
+        if actual_size is None:
+            return 'missing', None
+        if actual_size != stored_size:
+            return 'size_mismatch', f'{actual_size} bytes stored, expected {stored_size}'
+        if verify_checksums:
+            # Compressed blobs are hashed as their original content
+            digest, length = hashlib.sha256(), 0
+            with store.open(storage_key) as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    length += len(chunk)
+            if digest.hexdigest() != sha256 or length != size:
+                return 'checksum_mismatch', f'content is {length} bytes with SHA-256 {digest.hexdigest()}'
+    except Exception as e:
+        return 'unreadable', f'{type(e).__name__}: {e}'
+    return None
+
+
+def _check_legacy_file(document):
+    """(kind, detail) of a problem with a pre-blob-store document's file, or None"""
+    _, file_path, file_size = document
+    try:
+        actual_size = os.path.getsize(file_path)
+    except FileNotFoundError:
+        return 'missing', None
+    except OSError as e:
+        return 'unreadable', f'{type(e).__name__}: {e}'
+    if file_size is not None and actual_size != file_size:
+        return 'size_mismatch', f'{actual_size} bytes on disk, expected {file_size}'
+    return None
+
+
+def _document_ids(content_hash):
+    return [row[0] for row in db.session.query(Document.id).filter(Document.content_hash == content_hash)]
+
+
+def verify_documents(store, pool, batch_size=500, verify_checksums=True, report=print, include_archive=False):
+    """
+    Check every blob (archived ones too with include_archive) and legacy
+    document file; returns (files checked, issues). Each issue is passed to
+    report as it is found.
+    """
+    issues, checked = [], 0
+
+    stored_size = func.coalesce(DocumentBlob.stored_size, DocumentBlob.size)
+    tiers = [] if include_archive else [~DocumentBlob.storage_key.startswith(ARCHIVE_PREFIX)]
+    last_id = 0
+    while True:
+        blobs = (db.session.query(DocumentBlob.id, DocumentBlob.storage_key, DocumentBlob.sha256,
+                                  DocumentBlob.size, stored_size)
+                 .filter(DocumentBlob.id > last_id, *tiers).order_by(DocumentBlob.id).limit(batch_size).all())
+        if not blobs:
+            break
+        last_id = blobs[-1].id
+        results = pool.map(lambda blob: _check_blob(store, blob[1:], verify_checksums), blobs)
+        for blob, problem in zip(blobs, results):
+            if problem:
+                kind, detail = problem
+                documents = ', '.join(str(document_id) for document_id in _document_ids(blob.sha256)) or 'none'
+                issue = IntegrityIssue(kind, blob.storage_key, f"{detail or ''} (documents {documents})".strip())
+                issues.append(issue)
+                report(issue)
+        checked += len(blobs)
+
+    last_id = 0
+    while True:
+        documents = (db.session.query(Document.id, Document.file_path, Document.file_size)
+                     .filter(Document.content_hash.is_(None), Document.id > last_id)
+                     .order_by(Document.id).limit(batch_size).all())
+        if not documents:
+            break
+        last_id = documents[-1].id
+        for document, problem in zip(documents, pool.map(_check_legacy_file, documents)):
+            if problem:
+                kind, detail = problem
+                issue = IntegrityIssue(kind, document.file_path, f"{detail or ''} (document {document.id})".strip())
+                issues.append(issue)
+                report(issue)
+        checked += len(documents)
+
+    # Documents pointing at a blob row that is gone, and reference counts that drifted
+    dangling = (db.session.query(Document.id, Document.file_path)
+                .outerjoin(DocumentBlob, DocumentBlob.sha256 == Document.content_hash)
+                .filter(Document.content_hash.isnot(None), DocumentBlob.id.is_(None)))
+    for document_id, file_path in dangling:
+        issue = IntegrityIssue('missing', file_path, f'no document_blob row (document {document_id})')
+        issues.append(issue)
+        report(issue)
+    references = func.count(Document.id)
+    drifted = (db.session.query(DocumentBlob.storage_key, DocumentBlob.ref_count, references)
+               .outerjoin(Document, Document.content_hash == DocumentBlob.sha256)
+               .group_by(DocumentBlob.id).having(DocumentBlob.ref_count != references))
+    for storage_key, ref_count, actual in drifted:
+        issue = IntegrityIssue('ref_count', storage_key, f'ref_count {ref_count}, referenced by {actual} documents')
+        issues.append(issue)
+        report(issue)
+    return checked, issues
+
+
+def _batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _legacy_files(root_dir, cutoff):
+    if not os.path.isdir(root_dir):
+        return
+    with os.scandir(root_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                yield entry
+
+
+def _is_quarantined(storage_key):
+    if storage_key.startswith(ARCHIVE_PREFIX):
+        storage_key = storage_key[len(ARCHIVE_PREFIX):]
+    return storage_key.startswith(QUARANTINE_DIR + '/')
+
+
+def find_orphans(store, batch_size=500, grace_seconds=ORPHAN_GRACE_SECONDS, include_archive=False):
+    """
+    Yield (location, size) of files no row refers to: blobs without a
+    document_blob row (in the archive tier too with include_archive), and
+    files left in the store directory by the pre-blob-store upload code
+    without a document row. Files younger than grace_seconds are skipped,
+    since an upload may still be committing them.
+    """
+    cutoff = time.time() - grace_seconds
+
+    stored_keys = store.backend.iter_keys() if include_archive else store.backend.hot.iter_keys()
+    blob_keys = ((key, size) for key, size, modified in stored_keys
+                 if modified < cutoff and not _is_quarantined(key))
+    for batch in _batches(blob_keys, batch_size):
+        known = {row[0] for row in db.session.query(DocumentBlob.storage_key)
+                 .filter(DocumentBlob.storage_key.in_([key for key, _ in batch]))}
+        for key, size in batch:
+            if key not in known:
+                yield key, size
+
+    # Old-style uploads sit directly in the store directory, named by their Document.filename
+    for batch in _batches(_legacy_files(store.root_dir, cutoff), batch_size):
+        known = {row[0] for row in db.session.query(Document.filename)
+                 .filter(Document.content_hash.is_(None), Document.filename.in_([entry.name for entry in batch]))}
+        for entry in batch:
+            if entry.name not in known:
+                yield entry.path, entry.stat().st_size
+
+
+def quarantine_orphan(store, location, stamp):
+    """
+    Move an orphaned file under quarantine/<stamp>/: inside its storage
+    tier for blobs, under the store directory for old-style files. Returns
+    the new location.
+    """
+    if os.path.isabs(location):
+        target = os.path.join(store.root_dir, QUARANTINE_DIR, stamp, os.path.basename(location))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(location, target)
+        return target
+    tier = ARCHIVE_PREFIX if location.startswith(ARCHIVE_PREFIX) else ''
+    target = f'{tier}{QUARANTINE_DIR}/{stamp}/{location[len(tier):]}'
+    store.backend.rename(location, target)
+    return target
+
+
+def scan_storage(store, workers=8, batch_size=500, verify_checksums=True, orphans=True, quarantine=False,
+                 grace_seconds=ORPHAN_GRACE_SECONDS, report=print, include_archive=False):
+    """
+    Verify stored documents and look for orphaned files, moving orphans to
+    quarantine when asked. Returns counters and the list of issues.
+    """
+    with ThreadPoolExecutor(workers) as pool:
+        checked, issues = verify_documents(store, pool, batch_size, verify_checksums, report, include_archive)
+
+    results = {'checked': checked, 'orphans': 0, 'orphan_bytes': 0, 'quarantined': 0}
+    if orphans:
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for location, size in find_orphans(store, batch_size, grace_seconds, include_archive):
+            results['orphans'] += 1
+            results['orphan_bytes'] += size
+            detail = f'{size} bytes'
+            if quarantine:
+                try:
+                    detail += f', moved to {quarantine_orphan(store, location, stamp)}'
+                    results['quarantined'] += 1
+                except Exception as e:
+                    detail += f', not moved: {e}'
+            issue = IntegrityIssue('orphan', location, detail)
+            issues.append(issue)
+            report(issue)
+    results['issues'] = issues
+    return results
@@ -0,0 +1,252 @@
+"""
+Document previews
+Thumbnails of image uploads (and of the preview picture Office embeds in
+docx/pptx/xlsx files) and a short text preview of PDFs, Word, PowerPoint,
+Excel and text files. Previews are generated in a background process pool
+(fetching documents in object storage to a temp file first) and cached on
+local disk by content hash, so identical files share them; the
+cache is trimmed least recently used first. Thumbnails need the optional
+Pillow package and PDF previews the optional pypdf package.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are optional
+    Image = None
+
+from storage_backends import local_copy
+from text_extraction import UnsupportedDocument, extract_text, normalize_text, pypdf
+
+THUMBNAIL_SIZE = (320, 320)
+PREVIEW_TEXT_CHARS = 1500
+
+IMAGE_TYPES = {'jpg', 'jpeg', 'png', 'gif'}
+EMBEDDED_THUMBNAIL_TYPES = {'docx', 'pptx', 'xlsx'}
+TEXT_PREVIEW_TYPES = {'pdf', 'docx', 'pptx', 'xlsx', 'txt'}
+
+# Preview kind -> cache file extension
+PREVIEW_KINDS = {'thumbnail': 'jpg', 'text': 'txt'}
+
+# Cache hits refresh a file's mtime (its LRU position) at most this often
+_TOUCH_INTERVAL = 3600
+
+logger = logging.getLogger(__name__)
+
+
+def preview_kinds(file_type):
+    """Preview kinds that can be generated for a file type"""
+    file_type = (file_type or '').lower()
+    kinds = []
+    if Image is not None and (file_type in IMAGE_TYPES or file_type in EMBEDDED_THUMBNAIL_TYPES):
+        kinds.append('thumbnail')
+    if file_type in TEXT_PREVIEW_TYPES and (file_type != 'pdf' or pypdf is not None):
+        kinds.append('text')
+    return kinds
+
+
+def _embedded_thumbnail(path):
+    """Bytes of the thumbnail picture an Office file was saved with, or None"""
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            if name.lower() in ('docprops/thumbnail.jpeg', 'docprops/thumbnail.jpg', 'docprops/thumbnail.png'):
+                return archive.read(name)
+    return None
+
+
+def _write_thumbnail(path, file_type, target):
+    """Write a JPEG thumbnail of an image or Office file; False when there is nothing to show"""
+    source = path
+    if file_type in EMBEDDED_THUMBNAIL_TYPES:
+        data = _embedded_thumbnail(path)
+        if data is None:
+            return False
+        source = io.BytesIO(data)
+
+    with Image.open(source) as image:
+        # JPEGs are decoded straight at a reduced scale instead of at full resolution
+        image.draft('RGB', THUMBNAIL_SIZE)
+        image.thumbnail(THUMBNAIL_SIZE)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(target, 'JPEG', quality=80, optimize=True)
+    return True
+
+
+def _write_text_preview(path, file_type, target):
+    """Write the start of a document's text; False when it has none"""
+    if file_type == 'pdf':
+        if pypdf is None:
+            raise UnsupportedDocument('PDF previews need the pypdf package')
+        reader = pypdf.PdfReader(path)
+        text = normalize_text(reader.pages[0].extract_text() or '') if reader.pages else ''
+    else:
+        text = extract_text(path, file_type)
+    if not text:
+        return False
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write(text[:PREVIEW_TEXT_CHARS])
+    return True
+
+
+def generate_preview(task):
+    """
+    Process pool entry point: (storage backend, location, file_type, kind,
+    target) -> bytes written. An empty target records that the file has no
+    preview, so it isn't retried. Never raises.
+    """
+    backend, location, file_type, kind, target = task
+    temp_path = f'{target}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        writer = _write_thumbnail if kind == 'thumbnail' else _write_text_preview
+        try:
+            with local_copy(backend, location) as path:
+                created = writer(path, file_type.lower(), temp_path)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            logger.warning(f"No {kind} preview for {location}: {type(e).__name__}: {e}")
+            created = False
+        if not created:
+            open(temp_path, 'wb').close()
+        os.replace(temp_path, target)
+        return os.path.getsize(target)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return 0
+
+
+class PreviewCache:
+    """Preview files under cache_dir/<aa>/<sha256>.<kind>.<ext>, trimmed to max_bytes"""
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def path_for(self, content_hash, kind):
+        return os.path.join(self.cache_dir, content_hash[:2], f'{content_hash}.{kind}.{PREVIEW_KINDS[kind]}')
+
+    def get(self, content_hash, kind):
+        """Path of a cached preview (empty when the file has none), or None if not generated yet"""
+        path = self.path_for(content_hash, kind)
+        try:
+            modified = os.path.getmtime(path)
+            if time.time() - modified > _TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def remove(self, content_hash):
+        """Drop every cached preview of a content hash"""
+        for kind in PREVIEW_KINDS:
+            try:
+                os.remove(self.path_for(content_hash, kind))
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Remove least recently used previews until the cache is back under 90% of max_bytes"""
+        entries, total = [], 0
+        for root, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue  # Still being written
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return 0
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+class PreviewGenerator:
+    """
+    Generates previews in a small process pool so pages never wait on it.
+    Like the text extraction pool it starts on first use, with the spawn
+    start method. Each preview is generated at most once at a time.
+    """
+
+    def __init__(self, cache, backend, max_workers=2):
+        self.cache = cache
+        self.backend = backend
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        # Trim after the first preview, then whenever another 5% of the budget has been written
+        self._written_since_evict = cache.max_bytes
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def submit(self, content_hash, location, file_type, kind):
+        """Queue generation of one preview unless it is cached or already queued"""
+        target = self.cache.path_for(content_hash, kind)
+        with self._lock:
+            if target in self._pending or os.path.exists(target):
+                return
+            self._pending.add(target)
+        try:
+            future = self._pool().submit(generate_preview, (self.backend, location, file_type, kind, target))
+        except Exception:
+            with self._lock:
+                self._pending.discard(target)
+            raise
+        future.add_done_callback(lambda done: self._finish(done, target))
+
+    def submit_document(self, document):
+        """Queue every preview a document can have"""
+        if document.content_hash:
+            for kind in preview_kinds(document.file_type):
+                self.submit(document.content_hash, document.file_path, document.file_type, kind)
+
+    def _finish(self, future, target):
+        with self._lock:
+            self._pending.discard(target)
+            self._written_since_evict += future.result() if not future.exception() else 0
+            evict = self._written_since_evict >= self.cache.max_bytes * 0.05
+            if evict:
+                self._written_since_evict = 0
+        if evict:
+            try:
+                self.cache.evict()
+            except Exception as e:
+                logger.error(f"Preview cache eviction failed: {type(e).__name__}: {e}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
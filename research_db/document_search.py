@@ -0,0 +1,243 @@
+"""
+Document full-text search
+Extracted document text is kept in an SQLite FTS5 table (rowid = document id)
+next to a DocumentExtraction status row. New uploads are extracted in a local
+process pool; reindex_documents() rebuilds the index in bulk.
+"""
+import html
+import logging
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload
+
+from models import db, Document, DocumentExtraction
+from text_extraction import extract_for_index
+
+FTS_TABLE = 'document_fts'
+
+# Characters of document text shown around the first match in search results
+SNIPPET_CHARS = 240
+
+logger = logging.getLogger(__name__)
+
+
+def search_index_available():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def create_search_index():
+    """Create the FTS5 table if missing (SQLite only); returns whether search is available"""
+    if not search_index_available():
+        return False
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "content, project_id UNINDEXED, tokenize='porter unicode61')"
+    ))
+    db.session.commit()
+    return True
+
+
+def remove_document_text(document_id):
+    """Drop a document's text and extraction state (in the current transaction)"""
+    if search_index_available():
+        db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': document_id})
+    DocumentExtraction.query.filter_by(document_id=document_id).delete()
+
+
+def store_extraction(document_id, project_id, status, content, error=None):
+    """Replace a document's indexed text and extraction state (in the current transaction)"""
+    remove_document_text(document_id)
+    if content:
+        db.session.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, content, project_id) VALUES (:id, :content, :project_id)"),
+            {'id': document_id, 'content': content, 'project_id': project_id}
+        )
+    db.session.add(DocumentExtraction(document_id=document_id, status=status, char_count=len(content or ''),
+                                      error=error, extracted_at=datetime.utcnow()))
+
+
+def indexed_text_for_hash(content_hash, exclude_id):
+    """Text already extracted from another document with identical content, or None"""
+    if not content_hash:
+        return None
+    row = db.session.execute(text(
+        f"SELECT {FTS_TABLE}.content FROM {FTS_TABLE} JOIN document ON document.id = {FTS_TABLE}.rowid "
+        f"WHERE document.content_hash = :hash AND document.id != :id LIMIT 1"
+    ), {'hash': content_hash, 'id': exclude_id}).first()
+    return row[0] if row else None
+
+
+def _query_words(query):
+    return re.findall(r'\w+', query or '')
+
+
+def fts_query(query):
+    """
+    Turn free text into an FTS5 query: every word must match, the last one
+    as a prefix (so results appear while typing). None when there are no words.
+    """
+    words = _query_words(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight_snippet(snippet, words, leading=False, trailing=False):
+    """HTML for a snippet: escaped text with <mark> around words starting with one of the query words"""
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in words) + r')\w*', re.IGNORECASE)
+    parts, position = [], 0
+    for found in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[position:found.start()]))
+        parts.append(f'<mark>{html.escape(found.group())}</mark>')
+        position = found.end()
+    parts.append(html.escape(snippet[position:]))
+    return ('…' if leading else '') + ''.join(parts) + ('…' if trailing else '')
+
+
+def _snippet(document_id, words):
+    """
+    Text around the first literal occurrence of a query word (the start of
+    the document when only a stemmed form matched). FTS5's snippet() scores
+    every phrase hit, which on long repetitive documents takes minutes, so
+    the window is cut out with instr()/substr() instead.
+    """
+    positions = ', '.join(f'instr(lower(content), :word{i})' for i in range(len(words)))
+    params = {f'word{i}': word.lower() for i, word in enumerate(words)}
+    params['id'] = document_id
+    row = db.session.execute(text(f"SELECT length(content), {positions} FROM {FTS_TABLE} WHERE rowid = :id"),
+                             params).first()
+    if row is None:
+        return ''
+    length, found = row[0], [position for position in row[1:] if position]
+    start = max(min(found) - SNIPPET_CHARS // 3, 1) if found else 1
+    window = db.session.execute(text(f"SELECT substr(content, :start, :chars) FROM {FTS_TABLE} WHERE rowid = :id"),
+                                {'id': document_id, 'start': start, 'chars': SNIPPET_CHARS}).scalar()
+    return highlight_snippet(window, words, leading=start > 1, trailing=start + SNIPPET_CHARS <= length)
+
+
+def search_documents(query, project_id=None, document_type=None, limit=20, offset=0):
+    """Matching documents, best first, as (Document, snippet HTML) pairs; also returns the total match count"""
+    match = fts_query(query)
+    if match is None or not search_index_available():
+        return [], 0
+
+    filters = ''
+    params = {'match': match, 'limit': limit, 'offset': offset}
+    if project_id:
+        filters += ' AND document.project_id = :project_id'
+        params['project_id'] = project_id
+    if document_type:
+        filters += ' AND document.document_type = :document_type'
+        params['document_type'] = document_type
+
+    base = f"FROM {FTS_TABLE} JOIN document ON document.id = {FTS_TABLE}.rowid WHERE {FTS_TABLE} MATCH :match{filters}"
+    total = db.session.execute(text(f"SELECT COUNT(*) {base}"), params).scalar()
+    document_ids = db.session.execute(text(
+        f"SELECT {FTS_TABLE}.rowid {base} ORDER BY bm25({FTS_TABLE}) LIMIT :limit OFFSET :offset"
+    ), params).scalars().all()
+
+    documents = {
+        document.id: document
+        for document in Document.query.options(joinedload(Document.project))
+        .filter(Document.id.in_(document_ids))
+    }
+    words = _query_words(query)
+    return [(documents[document_id], _snippet(document_id, words))
+            for document_id in document_ids if document_id in documents], total
+
+
+def _extraction_task(document, backend):
+    return document.id, backend, document.file_path, document.file_type
+
+
+class DocumentIndexer:
+    """
+    Extracts the text of new uploads in a small process pool so requests
+    never wait on it. The pool starts on first use, per worker process, with
+    the spawn start method so children don't inherit the server's threads.
+    """
+
+    def __init__(self, app, backend, max_workers=2):
+        self.app = app
+        self.backend = backend
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def submit(self, document):
+        """Queue a freshly committed document for extraction"""
+        if not self.app.config['DOCUMENT_SEARCH_ENABLED'] or not search_index_available():
+            return
+        project_id = document.project_id
+
+        # Identical content was extracted before - reuse its text instead of parsing the file again
+        content = indexed_text_for_hash(document.content_hash, document.id)
+        if content is not None:
+            store_extraction(document.id, project_id, 'indexed', content)
+            db.session.commit()
+            return
+
+        future = self._pool().submit(extract_for_index, _extraction_task(document, self.backend))
+        future.add_done_callback(lambda done: self._finish(done, project_id))
+
+    def _finish(self, future, project_id):
+        try:
+            document_id, status, content, error = future.result()
+            with self.app.app_context():
+                # The document may have been deleted while it was being extracted
+                if db.session.get(Document, document_id) is not None:
+                    store_extraction(document_id, project_id, status, content, error)
+                    db.session.commit()
+        except Exception as e:
+            logger.error(f"Document text extraction failed: {type(e).__name__}: {e}")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def reindex_documents(backend, workers=2, batch_size=100, only_missing=True, project_id=None, log=print):
+    """
+    Extract and index documents stored in backend in id order, batch_size at
+    a time, with a process pool. By default only documents without an extraction are done.
+    Returns counts per extraction status.
+    """
+    create_search_index()
+    counts = {'indexed': 0, 'empty': 0, 'unsupported': 0, 'failed': 0, 'missing': 0}
+    last_id = 0
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        while True:
+            query = Document.query.filter(Document.id > last_id)
+            if only_missing:
+                query = query.outerjoin(DocumentExtraction).filter(DocumentExtraction.document_id.is_(None))
+            if project_id:
+                query = query.filter(Document.project_id == project_id)
+            documents = query.order_by(Document.id).limit(batch_size).all()
+            if not documents:
+                break
+            last_id = documents[-1].id
+            project_ids = {document.id: document.project_id for document in documents}
+
+            for document_id, status, content, error in pool.map(extract_for_index,
+                                                                [_extraction_task(d, backend) for d in documents]):
+                if status == 'failed' and error and error.startswith('FileNotFoundError'):
+                    status = 'missing'
+                store_extraction(document_id, project_ids[document_id],
+                                 'failed' if status == 'missing' else status, content, error)
+                counts[status] += 1
+            db.session.commit()
+            db.session.expunge_all()
+            log(f"   {sum(counts.values())} documents processed...")
+    return counts
@@ -0,0 +1,427 @@
+"""
+Content-addressed document storage
+Uploads are hashed with SHA-256 while they stream to a local temp file and
+stored once per distinct content under the storage key <first two hex
+digits>/<sha256>, plus .gz or .zst when the store compresses blobs at rest,
+in a local or S3 backend (see storage_backends), or under archive/<key> in
+the archive tier once only long-closed projects use it (see document_tiers).
+Document rows keep the storage key and reference a DocumentBlob, whose
+reference count decides when the file goes.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+from collections import namedtuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from models import db, Document, DocumentBlob
+from storage_backends import ARCHIVE_PREFIX, LocalBackend, TieredBackend, is_legacy_location, local_copy, open_location
+from storage_compression import (CODEC_EXTENSIONS, COMPRESSIBLE_TYPES, MIN_SAVING, codec_for_path,
+                                 compress_file)
+
+CHUNK_SIZE = 1024 * 1024
+
+# Multipart boundaries and the other form fields of a document upload
+FORM_OVERHEAD_BYTES = 1024 * 1024
+
+
+# Where a blob ended up: created is False when identical content was already stored
+StoredBlob = namedtuple('StoredBlob', ['storage_key', 'stored_size', 'compression', 'created'])
+
+
+def blob_storage_key(sha256):
+    """Storage key of a blob, relative to the store's blob directory"""
+    return f'{sha256[:2]}/{sha256}'
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """SHA-256 and size of a file on disk, read in chunks"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class HashingUploadFile:
+    """
+    Temp file handed to the multipart parser: every chunk the parser writes is
+    hashed and counted as it arrives, and the upload is cut off as soon as it
+    passes max_size. Unless claimed, the file is removed when the request closes it.
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._file = open(path, 'w+b')
+        self._claimed = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge(f'Documents are limited to {self.max_size // (1024 * 1024)} MB.')
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def claim(self):
+        """Take ownership of the received file; returns (temp_path, sha256, size)"""
+        self._file.close()
+        self._claimed = True
+        return self.path, self._digest.hexdigest(), self.size
+
+    def close(self):
+        self._file.close()
+        if not self._claimed:
+            DocumentStore.discard(self.path)
+
+    def __getattr__(self, name):
+        # read, readline, seek, tell, flush... as the parser and FileStorage expect
+        return getattr(self._file, name)
+
+
+class DocumentStore:
+    """
+    Blob files in a storage backend (by default under root_dir/blobs) and an
+    archive tier (by default root_dir/archive), with uploads received into
+    root_dir/tmp; database bookkeeping lives in the functions below. With a
+    compression codec, eligible formats are compressed as they are placed;
+    the archive tier tries archive_compression on every format.
+
+    Methods taking a location accept a Document's file_path: a storage key,
+    or the full local path of a document from before the blob store.
+    """
+
+    def __init__(self, root_dir, compression=None, backend=None, archive_dir=None, archive_compression='gzip'):
+        self.root_dir = root_dir
+        self.compression = compression
+        self.archive_compression = archive_compression
+        self.backend = TieredBackend(backend or LocalBackend(os.path.join(root_dir, 'blobs')),
+                                     LocalBackend(archive_dir or os.path.join(root_dir, 'archive')))
+        self.temp_dir = os.path.join(root_dir, 'tmp')
+
+    def open(self, location):
+        """Binary file object with a document's original content"""
+        return open_location(self.backend, location)
+
+    def local_path(self, location):
+        """Local path of a document stored uncompressed on this machine, or None when it has to be streamed"""
+        if codec_for_path(location):
+            return None
+        return location if is_legacy_location(location) else self.backend.local_path(location)
+
+    def local_copy(self, location):
+        return local_copy(self.backend, location)
+
+    def exists(self, location):
+        return os.path.exists(location) if is_legacy_location(location) else self.backend.exists(location)
+
+    def new_temp_path(self):
+        os.makedirs(self.temp_dir, exist_ok=True)
+        return os.path.join(self.temp_dir, f'{uuid.uuid4().hex}.part')
+
+    def open_upload(self, max_size=None):
+        return HashingUploadFile(self.new_temp_path(), max_size)
+
+    def receive(self, stream, chunk_size=CHUNK_SIZE, max_size=None):
+        """
+        Copy a file-like stream into a temp file, hashing it on the way.
+        Returns (temp_path, sha256, size); the temp file sits on the same
+        filesystem as local blobs so placing it there is a rename, and is
+        uploaded in parts when blobs live in S3.
+        """
+        if isinstance(stream, HashingUploadFile):
+            # Already written and hashed while the form was parsed
+            return stream.claim()
+        upload = self.open_upload(max_size)
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                upload.write(chunk)
+        except BaseException:
+            upload.close()
+            raise
+        return upload.claim()
+
+    def find_blob(self, sha256):
+        """StoredBlob of content already stored, raw or compressed, hot or archived, or None"""
+        raw_key = blob_storage_key(sha256)
+        for prefix in ['', ARCHIVE_PREFIX]:
+            for storage_key in [raw_key] + [raw_key + extension for extension in CODEC_EXTENSIONS.values()]:
+                stored_size = self.backend.size(prefix + storage_key)
+                if stored_size is not None:
+                    return StoredBlob(prefix + storage_key, stored_size, codec_for_path(storage_key), False)
+        return None
+
+    def place(self, temp_path, sha256, file_type=None, discard_duplicate=True):
+        """
+        Move a received file into the backend, compressing it first when
+        the store compresses and the format is worth it. Returns a StoredBlob;
+        when identical content is already stored the temp file is dropped,
+        or left to the caller with discard_duplicate=False.
+        """
+        existing = self.find_blob(sha256)
+        if existing is not None:
+            if discard_duplicate:
+                self.discard(temp_path)
+            return existing
+        return self.put_blob(temp_path, sha256, file_type)
+
+    def put_blob(self, temp_path, sha256, file_type=None):
+        """Move a file into the hot backend as a new blob, compressed if worth it; returns its StoredBlob"""
+        storage_key = blob_storage_key(sha256)
+        if self.compression and (file_type or '').lower() in COMPRESSIBLE_TYPES:
+            stored = self._put_compressed(temp_path, storage_key, self.compression)
+            if stored is not None:
+                self.discard(temp_path)
+                return stored
+        size = os.path.getsize(temp_path)
+        self.backend.put_file(storage_key, temp_path, move=True)
+        return StoredBlob(storage_key, size, None, True)
+
+    def _put_compressed(self, path, storage_key, codec):
+        """Store a compressed copy of path under storage_key plus the codec's extension; None if it saves too little"""
+        size = os.path.getsize(path)
+        if not size:
+            return None
+        compressed_path = f'{self.new_temp_path()}{CODEC_EXTENSIONS[codec]}'
+        try:
+            stored_size = compress_file(path, compressed_path, codec)
+            if stored_size > size * (1 - MIN_SAVING):
+                return None
+            compressed_key = storage_key + CODEC_EXTENSIONS[codec]
+            self.backend.put_file(compressed_key, compressed_path, move=True)
+            return StoredBlob(compressed_key, stored_size, codec, True)
+        finally:
+            self.discard(compressed_path)
+
+    def archive_blob(self, storage_key):
+        """
+        Copy a hot blob into the archive tier, compressed there when it isn't
+        already and that saves enough. Returns the archived StoredBlob; the hot
+        copy is left for the caller to remove.
+        """
+        archive_key = ARCHIVE_PREFIX + storage_key
+        with self.backend.local_copy(storage_key) as path:
+            if self.archive_compression and codec_for_path(storage_key) is None:
+                stored = self._put_compressed(path, archive_key, self.archive_compression)
+                if stored is not None:
+                    return stored
+            self.backend.put_file(archive_key, path)
+            return StoredBlob(archive_key, os.path.getsize(path), codec_for_path(storage_key), True)
+
+    def unarchive_blob(self, archive_key, sha256, file_type=None):
+        """
+        Copy an archived blob back into the hot backend, stored the way an
+        upload of it would be. Returns the hot StoredBlob; the archived copy is
+        left for the caller to remove.
+        """
+        temp_path = self.new_temp_path()
+        try:
+            with self.open(archive_key) as source, open(temp_path, 'wb') as target:
+                shutil.copyfileobj(source, target, CHUNK_SIZE)
+            return self.put_blob(temp_path, sha256, file_type)
+        finally:
+            self.discard(temp_path)
+
+    def remove(self, storage_key):
+        self.backend.delete(storage_key)
+
+    @staticmethod
+    def discard(temp_path):
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+
+def init_document_uploads(app, store, endpoints, limits):
+    """
+    Stream multipart file parts of the given endpoints straight into the
+    store's temp directory instead of Werkzeug's spooled temp files, and
+    apply per-endpoint request size limits (endpoint -> bytes) so an oversize
+    body is refused from its Content-Length before any of it is read.
+    """
+    endpoints = set(endpoints)
+    base_request_class = app.request_class
+
+    class DocumentUploadRequest(base_request_class):
+
+        @property
+        def max_content_length(self):
+            if self.endpoint in limits:
+                return limits[self.endpoint]
+            return super().max_content_length
+
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            if self.endpoint in endpoints:
+                return store.open_upload(self.max_content_length)
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+    app.request_class = DocumentUploadRequest
+
+
+def add_blob_reference(sha256, size):
+    """
+    Count one more reference to a blob in the current transaction, creating
+    the DocumentBlob row on first use. Returns the storage key.
+    """
+    storage_key = blob_storage_key(sha256)
+    table = DocumentBlob.__table__
+    increment = table.update().where(table.c.sha256 == sha256).values(ref_count=table.c.ref_count + 1)
+    if db.session.execute(increment).rowcount:
+        return storage_key
+    try:
+        # A savepoint, so losing the insert race to a concurrent upload only rolls back this statement
+        with db.session.begin_nested():
+            db.session.execute(table.insert().values(sha256=sha256, size=size, storage_key=storage_key, ref_count=1))
+    except IntegrityError:
+        db.session.execute(increment)
+    return storage_key
+
+
+def record_blob_storage(sha256, stored, previous_keys=None):
+    """
+    Record where and how a placed blob is stored, in the current transaction;
+    with previous_keys only if the row still has one of them. Returns whether
+    the row was updated.
+    """
+    table = DocumentBlob.__table__
+    update = table.update().where(table.c.sha256 == sha256)
+    if previous_keys is not None:
+        update = update.where(table.c.storage_key.in_(previous_keys))
+    return db.session.execute(update.values(
+        storage_key=stored.storage_key, stored_size=stored.stored_size, compression=stored.compression
+    )).rowcount > 0
+
+
+def follow_moved_blob(store, sha256, stored):
+    """
+    Point the blob row and documents still using a storage key that no longer
+    exists at stored, the blob's current location, once it has moved between
+    tiers; in the current transaction. Returns the number of documents updated.
+    """
+    keys = [row[0] for row in db.session.query(Document.file_path).filter(
+        Document.content_hash == sha256, Document.file_path != stored.storage_key
+    ).distinct()]
+    stale = [key for key in keys if not store.exists(key)]
+    if not stale:
+        return 0
+    record_blob_storage(sha256, stored, previous_keys=stale)
+    return Document.query.filter(Document.content_hash == sha256, Document.file_path.in_(stale)).update(
+        {'file_path': stored.storage_key}, synchronize_session=False
+    )
+
+
+def release_blob_reference(sha256):
+    """
+    Drop one reference to a blob in the current transaction. Returns the
+    storage key when that was the last reference, so the caller can remove
+    the file once the transaction has committed; otherwise None.
+    """
+    table = DocumentBlob.__table__
+    db.session.execute(
+        table.update().where(table.c.sha256 == sha256).values(ref_count=table.c.ref_count - 1)
+    )
+    blob = db.session.execute(
+        table.select().where(table.c.sha256 == sha256, table.c.ref_count <= 0)
+    ).first()
+    if blob is None:
+        return None
+    db.session.execute(table.delete().where(table.c.id == blob.id))
+    return blob.storage_key
+
+
+def remove_released_blob(store, sha256, storage_key):
+    """
+    Remove a released blob's file, unless a new upload of the same content has
+    claimed it since. The file is moved aside before a second check, so an
+    upload committing in between either gets it moved back or, finding it
+    gone, stores its own copy (see restore_blob).
+    """
+    if DocumentBlob.query.filter_by(sha256=sha256).first() is not None:
+        return
+    released_key = f'{storage_key}.{uuid.uuid4().hex}.released'
+    if not store.backend.rename(storage_key, released_key):
+        return
+    if DocumentBlob.query.filter_by(sha256=sha256).first() is not None:
+        store.backend.rename(released_key, storage_key)
+    else:
+        store.remove(released_key)
+
+
+def restore_blob(store, sha256, temp_path, file_type=None):
+    """
+    Once a reference to content that place() found already stored has
+    committed: store the upload's own copy from temp_path if a concurrent
+    release removed the file in the meantime, or follow it if it has moved to
+    another tier, then drop temp_path. Returns whether the blob had to be
+    restored. Call it with no write pending: the copy is stored before any
+    row is touched, so no database lock is held while it uploads.
+    """
+    try:
+        existing = store.find_blob(sha256)
+        if existing is not None:
+            if follow_moved_blob(store, sha256, existing):
+                db.session.commit()
+            return False
+        stored = store.place(temp_path, sha256, file_type)
+        record_blob_storage(sha256, stored)
+        # The restored copy may be compressed differently from the one it replaces
+        Document.query.filter_by(content_hash=sha256).update({'file_path': stored.storage_key})
+        db.session.commit()
+        return True
+    finally:
+        store.discard(temp_path)
+
+
+def storage_totals():
+    """
+    Logical bytes (every document at its original size) against bytes on
+    disk after deduplication and compression, overall, per codec and per
+    file type (logical only, since identical files may have different names).
+    Documents not yet in the blob store count as stored raw.
+    """
+    documents = db.session.query(
+        func.count(Document.id), func.coalesce(func.sum(Document.file_size), 0)
+    ).one()
+    legacy = db.session.query(
+        func.count(Document.id), func.coalesce(func.sum(Document.file_size), 0)
+    ).filter(Document.content_hash.is_(None)).one()
+
+    stored_size = func.coalesce(DocumentBlob.stored_size, DocumentBlob.size)
+    codec = func.coalesce(DocumentBlob.compression, 'none')
+    by_codec = db.session.query(
+        codec, func.count(DocumentBlob.id), func.coalesce(func.sum(DocumentBlob.size), 0),
+        func.coalesce(func.sum(stored_size), 0)
+    ).group_by(codec).order_by(codec).all()
+
+    by_file_type = db.session.query(
+        Document.file_type, func.count(Document.id), func.coalesce(func.sum(Document.file_size), 0)
+    ).group_by(Document.file_type).order_by(func.sum(Document.file_size).desc()).all()
+
+    archived = db.session.query(
+        func.count(DocumentBlob.id), func.coalesce(func.sum(stored_size), 0)
+    ).filter(DocumentBlob.storage_key.startswith(ARCHIVE_PREFIX)).one()
+
+    unique_bytes = sum(row[2] for row in by_codec)
+    blob_stored_bytes = sum(row[3] for row in by_codec)
+    return {
+        'document_count': documents[0],
+        'logical_bytes': documents[1],
+        'legacy_count': legacy[0],
+        'legacy_bytes': legacy[1],
+        'blob_count': sum(row[1] for row in by_codec),
+        'unique_bytes': unique_bytes,
+        'stored_bytes': blob_stored_bytes + legacy[1],
+        'archive_count': archived[0],
+        'archive_stored_bytes': archived[1],
+        'by_codec': [{'codec': row[0], 'blobs': row[1], 'bytes': row[2], 'stored_bytes': row[3]} for row in by_codec],
+        'by_file_type': [{'file_type': row[0], 'documents': row[1], 'bytes': row[2]} for row in by_file_type],
+    }
@@ -0,0 +1,132 @@
+"""
+Document storage tiers
+Blobs used only by projects that were completed or cancelled more than some
+months ago move from the hot store to the archive tier, a separate local
+directory where they are compressed when that saves space. Archived blobs
+that an open project uses again move back. The storage key changes with the
+tier (archive/...), so downloads, previews and search read an archived blob
+without knowing about tiers. Files are copied by a thread pool; each blob's
+rows switch to the new copy in one transaction before the old copy goes.
+"""
+import calendar
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import exists, func, select
+
+from document_store import follow_moved_blob, record_blob_storage
+from models import db, Document, DocumentBlob, Project, ProjectStatusHistory
+from storage_backends import ARCHIVE_PREFIX
+
+CLOSED_STATUSES = ['Completed', 'Cancelled']
+
+
+def months_before(moment, months):
+    """The same day and time months calendar months earlier, clamped to the end of shorter months"""
+    year, month = divmod(moment.year * 12 + moment.month - 1 - months, 12)
+    month += 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+
+def cold_projects(cutoff):
+    """
+    Select of the ids of projects closed before cutoff: when they last moved
+    to Completed or Cancelled, or for projects given that status without a
+    recorded change (by a bulk import, say) their end date.
+    """
+    closed_at = (select(func.max(ProjectStatusHistory.changed_at))
+                 .where(ProjectStatusHistory.project_id == Project.id,
+                        ProjectStatusHistory.to_status.in_(CLOSED_STATUSES))
+                 .scalar_subquery())
+    return select(Project.id).where(
+        Project.status.in_(CLOSED_STATUSES),
+        func.coalesce(closed_at, Project.end_date, Project.updated_at) < cutoff
+    )
+
+
+def _candidates(cold, to_archive, last_id, batch_size):
+    """Next batch of blobs to move: hot blobs only cold projects use, or archived blobs an open project uses"""
+    archived = DocumentBlob.storage_key.startswith(ARCHIVE_PREFIX)
+
+    def used_by(*criteria):
+        return exists().where(Document.content_hash == DocumentBlob.sha256, *criteria)
+
+    if to_archive:
+        criteria = [~archived, used_by(Document.project_id.in_(cold)), ~used_by(Document.project_id.notin_(cold))]
+    else:
+        criteria = [archived, used_by(Document.project_id.notin_(cold))]
+    # Any one document's type will do: it only decides whether a restored blob is compressed
+    file_type = (select(func.min(Document.file_type))
+                 .where(Document.content_hash == DocumentBlob.sha256).scalar_subquery())
+    stored_size = func.coalesce(DocumentBlob.stored_size, DocumentBlob.size)
+    return (db.session.query(DocumentBlob.id, DocumentBlob.sha256, DocumentBlob.storage_key, stored_size, file_type)
+            .filter(DocumentBlob.id > last_id, *criteria).order_by(DocumentBlob.id).limit(batch_size).all())
+
+
+def _copy_blob(store, blob, to_archive):
+    """Copy one blob to the other tier; returns (StoredBlob, None) or (None, error)"""
+    _, sha256, storage_key, _, file_type = blob
+    try:
+        if to_archive:
+            return store.archive_blob(storage_key), None
+        return store.unarchive_blob(storage_key, sha256, file_type), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def _switch_blob(store, sha256, old_key, stored):
+    """
+    Point a blob's row and documents at its new copy, then remove the old one.
+    False, with the new copy dropped, when the blob was deleted meanwhile.
+    """
+    if not record_blob_storage(sha256, stored, previous_keys=[old_key]):
+        db.session.rollback()
+        store.remove(stored.storage_key)
+        return False
+    Document.query.filter(Document.content_hash == sha256, Document.file_path == old_key).update(
+        {'file_path': stored.storage_key}, synchronize_session=False
+    )
+    db.session.commit()
+    store.remove(old_key)
+    # Uploads that found the old copy and committed in the meantime
+    if follow_moved_blob(store, sha256, stored):
+        db.session.commit()
+    return True
+
+
+def tier_documents(store, months, workers=4, batch_size=200, dry_run=False, now=None, report=print):
+    """
+    Move blobs used only by projects closed more than months ago into the
+    archive tier, then archived blobs that an open project uses back into the
+    hot store. Returns counters; each failure is passed to report(storage
+    key, error). A dry run only counts the blobs and their stored bytes.
+    """
+    cold = cold_projects(months_before(now or datetime.utcnow(), months))
+    results = {'archived': 0, 'archived_bytes': 0, 'archive_bytes': 0, 'restored': 0, 'restored_bytes': 0,
+               'failed': 0}
+    with ThreadPoolExecutor(workers) as pool:
+        for to_archive, counter in [(True, 'archived'), (False, 'restored')]:
+            last_id = 0
+            while True:
+                blobs = _candidates(cold, to_archive, last_id, batch_size)
+                if not blobs:
+                    break
+                last_id = blobs[-1].id
+                if dry_run:
+                    results[counter] += len(blobs)
+                    results[f'{counter}_bytes'] += sum(blob[3] for blob in blobs)
+                    continue
+
+                copies = pool.map(lambda blob: _copy_blob(store, blob, to_archive), blobs)
+                for blob, (stored, error) in zip(blobs, copies):
+                    if stored is None:
+                        results['failed'] += 1
+                        report(blob.storage_key, error)
+                    elif _switch_blob(store, blob.sha256, blob.storage_key, stored):
+                        results[counter] += 1
+                        if to_archive:
+                            results['archived_bytes'] += blob[3]
+                            results['archive_bytes'] += stored.stored_size
+                        else:
+                            results['restored_bytes'] += stored.stored_size
+    return results
@@ -0,0 +1,213 @@
+"""
+Error ingestion into ErrorLog
+Fingerprints errors and aggregates repeated occurrences into one row per fingerprint
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, ErrorLog
+
+# Number of occurrence contexts kept per fingerprint (reservoir sampled)
+MAX_CONTEXT_SAMPLES = 5
+
+# ErrorAggregator.record outcomes
+RECORDED_FIRST = 'first'
+RECORDED_REPEAT = 'repeat'
+RECORD_DROPPED = 'dropped'
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_message(message):
+    """Strip volatile parts (numbers, quoted values, hex ids) from an error message"""
+    message = re.sub(r"'[^']*'|\"[^\"]*\"", "'?'", message)
+    message = re.sub(r'0x[0-9a-fA-F]+|\d+', 'N', message)
+    return message[:200]
+
+
+def fingerprint_error(error):
+    """
+    Fingerprint an error by exception type plus its normalized traceback
+    frames (file name and function, without line numbers so the fingerprint
+    survives unrelated edits). Errors without a traceback fall back to the
+    normalized message.
+    """
+    parts = [f'{type(error).__module__}.{type(error).__name__}']
+    frames = traceback.extract_tb(error.__traceback__) if error.__traceback__ else []
+    if frames:
+        parts.extend(f'{os.path.basename(frame.filename)}:{frame.name}' for frame in frames)
+    else:
+        parts.append(normalize_message(str(error)))
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def format_error_traceback(error):
+    """Return the formatted traceback of an exception object"""
+    return ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+
+
+class ErrorAggregator:
+    """
+    Buffers error occurrences in memory and writes them to ErrorLog at most
+    once per flush interval, so a hot failure loop costs one database write
+    per interval instead of one per occurrence.
+    """
+
+    def __init__(self, app, flush_interval=5.0, max_pending=500):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = {}
+        self.dropped = 0
+        self.last_flush = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    def record(self, fingerprint, error, occurrence):
+        """
+        Record one occurrence. Returns RECORDED_FIRST for the first occurrence
+        of the fingerprint in the current flush window, RECORDED_REPEAT for
+        later ones (callers use this to avoid repeating file and audit logging
+        during an error storm), or RECORD_DROPPED when the window already holds
+        max_pending other fingerprints and this one will not reach ErrorLog.
+        """
+        now = datetime.utcnow()
+        with self._lock:
+            aggregate = self.pending.get(fingerprint)
+            first_in_window = aggregate is None
+            if first_in_window:
+                if len(self.pending) >= self.max_pending:
+                    self.dropped += 1
+                    return RECORD_DROPPED
+                aggregate = self.pending[fingerprint] = {
+                    'error_type': type(error).__name__,
+                    'error_message': str(error) or type(error).__name__,
+                    'traceback': format_error_traceback(error),
+                    'count': 0,
+                    'seen': 0,
+                    'first_seen': now,
+                    'last_seen': now,
+                    'samples': []
+                }
+
+            aggregate['count'] += 1
+            aggregate['last_seen'] = now
+            aggregate['latest'] = occurrence
+
+            # Reservoir sampling keeps a representative set of contexts
+            aggregate['seen'] += 1
+            if len(aggregate['samples']) < MAX_CONTEXT_SAMPLES:
+                aggregate['samples'].append(occurrence)
+            else:
+                index = random.randrange(aggregate['seen'])
+                if index < MAX_CONTEXT_SAMPLES:
+                    aggregate['samples'][index] = occurrence
+
+            due = time.monotonic() - self.last_flush >= self.flush_interval
+
+        if due:
+            self.flush()
+        else:
+            self._schedule_flush()
+        return RECORDED_FIRST if first_in_window else RECORDED_REPEAT
+
+    def _schedule_flush(self):
+        """Make sure buffered occurrences are written even if no further errors arrive"""
+        with self._lock:
+            if self._timer is not None:
+                return
+            delay = max(0.0, self.flush_interval - (time.monotonic() - self.last_flush))
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Write all buffered occurrences to ErrorLog"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self.pending = self.pending, {}
+                dropped, self.dropped = self.dropped, 0
+                self.last_flush = time.monotonic()
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if dropped:
+                logger.warning(f"Error ingestion dropped {dropped} occurrences of new errors: "
+                               f"more than {self.max_pending} distinct errors in one flush window")
+            if not pending:
+                return
+
+            try:
+                with self.app.app_context():
+                    # Own session so a failed request transaction cannot affect ingestion
+                    with Session(db.engine) as session:
+                        for fingerprint, aggregate in pending.items():
+                            try:
+                                self._write(session, fingerprint, aggregate)
+                            except Exception as e:
+                                logger.error(f"Could not write {aggregate['count']} occurrences of error "
+                                             f"{fingerprint} to ErrorLog: {e}")
+                        session.commit()
+            except Exception as e:
+                logger.error(f"Error ingestion failed, {len(pending)} errors not written: {e}")
+                print(f"Critical: Error ingestion failed: {e}")
+
+    def _write(self, session, fingerprint, aggregate):
+        """
+        Merge one fingerprint in its own savepoint, so a failure only loses
+        that fingerprint. When another worker inserted the same new
+        fingerprint first, the merge is retried as an update of its row.
+        """
+        try:
+            with session.begin_nested():
+                self._merge(session, fingerprint, aggregate)
+        except IntegrityError:
+            with session.begin_nested():
+                self._merge(session, fingerprint, aggregate)
+
+    def _merge(self, session, fingerprint, aggregate):
+        """Insert or update the ErrorLog row for one fingerprint"""
+        latest = aggregate.get('latest', {})
+        error_log = session.query(ErrorLog).filter_by(fingerprint=fingerprint).first()
+
+        if error_log is None:
+            error_log = ErrorLog(
+                fingerprint=fingerprint,
+                error_type=aggregate['error_type'],
+                traceback=aggregate['traceback'],
+                occurrence_count=0,
+                occurred_at=aggregate['first_seen'],
+                severity='error'
+            )
+            session.add(error_log)
+            samples = []
+        else:
+            samples = error_log.get_context_dict().get('samples', [])
+            # A resolved error that happens again is a regression
+            error_log.resolved = False
+
+        error_log.error_message = aggregate['error_message']
+        error_log.occurrence_count = (error_log.occurrence_count or 0) + aggregate['count']
+        error_log.last_seen_at = aggregate['last_seen']
+        error_log.user_id = latest.get('user_id')
+        error_log.url = (latest.get('url') or '')[:500] or None
+        error_log.method = latest.get('method')
+        error_log.ip_address = latest.get('ip')
+        error_log.user_agent = latest.get('user_agent')
+        error_log.context = json.dumps({
+            'samples': (aggregate['samples'] + samples)[:MAX_CONTEXT_SAMPLES]
+        }, default=str)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Audit Log Export Script
+Streams audit log entries (including archived months) to a CSV or NDJSON file
+"""
+import argparse
+import os
+import sys
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, iter_audit_export_rows, iter_audit_export_lines
+
+
+def main():
+    """Export audit logs with the same filters as the audit log viewer"""
+    parser = argparse.ArgumentParser(description='Export audit log entries')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv', help='Output format')
+    parser.add_argument('--user', default='', help='Filter by username (partial match)')
+    parser.add_argument('--action', default='', help='Filter by action (partial match)')
+    parser.add_argument('--date-from', default='', help='Start date (YYYY-MM-DD)')
+    parser.add_argument('--date-to', default='', help='End date, inclusive (YYYY-MM-DD)')
+    parser.add_argument('--output', '-o', default='-', help='Output file (default: stdout)')
+    args = parser.parse_args()
+
+    with app.app_context():
+        rows = iter_audit_export_rows(args.user, args.action, args.date_from, args.date_to,
+                                      batch_size=app.config['AUDIT_EXPORT_BATCH_SIZE'])
+        output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+        try:
+            for chunk in iter_audit_export_lines(rows, args.format):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+    if args.output != '-':
+        print(f"✅ Audit logs exported to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Advisory file locks
+Serializes read-modify-write cycles on files shared by worker processes with
+fcntl.flock. Where fcntl is unavailable (Windows, where the development
+server runs a single process) the lock is a no-op.
+"""
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path, shared=False, create=True):
+    """
+    Hold an exclusive (or shared) lock on path for the duration of the block.
+    The file is created if needed, unless create is False: then a missing
+    file raises FileNotFoundError.
+    """
+    if fcntl is None:
+        if not create and not os.path.exists(path):
+            raise FileNotFoundError(path)
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | (os.O_CREAT if create else 0), 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
@@ -0,0 +1,136 @@
+"""
+File serving
+Document and backup downloads are either streamed by the worker (direct) or,
+behind Apache or nginx, handed to the front-end server with X-Sendfile or
+X-Accel-Redirect once the app has checked permissions, so the worker is free
+as soon as the headers are written.
+"""
+import os
+import zipfile
+from datetime import datetime
+from urllib.parse import quote
+
+from flask import Response, request, send_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+
+from storage_compression import open_stored_file
+
+FILE_SERVING_MODES = ['direct', 'x-sendfile', 'x-accel-redirect']
+
+# Formats that are already compressed internally; deflating them again costs CPU for nothing
+STORED_ZIP_TYPES = {'pdf', 'docx', 'xlsx', 'pptx', 'jpg', 'jpeg', 'png', 'gif', 'zip', 'gz'}
+
+ZIP_CHUNK_SIZE = 256 * 1024
+
+# Describe a body the front-end server supplies instead, so they must not be passed on
+_BODY_HEADERS = ['Content-Length', 'Content-Range']
+
+
+def offload_header(path, mode, accel_locations):
+    """(header, value) handing path to the front-end server, or None to stream it ourselves"""
+    if mode == 'x-sendfile':
+        return 'X-Sendfile', os.path.abspath(path)
+    if mode == 'x-accel-redirect':
+        path = os.path.abspath(path)
+        for root, uri in accel_locations.items():
+            root = os.path.abspath(root)
+            if path.startswith(root + os.sep):
+                relative = os.path.relpath(path, root).replace(os.sep, '/')
+                return 'X-Accel-Redirect', f"{uri.rstrip('/')}/{quote(relative)}"
+    return None
+
+
+def serve_file(path, mode='direct', accel_locations=None, **send_file_kwargs):
+    """
+    send_file with conditional handling, offloading the transfer when mode asks
+    for it. Returns (response, full_transfer); full_transfer is False for 304s
+    and Range requests, which callers don't count as downloads.
+    """
+    response = send_file(path, conditional=True, **send_file_kwargs)
+    if response.status_code == 304:
+        return response, False
+
+    header = offload_header(path, mode, accel_locations or {}) if mode != 'direct' else None
+    if header is None:
+        return response, response.status_code == 200
+
+    # The front-end server answers Range requests itself, from the full file
+    response.close()
+    offloaded = Response(status=200)
+    for name, value in response.headers.items():
+        if name not in _BODY_HEADERS:
+            offloaded.headers[name] = value
+    offloaded.headers[header[0]] = header[1]
+    return offloaded, 'Range' not in request.headers
+
+
+def serve_stream(stream, size, **send_file_kwargs):
+    """
+    serve_file for an open stream of known length, such as a decompressing
+    reader: the same conditional and Range handling, but never offloaded,
+    since the front-end server would send the stored bytes. Returns
+    (response, full_transfer).
+    """
+    response = send_file(stream, conditional=False, **send_file_kwargs)
+    response.content_length = size
+    try:
+        response = response.make_conditional(request.environ, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        stream.close()
+        raise
+    return response, response.status_code == 200
+
+
+class _ZipOutput:
+    """Write-only sink for ZipFile; zipfile falls back to data descriptors when it cannot seek"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def unique_archive_name(name, used):
+    """Add ' (2)', ' (3)'... before the extension of names already in the archive"""
+    candidate, counter = name, 1
+    stem, extension = os.path.splitext(name)
+    while candidate.lower() in used:
+        counter += 1
+        candidate = f'{stem} ({counter}){extension}'
+    used.add(candidate.lower())
+    return candidate
+
+
+def stream_zip(entries, open_entry=open_stored_file, chunk_size=ZIP_CHUNK_SIZE):
+    """
+    Yield a ZIP archive of (archive name, location, size, modified datetime)
+    entries as it is written, one file chunk at a time, so memory stays flat
+    and nothing is staged on disk. open_entry opens a location for reading
+    its original content, by default a local file that may be compressed at
+    rest. Already-compressed formats are stored, others deflated.
+    """
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', allowZip64=True) as archive:
+        for arcname, location, size, modified in entries:
+            info = zipfile.ZipInfo(arcname, date_time=(modified or datetime.now()).timetuple()[:6])
+            extension = arcname.rsplit('.', 1)[-1].lower() if '.' in arcname else ''
+            info.compress_type = zipfile.ZIP_STORED if extension in STORED_ZIP_TYPES else zipfile.ZIP_DEFLATED
+            info.file_size = size
+            with open_entry(location) as source, archive.open(info, 'w') as target:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    target.write(chunk)
+                    data = output.drain()
+                    if data:
+                        yield data
+    # Remaining entry headers and the central directory
+    yield output.drain()
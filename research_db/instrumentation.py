@@ -0,0 +1,159 @@
+"""
+Request instrumentation
+Collects per-request SQL and template timings through SQLAlchemy engine
+events and Flask template signals, plus named spans for application phases
+such as import parsing or export writing
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from logging_config import TRACE_LOGGER_NAME
+
+_engine_hooks_installed = False
+
+
+class RequestStats:
+    """Timings accumulated while handling one request"""
+
+    __slots__ = ('started_at', 'db_count', 'db_time', 'template_time', 'template_starts', 'templates', 'spans', 'queries')
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.db_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_starts = []
+        self.templates = []  # (template name, seconds) for each top-level render
+        self.spans = {}  # span name -> [seconds, count]
+        self.queries = None  # (statement, parameters, seconds) while the SQL profiler is recording
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def add_span(self, name, duration):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [duration, 1]
+        else:
+            span[0] += duration
+            span[1] += 1
+
+    def timings(self):
+        """Return (name, milliseconds, description) for every measured phase"""
+        timings = [('db', self.db_time * 1000, f'SQL ({self.db_count} queries)')]
+        if self.templates:
+            timings.append(('tpl', self.template_time * 1000, 'Template render'))
+        for name, (duration, count) in self.spans.items():
+            timings.append((name, duration * 1000, name if count == 1 else f'{name} (x{count})'))
+        timings.append(('total', self.elapsed() * 1000, 'Total'))
+        return timings
+
+    def server_timing_header(self):
+        """Format the timings as a Server-Timing header value"""
+        return ', '.join(
+            f'{name};dur={duration:.2f};desc="{description}"' for name, duration, description in self.timings()
+        )
+
+
+def current_request_stats():
+    """Return the RequestStats of the active request, or None outside a request"""
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+
+@contextmanager
+def timing_span(name):
+    """Time a block of work as a named Server-Timing span of the active request"""
+    stats = current_request_stats()
+    if stats is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_span(name, time.perf_counter() - started_at)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start_time')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    stats = current_request_stats()
+    if stats is not None:
+        stats.db_count += 1
+        stats.db_time += duration
+        if stats.queries is not None:
+            stats.queries.append((statement, parameters, duration))
+
+
+def _before_render_template(sender, template, context, **extra):
+    stats = current_request_stats()
+    if stats is not None:
+        stats.template_starts.append(time.perf_counter())
+
+
+def _template_rendered(sender, template, context, **extra):
+    stats = current_request_stats()
+    if stats is None or not stats.template_starts:
+        return
+    duration = time.perf_counter() - stats.template_starts.pop()
+    # Nested renders are already included in the outer render time
+    if not stats.template_starts:
+        stats.template_time += duration
+        stats.templates.append((template.name or 'string', duration))
+
+
+def init_instrumentation(app):
+    """
+    Install request, SQL and template timing hooks on the app.
+
+    SERVER_TIMING_ENABLED adds a Server-Timing header to every response and
+    REQUEST_TRACE_LOG writes each request's timings to the request trace log.
+    """
+    global _engine_hooks_installed
+    if not _engine_hooks_installed:
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _engine_hooks_installed = True
+
+    before_render_template.connect(_before_render_template, app)
+    template_rendered.connect(_template_rendered, app)
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = RequestStats()
+
+    trace_logger = logging.getLogger(TRACE_LOGGER_NAME)
+
+    @app.after_request
+    def emit_request_timings(response):
+        stats = current_request_stats()
+        if stats is None:
+            return response
+        if app.config.get('SERVER_TIMING_ENABLED'):
+            response.headers['Server-Timing'] = stats.server_timing_header()
+        if app.config.get('REQUEST_TRACE_LOG'):
+            trace_logger.info(
+                f"{request.method} {request.path} {response.status_code}",
+                extra={
+                    'method': request.method,
+                    'path': request.path,
+                    'endpoint': request.endpoint,
+                    'status': response.status_code,
+                    'latency_ms': round(stats.elapsed() * 1000, 2),
+                    'timings': {name: round(duration, 2) for name, duration, _ in stats.timings()}
+                }
+            )
+        return response
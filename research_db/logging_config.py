@@ -0,0 +1,196 @@
+"""
+Application logging
+Non-blocking JSON-lines logging with size/time based rotation and gzip compression
+"""
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+from datetime import datetime, timezone
+
+# Extra fields copied from log records into the JSON output when present
+STRUCTURED_FIELDS = ['request_id', 'method', 'path', 'endpoint', 'status', 'latency_ms', 'user_id', 'timings']
+
+# Logger that receives per-request timing traces; routed only to traces.log
+TRACE_LOGGER_NAME = 'request_trace'
+
+_listener = None
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request id to records logged on the request thread"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = None
+            try:
+                from flask import g, has_request_context
+                if has_request_context():
+                    record.request_id = g.get('request_id')
+            except ImportError:
+                pass
+        return True
+
+
+class TraceRecordFilter(logging.Filter):
+    """Route request trace records to the trace log only"""
+
+    def __init__(self, traces_only):
+        super().__init__()
+        self.traces_only = traces_only
+
+    def filter(self, record):
+        return (record.name == TRACE_LOGGER_NAME) == self.traces_only
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Human-readable console format that includes the request id"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = None
+        return super().format(record)
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that keeps exception text and extra fields intact for the
+    listener thread instead of flattening everything into the message.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _gzip_rotator(source, dest):
+    """Compress a rotated log file"""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _gzip_namer(name):
+    return name + '.gz'
+
+
+def _rotating_file_handler(path, rotation, max_bytes, backup_count, when):
+    """Create a size or time based rotating handler that gzips rotated files"""
+    if rotation == 'time':
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding='utf-8', utc=True
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    handler.setFormatter(JsonLinesFormatter())
+    return handler
+
+
+def setup_logging(log_dir, logger_name='app'):
+    """
+    Configure application logging.
+
+    Log calls only put records on an in-memory queue; a QueueListener thread
+    writes them to app.log / errors.log (JSON lines, rotated and gzipped)
+    and to stdout. Request timing traces go to traces.log only, which is
+    opened only when tracing is on. Configured through environment variables:
+
+    LOG_LEVEL          root level (default INFO)
+    IMPORT_LOG_LEVEL   level of the bulk import logger (default INFO; DEBUG shows import tracing)
+    LOG_ROTATION       'size' (default) or 'time'
+    LOG_MAX_BYTES      size rotation threshold (default 10 MB)
+    LOG_ROTATE_WHEN    time rotation interval (default 'midnight')
+    LOG_BACKUP_COUNT   rotated files kept per log (default 10)
+    REQUEST_TRACE_LOG  write request timing traces to traces.log (default false)
+    """
+    global _listener
+
+    app_logger = logging.getLogger(logger_name)
+    error_logger = logging.getLogger('error_logger')
+    if _listener is not None:
+        return app_logger, error_logger
+
+    os.makedirs(log_dir, exist_ok=True)
+
+    rotation = os.environ.get('LOG_ROTATION', 'size').lower()
+    max_bytes = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    backup_count = int(os.environ.get('LOG_BACKUP_COUNT', 10))
+    when = os.environ.get('LOG_ROTATE_WHEN', 'midnight')
+
+    # Main application log
+    app_handler = _rotating_file_handler(os.path.join(log_dir, 'app.log'), rotation, max_bytes, backup_count, when)
+
+    # Error log
+    error_handler = _rotating_file_handler(os.path.join(log_dir, 'errors.log'), rotation, max_bytes, backup_count, when)
+    error_handler.setLevel(logging.ERROR)
+
+    handlers = [app_handler, error_handler]
+
+    # Per-request timing traces; without tracing they are dropped by the filters on the other handlers
+    if os.environ.get('REQUEST_TRACE_LOG', 'false').lower() in ['1', 'true', 'yes']:
+        trace_handler = _rotating_file_handler(os.path.join(log_dir, 'traces.log'), rotation, max_bytes,
+                                               backup_count, when)
+        trace_handler.addFilter(TraceRecordFilter(traces_only=True))
+        handlers.append(trace_handler)
+    app_handler.addFilter(TraceRecordFilter(traces_only=False))
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(ConsoleFormatter())
+    console_handler.addFilter(TraceRecordFilter(traces_only=False))
+    handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    root_logger.addHandler(queue_handler)
+
+    logging.getLogger('bulk_import').setLevel(os.environ.get('IMPORT_LOG_LEVEL', 'INFO').upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    return app_logger, error_logger
@@ -0,0 +1,184 @@
+"""
+Memory diagnostics
+tracemalloc snapshots and snapshot diffs by allocation site, plus peak memory
+of import and export requests, to track down RSS growth in long-running workers
+"""
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+from flask import g, request
+
+SNAPSHOT_EXTENSION = '.snapshot'
+
+# Allocations made by the tracing machinery itself are noise in every report
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def format_bytes(size):
+    if size is None:
+        return '-'
+    sign = '-' if size < 0 else ''
+    size = abs(size)
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f'{sign}{size:.0f} {unit}' if unit == 'B' else f'{sign}{size:.1f} {unit}'
+        size /= 1024
+    return f'{sign}{size:.1f} GB'
+
+
+def take_snapshot(snapshot_dir, label, max_files=20):
+    """Dump a tracemalloc snapshot of this process; returns the file name"""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError('Memory tracing is not running.')
+    snapshot = tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    safe_label = ''.join(c if c.isalnum() or c in '-_' else '_' for c in label)[:40] or 'snapshot'
+    filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}__{os.getpid()}__{safe_label}{SNAPSHOT_EXTENSION}"
+    snapshot.dump(os.path.join(snapshot_dir, filename))
+
+    for old in list_snapshots(snapshot_dir)[max_files:]:
+        try:
+            os.remove(os.path.join(snapshot_dir, old['filename']))
+        except OSError:
+            pass
+    return filename
+
+
+def list_snapshots(snapshot_dir):
+    """Stored snapshots, newest first"""
+    snapshots = []
+    if not os.path.isdir(snapshot_dir):
+        return snapshots
+    for filename in os.listdir(snapshot_dir):
+        if not filename.endswith(SNAPSHOT_EXTENSION):
+            continue
+        parts = filename[:-len(SNAPSHOT_EXTENSION)].split('__')
+        stat = os.stat(os.path.join(snapshot_dir, filename))
+        snapshots.append({
+            'filename': filename,
+            'pid': parts[1] if len(parts) > 2 else '',
+            'label': parts[2] if len(parts) > 2 else '',
+            'created': datetime.fromtimestamp(stat.st_mtime),
+            'size_kb': round(stat.st_size / 1024, 1)
+        })
+    snapshots.sort(key=lambda snapshot: snapshot['created'], reverse=True)
+    return snapshots
+
+
+def _load_snapshot(snapshot_dir, filename):
+    if filename not in {snapshot['filename'] for snapshot in list_snapshots(snapshot_dir)}:
+        raise ValueError(f'Snapshot {filename} not found.')
+    return tracemalloc.Snapshot.load(os.path.join(snapshot_dir, filename))
+
+
+def _stat_row(stat, size_diff=None, count_diff=None):
+    frame = stat.traceback[0]
+    return {
+        'location': f'{frame.filename}:{frame.lineno}',
+        'size': stat.size,
+        'count': stat.count,
+        'size_diff': size_diff,
+        'count_diff': count_diff,
+        'traceback': [f'{f.filename}:{f.lineno}' for f in stat.traceback]
+    }
+
+
+def top_allocations(snapshot_dir, filename, key_type='lineno', limit=30):
+    """Largest allocation sites of one snapshot"""
+    snapshot = _load_snapshot(snapshot_dir, filename)
+    return [_stat_row(stat) for stat in snapshot.statistics(key_type)[:limit]]
+
+
+def diff_snapshots(snapshot_dir, older, newer, key_type='lineno', limit=30):
+    """Allocation sites that grew the most between two snapshots"""
+    old_snapshot = _load_snapshot(snapshot_dir, older)
+    new_snapshot = _load_snapshot(snapshot_dir, newer)
+    stats = new_snapshot.compare_to(old_snapshot, key_type)
+    return [_stat_row(stat, stat.size_diff, stat.count_diff) for stat in stats[:limit]]
+
+
+class RequestMemoryTracker:
+    """
+    Peak memory of selected endpoints. RSS is measured before and after each
+    request; while tracemalloc is running the Python heap peak is recorded as
+    well. The tracemalloc peak is process wide, so concurrent requests in the
+    same worker share it.
+    """
+
+    def __init__(self, max_requests=100):
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=max_requests)
+        self.endpoints = {}
+
+    def record(self, entry):
+        with self._lock:
+            self.recent.appendleft(entry)
+            summary = self.endpoints.setdefault(entry['endpoint'], {
+                'endpoint': entry['endpoint'], 'requests': 0, 'max_rss_growth': None, 'max_heap_peak': None
+            })
+            summary['requests'] += 1
+            for key, value in [('max_rss_growth', entry['rss_growth']), ('max_heap_peak', entry['heap_peak'])]:
+                if value is not None and (summary[key] is None or value > summary[key]):
+                    summary[key] = value
+
+    def summary(self):
+        with self._lock:
+            return sorted(self.endpoints.values(), key=lambda row: row['max_rss_growth'] or 0, reverse=True), list(self.recent)
+
+
+def init_memory_diagnostics(app, tracker):
+    """Measure memory around requests to MEMORY_TRACKED_ENDPOINTS"""
+    tracked = set(app.config['MEMORY_TRACKED_ENDPOINTS'])
+
+    if app.config.get('MEMORY_TRACE_AT_STARTUP') and not tracemalloc.is_tracing():
+        tracemalloc.start(app.config['MEMORY_TRACE_FRAMES'])
+
+    @app.before_request
+    def start_memory_tracking():
+        if request.endpoint not in tracked:
+            return
+        heap_start = None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            heap_start = tracemalloc.get_traced_memory()[0]
+        g.memory_tracking = (current_rss(), heap_start, time.perf_counter())
+
+    @app.teardown_request
+    def finish_memory_tracking(exc):
+        tracking = g.pop('memory_tracking', None)
+        if tracking is None:
+            return
+        rss_before, heap_start, started_at = tracking
+        rss_after = current_rss()
+        heap_peak = None
+        if heap_start is not None and tracemalloc.is_tracing():
+            heap_peak = max(0, tracemalloc.get_traced_memory()[1] - heap_start)
+        tracker.record({
+            'recorded_at': datetime.now(),
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'pid': os.getpid(),
+            'duration_ms': round((time.perf_counter() - started_at) * 1000, 1),
+            'rss_before': rss_before,
+            'rss_after': rss_after,
+            'rss_growth': rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            'heap_peak': heap_peak
+        })
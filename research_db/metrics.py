@@ -0,0 +1,289 @@
+"""
+Prometheus metrics
+Per-endpoint request, latency, SQL and template metrics aggregated in-process.
+Each worker process periodically writes its totals to its own file in the
+metrics directory and /metrics merges all files, so counts stay correct
+with several worker processes. Files of processes that have exited are
+folded into one retired-totals file, so the directory does not grow with
+restarts and counters never go backwards.
+"""
+import glob
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from flask import request
+
+from file_locks import file_lock
+from instrumentation import current_request_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+ROW_COUNT_BUCKETS = (10, 100, 1000, 10000, 50000, 100000, 500000, 1000000)
+
+WORKER_FILE_PATTERN = re.compile(r'^metrics_(\d+)_[0-9a-f]+\.json$')
+RETIRED_FILE = 'metrics_retired.json'
+LOCK_FILE = 'metrics.lock'
+# Key in the retired file listing the worker files already folded into it
+FOLDED_KEY = '_folded'
+
+# name -> (type, help, histogram buckets)
+METRIC_DEFINITIONS = {
+    'marga_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status', None),
+    'marga_http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint', LATENCY_BUCKETS),
+    'marga_db_queries_total': ('counter', 'SQL statements executed by endpoint', None),
+    'marga_db_query_duration_seconds_total': ('counter', 'Time spent executing SQL by endpoint', None),
+    'marga_db_queries_per_request': ('histogram', 'SQL statements executed per request by endpoint', QUERY_COUNT_BUCKETS),
+    'marga_template_render_duration_seconds': ('histogram', 'Jinja template render time by template', LATENCY_BUCKETS),
+    'marga_bulk_import_rows': ('histogram', 'Rows handled per bulk import by stage', ROW_COUNT_BUCKETS),
+    'marga_export_rows': ('histogram', 'Rows written per export by export type', ROW_COUNT_BUCKETS),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_items, extra=None):
+    items = list(label_items) + (list(extra) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in items) + '}'
+
+
+def _snapshot(values):
+    """Metric values in their JSON file form"""
+    return {
+        name: [[list(map(list, key)), value] for key, value in metric.items()]
+        for name, metric in values.items()
+    }
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, snapshot):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+
+
+def _merge_snapshot(merged, snapshot):
+    """Add the values of one metrics file to merged"""
+    for name, entries in snapshot.items():
+        if name not in METRIC_DEFINITIONS:
+            continue
+        metric = merged.setdefault(name, {})
+        for key, value in entries:
+            key = tuple(tuple(item) for item in key)
+            if isinstance(value, dict):
+                state = metric.setdefault(key, {'buckets': [0] * len(value['buckets']), 'sum': 0.0, 'count': 0})
+                state['buckets'] = [a + b for a, b in zip(state['buckets'], value['buckets'])]
+                state['sum'] += value['sum']
+                state['count'] += value['count']
+            else:
+                metric[key] = metric.get(key, 0) + value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user, or the platform cannot tell
+        return True
+    return True
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """In-process metric store backed by one JSON file per worker process"""
+
+    def __init__(self, metrics_dir, flush_interval=1.0):
+        self.metrics_dir = metrics_dir
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        # Unique per process start so a reused pid never overwrites a dead worker's totals
+        self.file_path = os.path.join(self.metrics_dir, f'metrics_{self.pid}_{uuid.uuid4().hex[:8]}.json')
+        self.values = {}
+        self.last_flush = 0.0
+        self.dirty = False
+        self.retire_dead_files()
+
+    def _check_fork(self):
+        # A forked worker must not keep writing the parent's numbers under its own file
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def inc(self, name, labels, amount=1):
+        """Increment a counter"""
+        with self._lock:
+            self._check_fork()
+            metric = self.values.setdefault(name, {})
+            key = _label_key(labels)
+            metric[key] = metric.get(key, 0) + amount
+            self.dirty = True
+
+    def observe(self, name, labels, value):
+        """Record one observation in a histogram"""
+        buckets = METRIC_DEFINITIONS[name][2]
+        with self._lock:
+            self._check_fork()
+            metric = self.values.setdefault(name, {})
+            key = _label_key(labels)
+            state = metric.get(key)
+            if state is None:
+                state = metric[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state['buckets'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+            self.dirty = True
+
+    def maybe_flush(self, force=False):
+        """Write this process's totals to disk at most once per flush interval"""
+        now = time.monotonic()
+        if not force and (not self.dirty or now - self.last_flush < self.flush_interval):
+            return
+        with self._lock:
+            snapshot = _snapshot(self.values)
+            self.last_flush = now
+            self.dirty = False
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        _write_snapshot(self.file_path, snapshot)
+
+    def retire_dead_files(self):
+        """
+        Fold the files of worker processes that have exited into the retired
+        totals file and remove them. Runs when a process starts or forks.
+        """
+        if not os.path.isdir(self.metrics_dir):
+            return
+        retired_path = os.path.join(self.metrics_dir, RETIRED_FILE)
+        with file_lock(os.path.join(self.metrics_dir, LOCK_FILE)):
+            dead = []
+            for name in os.listdir(self.metrics_dir):
+                match = WORKER_FILE_PATTERN.match(name)
+                if not match or os.path.join(self.metrics_dir, name) == self.file_path:
+                    continue
+                pid = int(match.group(1))
+                # Another file under our own pid was left by an earlier process that had it
+                if pid == self.pid or not _pid_alive(pid):
+                    dead.append(name)
+            if not dead:
+                return
+
+            retired = _read_snapshot(retired_path) or {}
+            # Files a previous run folded but was interrupted before removing
+            folded = set(retired.get(FOLDED_KEY, []))
+            merged = {}
+            _merge_snapshot(merged, retired)
+            for name in dead:
+                if name not in folded:
+                    _merge_snapshot(merged, _read_snapshot(os.path.join(self.metrics_dir, name)) or {})
+            snapshot = _snapshot(merged)
+            snapshot[FOLDED_KEY] = dead
+            _write_snapshot(retired_path, snapshot)
+            for name in dead:
+                try:
+                    os.remove(os.path.join(self.metrics_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def _merged_values(self):
+        """Sum the retired totals and the totals of every live worker process file"""
+        merged = {}
+        # Shared, so a scrape never sees a file both folded into the retired totals and still present
+        with file_lock(os.path.join(self.metrics_dir, LOCK_FILE), shared=True):
+            retired = _read_snapshot(os.path.join(self.metrics_dir, RETIRED_FILE)) or {}
+            folded = set(retired.get(FOLDED_KEY, []))
+            _merge_snapshot(merged, retired)
+            for path in glob.glob(os.path.join(self.metrics_dir, 'metrics_*.json')):
+                name = os.path.basename(path)
+                if name == RETIRED_FILE or name in folded:
+                    continue
+                _merge_snapshot(merged, _read_snapshot(path) or {})
+        return merged
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        self.maybe_flush(force=True)
+        merged = self._merged_values()
+        lines = []
+        for name, (metric_type, help_text, buckets) in METRIC_DEFINITIONS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for key, value in sorted(merged.get(name, {}).items()):
+                if metric_type == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip(buckets, value['buckets']):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{_format_labels(key, [("le", _format_number(bound))])} {cumulative}')
+                    lines.append(f'{name}_bucket{_format_labels(key, [("le", "+Inf")])} {value["count"]}')
+                    lines.append(f'{name}_sum{_format_labels(key)} {_format_number(value["sum"])}')
+                    lines.append(f'{name}_count{_format_labels(key)} {value["count"]}')
+                else:
+                    lines.append(f'{name}{_format_labels(key)} {_format_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app, registry):
+    """Record request, SQL and template metrics for every request"""
+
+    @app.after_request
+    def record_request_metrics(response):
+        stats = current_request_stats()
+        if stats is None:
+            return response
+
+        endpoint = request.endpoint or 'unmatched'
+        registry.inc('marga_http_requests_total', {
+            'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)
+        })
+        registry.observe('marga_http_request_duration_seconds', {'endpoint': endpoint}, stats.elapsed())
+        registry.inc('marga_db_queries_total', {'endpoint': endpoint}, stats.db_count)
+        registry.inc('marga_db_query_duration_seconds_total', {'endpoint': endpoint}, stats.db_time)
+        registry.observe('marga_db_queries_per_request', {'endpoint': endpoint}, stats.db_count)
+        for template_name, duration in stats.templates:
+            registry.observe('marga_template_render_duration_seconds', {'template': template_name}, duration)
+
+        registry.maybe_flush()
+        return response
+
+
+def count_rows(registry, metric_name, labels, rows):
+    """Pass rows through a generator, recording how many were produced once it finishes"""
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+            yield row
+    finally:
+        registry.observe(metric_name, labels, count)
@@ -90,7 +90,8 @@ def migrate_database():
         columns_to_add = [
             ('currency', 'VARCHAR(10) DEFAULT "Rs"'),
             ('category', 'VARCHAR(100)'),
-            ('theme', 'VARCHAR(100)')
+            ('theme', 'VARCHAR(100)'),
+            ('storage_quota_bytes', 'BIGINT')
         ]
         
         for column_name, column_def in columns_to_add:
@@ -105,6 +106,112 @@ def migrate_database():
             else:
                 print(f"✅ Column {column_name} already exists")
         
+        # Add error aggregation columns to error_log
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='error_log'")
+        if cursor.fetchone() is not None:
+            cursor.execute("PRAGMA table_info(error_log)")
+            error_log_columns = [row[1] for row in cursor.fetchall()]
+            error_log_columns_to_add = [
+                ('fingerprint', 'VARCHAR(40)'),
+                ('occurrence_count', 'INTEGER NOT NULL DEFAULT 1'),
+                ('last_seen_at', 'DATETIME')
+            ]
+            for column_name, column_def in error_log_columns_to_add:
+                if column_name not in error_log_columns:
+                    try:
+                        sql = f"ALTER TABLE error_log ADD COLUMN {column_name} {column_def}"
+                        print(f"Adding column: {sql}")
+                        cursor.execute(sql)
+                        print(f"✅ Added column: error_log.{column_name}")
+                    except sqlite3.Error as e:
+                        print(f"❌ Error adding column error_log.{column_name}: {e}")
+                else:
+                    print(f"✅ Column error_log.{column_name} already exists")
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_error_log_fingerprint ON error_log (fingerprint)")
+        
+        # Content-addressed document storage
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='document_blob'")
+        if cursor.fetchone() is None:
+            print("Creating document_blob table...")
+            cursor.execute("""
+                CREATE TABLE document_blob (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sha256 VARCHAR(64) NOT NULL UNIQUE,
+                    size BIGINT NOT NULL,
+                    storage_key VARCHAR(255) NOT NULL,
+                    ref_count INTEGER NOT NULL DEFAULT 0,
+                    created_at DATETIME NOT NULL
+                )
+            """)
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_document_blob_sha256 ON document_blob (sha256)")
+            print("✅ Created document_blob table")
+        else:
+            print("✅ document_blob table already exists")
+        
+        # Compression at rest
+        cursor.execute("PRAGMA table_info(document_blob)")
+        blob_columns = [row[1] for row in cursor.fetchall()]
+        for column_name, column_def in [('stored_size', 'BIGINT'), ('compression', 'VARCHAR(10)')]:
+            if column_name not in blob_columns:
+                try:
+                    sql = f"ALTER TABLE document_blob ADD COLUMN {column_name} {column_def}"
+                    print(f"Adding column: {sql}")
+                    cursor.execute(sql)
+                    print(f"✅ Added column: document_blob.{column_name}")
+                except sqlite3.Error as e:
+                    print(f"❌ Error adding column document_blob.{column_name}: {e}")
+            else:
+                print(f"✅ Column document_blob.{column_name} already exists")
+        
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='document'")
+        if cursor.fetchone() is not None:
+            cursor.execute("PRAGMA table_info(document)")
+            document_columns = [row[1] for row in cursor.fetchall()]
+            if 'content_hash' not in document_columns:
+                try:
+                    sql = "ALTER TABLE document ADD COLUMN content_hash VARCHAR(64) REFERENCES document_blob (sha256)"
+                    print(f"Adding column: {sql}")
+                    cursor.execute(sql)
+                    print("✅ Added column: document.content_hash")
+                except sqlite3.Error as e:
+                    print(f"❌ Error adding column document.content_hash: {e}")
+            else:
+                print("✅ Column document.content_hash already exists")
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_document_content_hash ON document (content_hash)")
+            # Document catalogue filters and ordering
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_document_project_uploaded ON document (project_id, uploaded_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS ix_document_type_uploaded ON document (document_type, uploaded_at)")
+            print("✅ Document catalogue indexes in place")
+            
+            # Blob store documents keep their storage key rather than a path on this machine,
+            # so any node (or an S3 backend) can resolve it
+            cursor.execute("""
+                UPDATE document SET file_path = (
+                    SELECT storage_key FROM document_blob WHERE document_blob.sha256 = document.content_hash
+                )
+                WHERE content_hash IS NOT NULL AND file_path != (
+                    SELECT storage_key FROM document_blob WHERE document_blob.sha256 = document.content_hash
+                )
+            """)
+            print(f"✅ Document file paths as storage keys ({cursor.rowcount} updated)")
+        
+        # Document full-text search (the FTS5 index itself is created when the app starts)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='document_extraction'")
+        if cursor.fetchone() is None:
+            print("Creating document_extraction table...")
+            cursor.execute("""
+                CREATE TABLE document_extraction (
+                    document_id INTEGER NOT NULL PRIMARY KEY REFERENCES document (id),
+                    status VARCHAR(20) NOT NULL,
+                    char_count INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    extracted_at DATETIME NOT NULL
+                )
+            """)
+            print("✅ Created document_extraction table")
+        else:
+            print("✅ document_extraction table already exists")
+        
         # Commit changes
         conn.commit()
         
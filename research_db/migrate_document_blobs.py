@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Document Blob Migration Script
+Moves documents uploaded before content-addressed storage into the blob
+store: each file is hashed, stored once per distinct content and its
+Document row pointed at the shared blob. Run migrate_database.py first.
+"""
+import argparse
+import os
+import sys
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, document_store
+from document_store import add_blob_reference, hash_file, record_blob_storage, restore_blob
+from memory_diagnostics import format_bytes
+from models import db, Document
+
+
+def migrate_documents(batch_size=200, dry_run=False, keep_files=False):
+    """Migrate legacy documents in id order, committing per batch; returns counters"""
+    results = {'migrated': 0, 'missing': 0, 'failed': 0, 'bytes_before': 0, 'new_blob_bytes': 0}
+    seen_hashes = set()
+
+    def count_migrated(content_hash, size, new_blob, stored_size):
+        seen_hashes.add(content_hash)
+        results['migrated'] += 1
+        results['bytes_before'] += size
+        if new_blob:
+            results['new_blob_bytes'] += stored_size
+
+    last_id = 0
+    while True:
+        documents = (Document.query.filter(Document.content_hash.is_(None), Document.id > last_id)
+                     .order_by(Document.id).limit(batch_size).all())
+        if not documents:
+            break
+        last_id = documents[-1].id
+        placed = []
+
+        for document in documents:
+            if not os.path.exists(document.file_path):
+                print(f"   ⚠️  Document {document.id}: file missing at {document.file_path}")
+                results['missing'] += 1
+                continue
+            try:
+                if dry_run:
+                    content_hash, size = hash_file(document.file_path)
+                    new_blob = content_hash not in seen_hashes and document_store.find_blob(content_hash) is None
+                    count_migrated(content_hash, size, new_blob, size)
+                    continue
+                with open(document.file_path, 'rb') as f:
+                    temp_path, content_hash, size = document_store.receive(f)
+                # Stored before the batch's transaction takes the write lock, which compressing
+                # or uploading every file would otherwise hold; a duplicate's temp file is kept
+                # until the batch has committed (see restore_blob)
+                try:
+                    stored = document_store.place(temp_path, content_hash, document.file_type,
+                                                  discard_duplicate=False)
+                except Exception:
+                    document_store.discard(temp_path)
+                    raise
+                placed.append((document, content_hash, size, stored, None if stored.created else temp_path))
+            except Exception as e:
+                print(f"   ❌ Document {document.id}: {e}")
+                results['failed'] += 1
+
+        if not dry_run:
+            removed_after_commit, restored_after_commit = [], []
+            for document, content_hash, size, stored, temp_path in placed:
+                legacy_path = document.file_path
+                try:
+                    # A savepoint per document, so one failure doesn't leave a stray reference in the batch
+                    with db.session.begin_nested():
+                        add_blob_reference(content_hash, size)
+                        record_blob_storage(content_hash, stored)
+                        document.content_hash = content_hash
+                        document.filename = content_hash
+                        document.file_path = stored.storage_key
+                        document.file_size = size
+                except Exception as e:
+                    print(f"   ❌ Document {document.id}: {e}")
+                    results['failed'] += 1
+                    if temp_path:
+                        document_store.discard(temp_path)
+                    continue
+                removed_after_commit.append(legacy_path)
+                if temp_path:
+                    restored_after_commit.append((content_hash, temp_path, document.file_type))
+                count_migrated(content_hash, size, stored.created, stored.stored_size)
+
+            db.session.commit()
+            for content_hash, temp_path, file_type in restored_after_commit:
+                try:
+                    if restore_blob(document_store, content_hash, temp_path, file_type):
+                        print(f"   ⚠️  Blob {content_hash} was removed by a concurrent delete and has been restored")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"   ❌ Could not check blob {content_hash}: {e}")
+            if not keep_files:
+                for path in removed_after_commit:
+                    os.remove(path)
+        db.session.expunge_all()
+        print(f"   {results['migrated']} documents migrated...")
+    return results
+
+
+def main():
+    """Run the document blob migration"""
+    parser = argparse.ArgumentParser(description='Move existing documents into content-addressed storage')
+    parser.add_argument('--batch-size', type=int, default=200, help='Documents per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='Hash files and report savings without changing anything')
+    parser.add_argument('--keep-files', action='store_true', help='Leave the original files in place after migrating')
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(f"Migrating documents into {document_store.backend.describe()}")
+        try:
+            results = migrate_documents(args.batch_size, dry_run=args.dry_run, keep_files=args.keep_files)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Migration failed: {e}")
+            return False
+
+        verb = 'Would migrate' if args.dry_run else 'Migrated'
+        print(f"✅ {verb} {results['migrated']} documents "
+              f"({results['missing']} missing files, {results['failed']} failures)")
+        print(f"   {format_bytes(results['bytes_before'])} of documents stored as "
+              f"{format_bytes(results['new_blob_bytes'])} of new blobs")
+        return results['failed'] == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Document Storage Migration Script
+Copies every blob from one storage backend to another (the local blob
+directory and an S3-compatible bucket, either way round) with a pool of
+threads, checking the size of each copy. Document rows keep storage keys
+rather than paths, so once the copy is complete set DOCUMENT_STORAGE to the
+new backend and restart the app. Documents from before the blob store are
+plain local files: run migrate_document_blobs.py first to include them.
+Blobs in the archive tier stay in DOCUMENT_ARCHIVE_DIR whichever backend
+is used.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import func
+
+from app import app
+from memory_diagnostics import format_bytes
+from models import db, Document, DocumentBlob
+from storage_backends import ARCHIVE_PREFIX, STORAGE_BACKENDS, backend_available, storage_backend
+
+
+def copy_blob(source, target, storage_key, stored_size, delete_source=False):
+    """Copy one blob unless the target already has it; returns its outcome"""
+    try:
+        if target.size(storage_key) != stored_size:
+            # A local source is read in place; an S3 source is downloaded to a temp file first
+            with source.local_copy(storage_key) as path:
+                target.put_file(storage_key, path)
+            copied_size = target.size(storage_key)
+            if copied_size != stored_size:
+                raise RuntimeError(f'copy is {copied_size} bytes, expected {stored_size}')
+            outcome = 'copied'
+        else:
+            outcome = 'present'
+        if delete_source:
+            source.delete(storage_key)
+        return outcome, None
+    except FileNotFoundError:
+        return 'missing', None
+    except Exception as e:
+        return 'failed', f'{type(e).__name__}: {e}'
+
+
+def migrate_storage(source, target, workers=8, batch_size=500, dry_run=False, delete_source=False):
+    """Copy blobs in id order, batch_size rows at a time; returns counters"""
+    results = {'copied': 0, 'present': 0, 'missing': 0, 'failed': 0, 'bytes_copied': 0}
+    stored_size = func.coalesce(DocumentBlob.stored_size, DocumentBlob.size)
+    last_id = 0
+    with ThreadPoolExecutor(workers) as pool:
+        while True:
+            blobs = (db.session.query(DocumentBlob.id, DocumentBlob.storage_key, stored_size)
+                     .filter(DocumentBlob.id > last_id, ~DocumentBlob.storage_key.startswith(ARCHIVE_PREFIX))
+                     .order_by(DocumentBlob.id).limit(batch_size).all())
+            if not blobs:
+                break
+            last_id = blobs[-1].id
+
+            if dry_run:
+                outcomes = pool.map(lambda blob: ('present' if target.size(blob[1]) == blob[2] else 'copied', None), blobs)
+            else:
+                outcomes = pool.map(lambda blob: copy_blob(source, target, blob[1], blob[2], delete_source), blobs)
+            for blob, (outcome, error) in zip(blobs, outcomes):
+                results[outcome] += 1
+                if outcome == 'copied':
+                    results['bytes_copied'] += blob[2]
+                elif outcome == 'missing':
+                    print(f"   ⚠️  Blob {blob[1]}: missing from {source.describe()}")
+                elif outcome == 'failed':
+                    print(f"   ❌ Blob {blob[1]}: {error}")
+            print(f"   {sum(results[key] for key in ['copied', 'present', 'missing', 'failed'])} blobs processed...")
+    return results
+
+
+def main():
+    """Run the document storage migration"""
+    parser = argparse.ArgumentParser(description='Copy stored documents to another storage backend')
+    parser.add_argument('--from', dest='source', choices=STORAGE_BACKENDS, default='local', help='Backend to copy from')
+    parser.add_argument('--to', dest='target', choices=STORAGE_BACKENDS, default='s3', help='Backend to copy to')
+    parser.add_argument('--workers', type=int, default=8, help='Blobs copied at a time')
+    parser.add_argument('--batch-size', type=int, default=500, help='Blob rows read per query')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would be copied without copying')
+    parser.add_argument('--delete-source', action='store_true',
+                        help='Remove each blob from the source once the target has it (after switching DOCUMENT_STORAGE)')
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        print("❌ Source and target backends are the same")
+        return False
+    if not all(backend_available(kind) for kind in [args.source, args.target]):
+        print("❌ S3 storage needs the boto3 package")
+        return False
+    if not app.config['DOCUMENT_S3_BUCKET']:
+        print("❌ Set DOCUMENT_S3_BUCKET (and DOCUMENT_S3_ENDPOINT_URL for MinIO) first")
+        return False
+
+    source = storage_backend(args.source, app.config)
+    target = storage_backend(args.target, app.config)
+    with app.app_context():
+        legacy_count = Document.query.filter(Document.content_hash.is_(None)).count()
+        if legacy_count:
+            print(f"⚠️  {legacy_count} documents predate the blob store and are not copied; "
+                  f"run migrate_document_blobs.py first")
+
+        print(f"Copying documents from {source.describe()} to {target.describe()} with {args.workers} workers")
+        try:
+            results = migrate_storage(source, target, args.workers, args.batch_size,
+                                      dry_run=args.dry_run, delete_source=args.delete_source)
+        except Exception as e:
+            print(f"❌ Migration failed: {e}")
+            return False
+
+        verb = 'Would copy' if args.dry_run else 'Copied'
+        print(f"✅ {verb} {results['copied']} blobs ({format_bytes(results['bytes_copied'])}); "
+              f"{results['present']} already present, {results['missing']} missing, {results['failed']} failures")
+        if not args.dry_run and results['failed'] == 0 and results['missing'] == 0:
+            print(f"   Set DOCUMENT_STORAGE={args.target} and restart the app to serve documents from there")
+        return results['failed'] == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
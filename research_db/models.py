@@ -54,6 +54,7 @@ class Project(db.Model):
     funding_source = db.Column(db.String(100))
     category = db.Column(db.String(100))  # New column for project category
     theme = db.Column(db.String(100))     # New column for project theme
+    storage_quota_bytes = db.Column(db.BigInteger)  # Document storage limit; NULL uses the default, 0 means unlimited
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -103,6 +104,23 @@ class AuditLog(db.Model):
                 return {}
         return {}
 
+class ActivityRollup(db.Model):
+    """Daily audit event counts per user, action and resource type"""
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, default=0)  # 0 for anonymous/system events
+    action = db.Column(db.String(100), nullable=False)
+    resource_type = db.Column(db.String(50), nullable=False, default='')  # '' when the event has none
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('day', 'user_id', 'action', 'resource_type', name='uq_activity_rollup_key'),
+        db.Index('ix_activity_rollup_user_day', 'user_id', 'day'),
+    )
+    
+    def __repr__(self):
+        return f'<ActivityRollup {self.day} user={self.user_id} {self.action}: {self.count}>'
+
 class ProjectStatusHistory(db.Model):
     """Track project status changes over time"""
     id = db.Column(db.Integer, primary_key=True)
@@ -134,7 +152,10 @@ class ErrorLog(db.Model):
     user_agent = db.Column(db.Text)
     severity = db.Column(db.String(20), default='error')  # error, warning, critical
     resolved = db.Column(db.Boolean, default=False)
-    occurred_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    occurred_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # First seen
+    fingerprint = db.Column(db.String(40), unique=True, index=True)  # Exception type + normalized frames
+    occurrence_count = db.Column(db.Integer, default=1, nullable=False)
+    last_seen_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship to user
     user = db.relationship('User', backref=db.backref('error_logs', lazy=True))
@@ -152,23 +173,44 @@ class ErrorLog(db.Model):
                 return {}
         return {}
 
+class DocumentBlob(db.Model):
+    """Stored file content, shared by every Document with the same SHA-256"""
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False)  # Size in bytes
+    storage_key = db.Column(db.String(255), nullable=False)  # Location relative to the document store
+    stored_size = db.Column(db.BigInteger)  # Bytes on disk when compressed; NULL means the same as size
+    compression = db.Column(db.String(10))  # gzip, zstd or NULL for raw files
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # Number of Document rows using this blob
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<DocumentBlob {self.sha256[:12]} refs={self.ref_count}>'
+
 class Document(db.Model):
     """Document model for storing project-related files (contracts, reports, deliverables)"""
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)  # Unique filename on disk
     original_filename = db.Column(db.String(255), nullable=False)  # Original uploaded filename
-    file_path = db.Column(db.String(500), nullable=False)  # Full path to file on disk
+    file_path = db.Column(db.String(500), nullable=False)  # Storage key, or the full local path of a pre-blob-store document
     file_type = db.Column(db.String(10), nullable=False)  # File extension (pdf, doc, docx, etc.)
     file_size = db.Column(db.Integer, nullable=False)  # File size in bytes
     uploaded_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     document_type = db.Column(db.String(20), nullable=False)  # contract, report, deliverable
     description = db.Column(db.Text)  # Optional description of the document
+    content_hash = db.Column(db.String(64), db.ForeignKey('document_blob.sha256'), index=True)  # NULL for files not yet in the blob store
     
     # Relationships
     project = db.relationship('Project', backref=db.backref('documents', lazy=True, order_by='Document.uploaded_at.desc()'))
     uploader = db.relationship('User', backref=db.backref('uploaded_documents', lazy=True))
+    blob = db.relationship('DocumentBlob')
+    
+    __table_args__ = (
+        db.Index('ix_document_project_uploaded', 'project_id', 'uploaded_at'),
+        db.Index('ix_document_type_uploaded', 'document_type', 'uploaded_at'),
+    )
     
     def __repr__(self):
         return f'<Document {self.original_filename} ({self.document_type}) for {self.project.title}>'
@@ -191,6 +233,32 @@ class Document(db.Model):
         }
         return type_names.get(self.document_type, self.document_type.title())
 
+class DocumentExtraction(db.Model):
+    """Text extraction state of a document; the text itself lives in the document_fts search index"""
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), primary_key=True)
+    status = db.Column(db.String(20), nullable=False)  # indexed, empty, unsupported, failed
+    char_count = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    extracted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<DocumentExtraction {self.document_id}: {self.status}>'
+
+class ProjectStorageUsage(db.Model):
+    """Document count and logical bytes per project and document type, kept up to date on upload and delete"""
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    document_type = db.Column(db.String(20), nullable=False)
+    document_count = db.Column(db.Integer, nullable=False, default=0)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('project_id', 'document_type', name='uq_project_storage_usage_key'),
+    )
+    
+    def __repr__(self):
+        return f'<ProjectStorageUsage project={self.project_id} {self.document_type}: {self.total_bytes} bytes>'
+
 def init_database(app):
     """Initialize database with tables and default data"""
     with app.app_context():
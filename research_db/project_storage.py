@@ -0,0 +1,133 @@
+"""
+Per-project document storage accounting
+Keeps the document count and logical bytes of every (project, document type)
+in counter rows updated in the same transaction as each upload and delete, so
+usage figures and quota checks read a few rows instead of summing the
+document table.
+"""
+from sqlalchemy import func
+
+from memory_diagnostics import format_bytes
+from models import db, Document, Project, ProjectStorageUsage
+
+USAGE_KEY_COLUMNS = ['project_id', 'document_type']
+
+
+class QuotaExceeded(Exception):
+    """An upload would take a project past its storage quota"""
+
+    def __init__(self, used, quota, size):
+        self.used = used
+        self.quota = quota
+        self.size = size
+        super().__init__(
+            f'This upload would bring the project to {format_bytes(used + size)}, '
+            f'over its storage quota of {format_bytes(quota)}.'
+        )
+
+
+def _upsert_statement(dialect_name):
+    """Build an INSERT ... ON CONFLICT that adds to an existing usage row"""
+    table = ProjectStorageUsage.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[column] for column in USAGE_KEY_COLUMNS],
+        set_={
+            'document_count': table.c.document_count + stmt.excluded.document_count,
+            'total_bytes': table.c.total_bytes + stmt.excluded.total_bytes,
+        }
+    )
+
+
+def record_document_usage(project_id, document_type, size, count=1):
+    """
+    Add count documents of size bytes in total to a project's usage in the
+    current transaction; negative values remove them.
+    """
+    connection = db.session.connection()
+    connection.execute(_upsert_statement(connection.dialect.name), [{
+        'project_id': project_id, 'document_type': document_type, 'document_count': count, 'total_bytes': size
+    }])
+
+
+def effective_quota(project, default_quota):
+    """
+    A project's storage quota in bytes, or None for no limit. The project's
+    own setting wins; NULL falls back to default_quota, and 0 means unlimited.
+    """
+    quota = project.storage_quota_bytes if project.storage_quota_bytes is not None else default_quota
+    return quota or None
+
+
+def project_bytes_used(project_id):
+    return db.session.query(func.coalesce(func.sum(ProjectStorageUsage.total_bytes), 0)).filter(
+        ProjectStorageUsage.project_id == project_id
+    ).scalar()
+
+
+def check_project_quota(project_id, quota, size=0):
+    """
+    Raise QuotaExceeded when size more bytes would take the project past
+    quota (None for no limit). With size 0 it checks usage already counted.
+    """
+    if quota is None:
+        return
+    used = project_bytes_used(project_id)
+    if used + size > quota:
+        raise QuotaExceeded(used, quota, size)
+
+
+def project_usage(project_id):
+    """Document count and bytes of one project, in total and per document type"""
+    rows = db.session.query(
+        ProjectStorageUsage.document_type, ProjectStorageUsage.document_count, ProjectStorageUsage.total_bytes
+    ).filter(
+        ProjectStorageUsage.project_id == project_id, ProjectStorageUsage.document_count > 0
+    ).order_by(ProjectStorageUsage.total_bytes.desc()).all()
+    return {
+        'document_count': sum(row[1] for row in rows),
+        'total_bytes': sum(row[2] for row in rows),
+        'by_type': [{'document_type': row[0], 'documents': row[1], 'bytes': row[2]} for row in rows],
+    }
+
+
+def usage_by_project(default_quota, limit=None):
+    """Projects holding documents, largest first, with their totals and quota (None for no limit)"""
+    documents = func.sum(ProjectStorageUsage.document_count)
+    total_bytes = func.sum(ProjectStorageUsage.total_bytes)
+    query = db.session.query(
+        Project.id, Project.project_id, Project.title, Project.status, Project.storage_quota_bytes,
+        documents, total_bytes
+    ).join(ProjectStorageUsage, ProjectStorageUsage.project_id == Project.id).group_by(Project.id).having(
+        documents > 0
+    ).order_by(total_bytes.desc(), Project.id)
+    if limit:
+        query = query.limit(limit)
+    return [
+        {'id': row[0], 'project_id': row[1], 'title': row[2], 'status': row[3],
+         'quota_bytes': (row[4] if row[4] is not None else default_quota) or None,
+         'documents': row[5], 'bytes': row[6]}
+        for row in query
+    ]
+
+
+def backfill_storage_usage():
+    """
+    Rebuild the usage table from the document table. Returns the number of
+    usage rows written.
+    """
+    ProjectStorageUsage.query.delete()
+    aggregated = db.session.query(
+        Document.project_id, Document.document_type, func.count(Document.id), func.sum(Document.file_size)
+    ).group_by(Document.project_id, Document.document_type).all()
+    if aggregated:
+        db.session.execute(ProjectStorageUsage.__table__.insert(), [
+            {'project_id': project_id, 'document_type': document_type, 'document_count': count, 'total_bytes': size}
+            for project_id, document_type, count, size in aggregated
+        ])
+    db.session.commit()
+    return len(aggregated)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Document Reindex Script
+Extracts the text of uploaded documents into the full-text search index.
+By default only documents without an extraction are processed; --all
+re-extracts everything (e.g. after installing pypdf).
+"""
+import argparse
+import os
+import sys
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, document_store
+from document_search import reindex_documents, search_index_available
+from models import db
+
+
+def main():
+    """Run the document reindex"""
+    parser = argparse.ArgumentParser(description='Extract document text into the search index')
+    parser.add_argument('--all', action='store_true', help='Re-extract documents that are already indexed')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Extraction processes')
+    parser.add_argument('--batch-size', type=int, default=100, help='Documents per transaction')
+    parser.add_argument('--project', type=int, help='Only documents of this project id')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not search_index_available():
+            print("❌ Document search needs an SQLite database with FTS5")
+            return False
+
+        print(f"Indexing documents with {args.workers} workers...")
+        try:
+            counts = reindex_documents(document_store.backend, args.workers, args.batch_size, only_missing=not args.all,
+                                       project_id=args.project)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Reindex failed: {e}")
+            return False
+
+        print(f"✅ Indexed {counts['indexed']} documents "
+              f"({counts['empty']} without text, {counts['unsupported']} unsupported, "
+              f"{counts['missing']} missing files, {counts['failed']} failures)")
+        return counts['failed'] == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
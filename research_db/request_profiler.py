@@ -0,0 +1,257 @@
+"""
+On-demand request profiler
+Profiles the next N requests to an endpoint, or any request carrying a signed
+X-Profile-Token header, with a stack sampler (flamegraph-ready collapsed
+stacks) or cProfile, and stores the results under logs/profiles/
+"""
+import cProfile
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, request
+
+from file_locks import file_lock
+
+PROFILE_MODES = ['sample', 'cprofile']
+PROFILE_EXTENSIONS = {'sample': '.folded', 'cprofile': '.prof'}
+ARMED_STATE_FILE = 'armed.json'
+
+# cProfile can profile only one thread of a process at a time (Python 3.12+ raises ValueError otherwise)
+_cprofile_lock = threading.Lock()
+
+
+class StackSampler:
+    """Samples the stack of one thread at a fixed interval and counts collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.counts[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        """Write collapsed stacks ("frame;frame;frame count"), the input format of flamegraph tools"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class CProfileRunner:
+    """cProfile wrapper with the same interface as StackSampler"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        """False, without profiling, while another request of this process is under cProfile"""
+        if not _cprofile_lock.acquire(blocking=False):
+            return False
+        try:
+            self.profile.enable()
+        except ValueError:
+            # Another profiling tool is active in this process
+            _cprofile_lock.release()
+            return False
+        return True
+
+    def stop(self):
+        self.profile.disable()
+        _cprofile_lock.release()
+
+    def write(self, path):
+        self.profile.dump_stats(path)
+
+
+def sign_profile_token(secret_key, expires_at):
+    """Create an X-Profile-Token value valid until the given unix time"""
+    signature = hmac.new(secret_key.encode('utf-8'), f'profile:{expires_at}'.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f'{expires_at}.{signature}'
+
+
+def verify_profile_token(secret_key, token):
+    """Return True for an unexpired token created by sign_profile_token"""
+    expires_at, _, signature = (token or '').partition('.')
+    if not expires_at.isdigit() or int(expires_at) < time.time():
+        return False
+    return hmac.compare_digest(sign_profile_token(secret_key, int(expires_at)), token)
+
+
+class ProfilerControl:
+    """
+    Arming state shared by all worker processes through a small JSON file in
+    the profile directory. Each process re-reads the file only when it changes;
+    changes are made under a file lock so two workers never claim the same slot.
+    """
+
+    def __init__(self, profile_dir):
+        self.profile_dir = profile_dir
+        self.state_path = os.path.join(profile_dir, ARMED_STATE_FILE)
+        self._lock = threading.Lock()
+        self._state = {}
+        self._mtime = None
+
+    def _load(self, force=False):
+        try:
+            mtime = os.path.getmtime(self.state_path)
+        except OSError:
+            self._state, self._mtime = {}, None
+            return
+        if force or mtime != self._mtime:
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    self._state = json.load(f)
+            except (OSError, ValueError):
+                self._state = {}
+            self._mtime = mtime
+
+    @contextmanager
+    def _locked_state(self):
+        """Hold the state across threads and processes, freshly loaded, for a read-modify-write"""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with self._lock, file_lock(self.state_path + '.lock'):
+            # Always re-read: a write within the same clock tick can leave the mtime unchanged
+            self._load(force=True)
+            yield
+
+    def _save(self):
+        temp_path = self.state_path + f'.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f)
+        os.replace(temp_path, self.state_path)
+        self._mtime = os.path.getmtime(self.state_path)
+
+    def armed(self):
+        """Return {endpoint: {'remaining': n, 'mode': mode}}"""
+        with self._lock:
+            self._load()
+            return dict(self._state)
+
+    def arm(self, endpoint, count, mode):
+        with self._locked_state():
+            self._state[endpoint] = {'remaining': count, 'mode': mode}
+            self._save()
+
+    def disarm(self, endpoint):
+        with self._locked_state():
+            if self._state.pop(endpoint, None) is not None:
+                self._save()
+
+    def claim(self, endpoint):
+        """Take one armed profiling slot for the endpoint; returns the mode or None"""
+        # Most requests are to endpoints that are not armed: skip the file lock for them
+        if endpoint not in self.armed():
+            return None
+        with self._locked_state():
+            armed = self._state.get(endpoint)
+            if not armed:
+                return None
+            armed['remaining'] -= 1
+            if armed['remaining'] <= 0:
+                del self._state[endpoint]
+            self._save()
+            return armed['mode']
+
+
+def list_profiles(profile_dir):
+    """Stored profiles, newest first"""
+    profiles = []
+    if not os.path.isdir(profile_dir):
+        return profiles
+    for filename in os.listdir(profile_dir):
+        extension = os.path.splitext(filename)[1]
+        if extension not in PROFILE_EXTENSIONS.values():
+            continue
+        path = os.path.join(profile_dir, filename)
+        stat = os.stat(path)
+        parts = os.path.splitext(filename)[0].split('__')
+        profiles.append({
+            'filename': filename,
+            'endpoint': parts[1] if len(parts) > 2 else '',
+            'duration_ms': int(parts[2]) if len(parts) > 3 and parts[2].isdigit() else None,
+            'mode': 'sample' if extension == '.folded' else 'cprofile',
+            'created': datetime.fromtimestamp(stat.st_mtime),
+            'size_kb': round(stat.st_size / 1024, 1)
+        })
+    profiles.sort(key=lambda profile: profile['created'], reverse=True)
+    return profiles
+
+
+def _prune_profiles(profile_dir, max_files):
+    for profile in list_profiles(profile_dir)[max_files:]:
+        try:
+            os.remove(os.path.join(profile_dir, profile['filename']))
+        except OSError:
+            pass
+
+
+def init_request_profiler(app, control):
+    """Start a profiler for armed or token-carrying requests and store the result at teardown"""
+    profile_dir = app.config['PROFILE_DIR']
+
+    @app.before_request
+    def start_request_profile():
+        if request.endpoint in (None, 'static'):
+            return
+        token = request.headers.get('X-Profile-Token')
+        if token and verify_profile_token(app.config['SECRET_KEY'], token):
+            mode = request.headers.get('X-Profile-Mode', 'sample')
+            mode = mode if mode in PROFILE_MODES else 'sample'
+        else:
+            mode = control.claim(request.endpoint)
+        if mode is None:
+            return
+
+        if mode == 'cprofile':
+            profiler = CProfileRunner()
+        else:
+            profiler = StackSampler(threading.get_ident(), app.config['PROFILER_SAMPLE_INTERVAL_MS'] / 1000)
+        if profiler.start():
+            g.request_profile = (profiler, mode, time.perf_counter())
+
+    @app.teardown_request
+    def finish_request_profile(exc):
+        profile = g.pop('request_profile', None)
+        if profile is None:
+            return
+        profiler, mode, started_at = profile
+        profiler.stop()
+        duration_ms = int((time.perf_counter() - started_at) * 1000)
+
+        os.makedirs(profile_dir, exist_ok=True)
+        filename = '__'.join([
+            datetime.now().strftime('%Y%m%d_%H%M%S'),
+            request.endpoint,
+            str(duration_ms),
+            (g.get('request_id') or os.urandom(4).hex())[:8]
+        ]) + PROFILE_EXTENSIONS[mode]
+        profiler.write(os.path.join(profile_dir, filename))
+        _prune_profiles(profile_dir, app.config['PROFILE_MAX_FILES'])
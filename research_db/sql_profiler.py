@@ -0,0 +1,173 @@
+"""
+SQL query profiler
+Development/staging profiler that records every SQL statement of a request,
+flags statement shapes repeated within one request as probable N+1 patterns
+and logs slow queries together with their query plan
+"""
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from flask import request
+
+from instrumentation import current_request_stats
+from models import db
+
+profiler_logger = logging.getLogger('sql_profiler')
+
+
+def statement_shape(statement):
+    """Normalize a statement so executions that differ only in values compare equal"""
+    shape = re.sub(r'\s+', ' ', statement).strip()
+    shape = re.sub(r"'(?:[^']|'')*'", '?', shape)
+    shape = re.sub(r'\b\d+(?:\.\d+)?\b', '?', shape)
+    # Expanded IN lists of any length share one shape
+    shape = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(?)', shape)
+    return shape
+
+
+def find_n_plus_one(queries, threshold):
+    """
+    Group the SELECT statements of one request by shape and return the shapes
+    executed at least `threshold` times as (shape, count, seconds), most
+    frequent first
+    """
+    groups = {}
+    for statement, parameters, duration in queries:
+        if not statement.lstrip().upper().startswith('SELECT'):
+            continue
+        shape = statement_shape(statement)
+        group = groups.setdefault(shape, [0, 0.0])
+        group[0] += 1
+        group[1] += duration
+    repeated = [(shape, count, seconds) for shape, (count, seconds) in groups.items() if count >= threshold]
+    repeated.sort(key=lambda item: item[1], reverse=True)
+    return repeated
+
+
+def explain_query_plan(statement, parameters):
+    """Return the SQLite query plan of a SELECT statement as a list of lines"""
+    if db.engine.dialect.name != 'sqlite' or not statement.lstrip().upper().startswith('SELECT'):
+        return []
+    try:
+        with db.engine.connect() as connection:
+            rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).fetchall()
+        return [row[-1] for row in rows]
+    except Exception as e:
+        return [f'Query plan unavailable: {e}']
+
+
+class SqlProfileStore:
+    """Per-endpoint SQL statistics of the current process"""
+
+    def __init__(self, max_findings=50):
+        self._lock = threading.Lock()
+        self.max_findings = max_findings
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.findings = deque(maxlen=self.max_findings)
+            self.started_at = time.time()
+
+    def record(self, endpoint, query_count, db_time, n_plus_one, slow_queries, path):
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, {
+                'endpoint': endpoint,
+                'requests': 0,
+                'queries': 0,
+                'max_queries': 0,
+                'db_time': 0.0,
+                'n_plus_one_requests': 0,
+                'slow_queries': 0,
+                'repeated_shapes': {}
+            })
+            stats['requests'] += 1
+            stats['queries'] += query_count
+            stats['max_queries'] = max(stats['max_queries'], query_count)
+            stats['db_time'] += db_time
+            stats['slow_queries'] += len(slow_queries)
+            if n_plus_one:
+                stats['n_plus_one_requests'] += 1
+                for shape, count, seconds in n_plus_one:
+                    stats['repeated_shapes'][shape] = max(stats['repeated_shapes'].get(shape, 0), count)
+
+            if n_plus_one or slow_queries:
+                self.findings.appendleft({
+                    'recorded_at': time.time(),
+                    'endpoint': endpoint,
+                    'path': path,
+                    'query_count': query_count,
+                    'n_plus_one': n_plus_one,
+                    'slow_queries': slow_queries
+                })
+
+    def worst_endpoints(self, limit=25):
+        """Endpoints ordered by average queries per request, then SQL time"""
+        with self._lock:
+            rows = []
+            for stats in self.endpoints.values():
+                row = dict(stats)
+                row['avg_queries'] = stats['queries'] / stats['requests']
+                row['avg_db_ms'] = stats['db_time'] * 1000 / stats['requests']
+                row['repeated_shapes'] = sorted(stats['repeated_shapes'].items(), key=lambda item: item[1], reverse=True)
+                rows.append(row)
+        rows.sort(key=lambda row: (row['avg_queries'], row['avg_db_ms']), reverse=True)
+        return rows[:limit]
+
+    def recent_findings(self):
+        with self._lock:
+            return list(self.findings)
+
+
+def init_sql_profiler(app, store):
+    """
+    Record every SQL statement of each request when SQL_PROFILER_ENABLED is set.
+
+    Analysis runs at teardown, after the response (including streamed bodies)
+    has been produced, so the profiler's own EXPLAIN queries never show up in
+    the request's metrics or Server-Timing header.
+    """
+    if not app.config.get('SQL_PROFILER_ENABLED'):
+        return
+
+    @app.before_request
+    def start_sql_profiling():
+        stats = current_request_stats()
+        if stats is not None and request.endpoint != 'static':
+            stats.queries = []
+
+    @app.teardown_request
+    def finish_sql_profiling(exc):
+        stats = current_request_stats()
+        if stats is None or stats.queries is None:
+            return
+        queries, stats.queries = stats.queries, None
+        endpoint = request.endpoint or 'unmatched'
+
+        n_plus_one = find_n_plus_one(queries, app.config['SQL_N_PLUS_ONE_THRESHOLD'])
+        for shape, count, seconds in n_plus_one:
+            profiler_logger.warning(
+                f"Probable N+1 in {endpoint}: {count} executions ({seconds * 1000:.1f}ms) of {shape[:300]}",
+                extra={'endpoint': endpoint, 'path': request.path}
+            )
+
+        slow_queries = []
+        threshold = app.config['SQL_SLOW_QUERY_MS'] / 1000
+        for statement, parameters, duration in queries:
+            if duration < threshold:
+                continue
+            plan = explain_query_plan(statement, parameters)
+            slow_queries.append({'statement': statement, 'duration_ms': round(duration * 1000, 2), 'plan': plan})
+            profiler_logger.warning(
+                f"Slow query in {endpoint} ({duration * 1000:.1f}ms): {' '.join(statement.split())[:500]} | plan: {'; '.join(plan)}",
+                extra={'endpoint': endpoint, 'path': request.path, 'latency_ms': round(duration * 1000, 2)}
+            )
+
+        store.record(
+            endpoint, len(queries), sum(duration for _, _, duration in queries),
+            n_plus_one, slow_queries, request.path
+        )
@@ -0,0 +1,404 @@
+"""
+Document storage backends
+Blob files live either in a local directory or in an S3-compatible bucket
+(AWS S3, or MinIO or another S3 API server given an endpoint URL), addressed
+by storage key ('ab/<sha256>', plus .gz or .zst when compressed), and
+blobs of long-closed projects in a local archive directory under keys
+starting with archive/ (see TieredBackend). Backends hold only their
+configuration - the S3 client is created on first use and
+left out when pickled - so extraction and preview worker processes can read
+blobs themselves. Imports nothing from the app. S3 needs the optional boto3
+package.
+"""
+import errno
+import io
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # S3 storage is optional
+    boto3 = None
+
+from storage_compression import codec_for_path, decompressing_stream
+
+STORAGE_BACKENDS = ['local', 's3']
+
+# Storage keys of blobs in the archive tier
+ARCHIVE_PREFIX = 'archive/'
+
+READ_BUFFER_SIZE = 256 * 1024
+
+
+def backend_available(kind):
+    return kind == 'local' or (kind == 's3' and boto3 is not None)
+
+
+class LocalBackend:
+    """Blobs as files under root_dir/<aa>/<sha256>"""
+
+    name = 'local'
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def describe(self):
+        return self.root_dir
+
+    def path_for(self, storage_key):
+        return os.path.join(self.root_dir, *storage_key.split('/'))
+
+    def local_path(self, storage_key):
+        """Path of the blob file, for send_file and front-end server offloading"""
+        return self.path_for(storage_key)
+
+    def size(self, storage_key):
+        """Stored size in bytes, or None when the blob does not exist"""
+        try:
+            return os.path.getsize(self.path_for(storage_key))
+        except OSError:
+            return None
+
+    def exists(self, storage_key):
+        return os.path.exists(self.path_for(storage_key))
+
+    def put_file(self, storage_key, source_path, move=False):
+        """Store a local file under storage_key; move renames it instead of copying where it can"""
+        target = self.path_for(storage_key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if move:
+            try:
+                os.replace(source_path, target)
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # On another filesystem (an archive disk, say): copied, then removed
+        # Copied next to the target first, so a reader never sees a partial blob
+        temp_path = f'{target}.{uuid.uuid4().hex}.tmp'
+        try:
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, target)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if move:
+            os.remove(source_path)
+
+    def open(self, storage_key):
+        return open(self.path_for(storage_key), 'rb')
+
+    def delete(self, storage_key):
+        try:
+            os.remove(self.path_for(storage_key))
+        except FileNotFoundError:
+            pass
+
+    def rename(self, storage_key, new_key):
+        """Move a blob to another key; False when it does not exist"""
+        target = self.path_for(new_key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(self.path_for(storage_key), target)
+        except FileNotFoundError:
+            return False
+        return True
+
+    @contextmanager
+    def local_copy(self, storage_key):
+        yield self.path_for(storage_key)
+
+    def iter_keys(self):
+        """(storage key, size, modified timestamp) of every stored blob"""
+        for root, _, filenames in os.walk(self.root_dir):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue  # Still being copied in
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield os.path.relpath(path, self.root_dir).replace(os.sep, '/'), stat.st_size, stat.st_mtime
+
+
+class _S3ObjectReader(io.RawIOBase):
+    """
+    Seekable raw reader over an S3 object. Reads continue one streaming GET
+    from the current position; a seek starts a new ranged GET on the next
+    read, so a Range request only transfers the bytes it asks for.
+    """
+
+    def __init__(self, backend, object_key, size):
+        self._backend = backend
+        self._object_key = object_key
+        self._size = size
+        self._position = 0
+        self._body = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._position >= self._size:
+            return 0
+        if self._body is None:
+            self._body = self._backend.client.get_object(
+                Bucket=self._backend.bucket, Key=self._object_key, Range=f'bytes={self._position}-'
+            )['Body']
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset != self._position:
+            self._close_body()
+            self._position = max(offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def close(self):
+        self._close_body()
+        super().close()
+
+
+class S3Backend:
+    """
+    Blobs as objects <prefix><aa>/<sha256> in an S3 bucket. Files are
+    uploaded in parts of part_size, several at a time, straight from their
+    temp file; downloads stream from ranged GETs. Credentials come from the
+    usual AWS environment variables or config files.
+    """
+
+    name = 's3'
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, part_size=8 * 1024 * 1024,
+                 max_concurrency=4):
+        if boto3 is None:
+            raise RuntimeError('S3 document storage needs the boto3 package')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_client'] = None
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # boto3 clients are thread-safe once created, but creating one isn't
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = boto3.session.Session().client(
+                        's3', endpoint_url=self.endpoint_url, region_name=self.region,
+                        config=BotoConfig(max_pool_connections=max(10, self.max_concurrency * 2))
+                    )
+        return self._client
+
+    def _transfer_config(self):
+        return TransferConfig(multipart_threshold=self.part_size, multipart_chunksize=self.part_size,
+                              max_concurrency=self.max_concurrency)
+
+    def describe(self):
+        location = f's3://{self.bucket}/{self.prefix}'
+        return f'{location} at {self.endpoint_url}' if self.endpoint_url else location
+
+    def object_key(self, storage_key):
+        return self.prefix + storage_key
+
+    def local_path(self, storage_key):
+        return None
+
+    def size(self, storage_key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(storage_key))['ContentLength']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, storage_key):
+        return self.size(storage_key) is not None
+
+    def put_file(self, storage_key, source_path, move=False):
+        """Multipart upload of a local file (a single PUT when it is smaller than one part)"""
+        self.client.upload_file(source_path, self.bucket, self.object_key(storage_key), Config=self._transfer_config())
+        if move:
+            os.remove(source_path)
+
+    def open(self, storage_key):
+        size = self.size(storage_key)
+        if size is None:
+            raise FileNotFoundError(f'{self.describe()}{storage_key}')
+        return io.BufferedReader(_S3ObjectReader(self, self.object_key(storage_key), size), READ_BUFFER_SIZE)
+
+    def delete(self, storage_key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_key(storage_key))
+
+    def rename(self, storage_key, new_key):
+        """Copy a blob to another key and delete the original; False when it does not exist"""
+        try:
+            self.client.copy(
+                {'Bucket': self.bucket, 'Key': self.object_key(storage_key)}, self.bucket, self.object_key(new_key),
+                Config=self._transfer_config()
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        self.delete(storage_key)
+        return True
+
+    @contextmanager
+    def local_copy(self, storage_key):
+        """Download the blob to a temp file for parsers that need a seekable local file"""
+        # The blob's name is kept as the suffix, so a compressed copy still says how to read it
+        handle, temp_path = tempfile.mkstemp(suffix=f'-{os.path.basename(storage_key)}')
+        os.close(handle)
+        try:
+            try:
+                self.client.download_file(self.bucket, self.object_key(storage_key), temp_path)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                    raise FileNotFoundError(f'{self.describe()}{storage_key}') from e
+                raise
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+
+    def iter_keys(self):
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):], item['Size'], item['LastModified'].timestamp()
+
+
+class TieredBackend:
+    """
+    The hot backend plus an archive tier: keys starting with archive/ are
+    stored in the archive backend (without the prefix), all others in the hot
+    one, so a moved blob is found again from its storage key alone.
+    """
+
+    def __init__(self, hot, archive):
+        self.hot = hot
+        self.archive = archive
+        self.name = hot.name
+
+    def _route(self, storage_key):
+        if storage_key.startswith(ARCHIVE_PREFIX):
+            return self.archive, storage_key[len(ARCHIVE_PREFIX):]
+        return self.hot, storage_key
+
+    def describe(self):
+        return f'{self.hot.describe()} (archive tier {self.archive.describe()})'
+
+    def local_path(self, storage_key):
+        backend, key = self._route(storage_key)
+        return backend.local_path(key)
+
+    def size(self, storage_key):
+        backend, key = self._route(storage_key)
+        return backend.size(key)
+
+    def exists(self, storage_key):
+        backend, key = self._route(storage_key)
+        return backend.exists(key)
+
+    def put_file(self, storage_key, source_path, move=False):
+        backend, key = self._route(storage_key)
+        backend.put_file(key, source_path, move)
+
+    def open(self, storage_key):
+        backend, key = self._route(storage_key)
+        return backend.open(key)
+
+    def delete(self, storage_key):
+        backend, key = self._route(storage_key)
+        backend.delete(key)
+
+    def rename(self, storage_key, new_key):
+        """Move a blob to another key of the same tier; False when it does not exist"""
+        backend, key = self._route(storage_key)
+        target, new_key = self._route(new_key)
+        if target is not backend:
+            raise ValueError('Blobs can only be renamed within one storage tier')
+        return backend.rename(key, new_key)
+
+    def local_copy(self, storage_key):
+        backend, key = self._route(storage_key)
+        return backend.local_copy(key)
+
+    def iter_keys(self):
+        yield from self.hot.iter_keys()
+        for key, size, modified in self.archive.iter_keys():
+            yield ARCHIVE_PREFIX + key, size, modified
+
+
+def storage_backend(kind, config):
+    """Backend of the given kind configured from the app config (a dict of DOCUMENT_* settings)"""
+    if kind == 's3':
+        return S3Backend(
+            config['DOCUMENT_S3_BUCKET'],
+            prefix=config['DOCUMENT_S3_PREFIX'],
+            endpoint_url=config['DOCUMENT_S3_ENDPOINT_URL'],
+            region=config['DOCUMENT_S3_REGION'],
+            part_size=config['DOCUMENT_S3_PART_BYTES'],
+            max_concurrency=config['DOCUMENT_S3_UPLOAD_CONCURRENCY'],
+        )
+    return LocalBackend(os.path.join(config['DOCUMENT_STORE_DIR'], 'blobs'))
+
+
+def is_legacy_location(location):
+    """Documents from before the blob store keep a full local path instead of a storage key"""
+    return os.path.isabs(location)
+
+
+def open_location(backend, location):
+    """Binary file object with the original content of a document's file_path, decompressed if need be"""
+    raw = open(location, 'rb') if is_legacy_location(location) else backend.open(location)
+    codec = codec_for_path(location)
+    return decompressing_stream(raw, codec, READ_BUFFER_SIZE) if codec else raw
+
+
+@contextmanager
+def local_copy(backend, location):
+    """Local path with a document's stored bytes (as stored, so possibly compressed)"""
+    if is_legacy_location(location):
+        yield location
+    else:
+        with backend.local_copy(location) as path:
+            yield path
@@ -0,0 +1,109 @@
+"""
+Compression at rest
+Blobs of formats that compress well (plain text and the binary pre-2007
+Office formats) can be stored gzip- or zstd-compressed; the codec is
+recorded in the blob's file extension (.gz / .zst), so any reader can open
+a stored file without a database lookup. Imports nothing from the app, so
+extraction and preview worker processes can use it too. zstd needs the
+optional zstandard package.
+"""
+import gzip
+import io
+import os
+import shutil
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+COMPRESSION_CODECS = ['gzip', 'zstd']
+CODEC_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+# PDF, Office Open XML (zip) and image formats are compressed already
+COMPRESSIBLE_TYPES = {'txt', 'doc', 'xls', 'ppt'}
+
+# A compressed copy has to save at least this fraction to be kept
+MIN_SAVING = 0.1
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 9
+
+
+def codec_available(codec):
+    return codec == 'gzip' or (codec == 'zstd' and zstandard is not None)
+
+
+def codec_for_path(path):
+    """Codec a stored file was written with, from its extension; None for raw files"""
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if path.endswith(extension):
+            return codec
+    return None
+
+
+def compress_file(source_path, target_path, codec, chunk_size=1024 * 1024):
+    """Stream-compress source_path into target_path; returns the compressed size"""
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        if codec == 'zstd':
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(
+                source, target, size=os.fstat(source.fileno()).st_size, read_size=chunk_size, write_size=chunk_size)
+        else:
+            # No name or mtime in the header, so identical content always compresses to identical bytes
+            with gzip.GzipFile(filename='', fileobj=target, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as compressed:
+                shutil.copyfileobj(source, compressed, chunk_size)
+    return os.path.getsize(target_path)
+
+
+class _DecompressingReader(io.RawIOBase):
+    """
+    Raw reader over a decompression stream. It deliberately has no fileno(),
+    so a WSGI server's sendfile() can't send the compressed bytes instead.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seekable(self):
+        return self._stream.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Forward seeks decompress and skip; Range requests only ever need those
+        return self._stream.seek(offset, whence)
+
+    def tell(self):
+        return self._stream.tell()
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+        super().close()
+
+
+def decompressing_stream(raw, codec, buffer_size=256 * 1024):
+    """Binary file object with the original content of a raw stream written with codec"""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('The file is zstd-compressed but the zstandard package is not installed')
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    else:
+        stream = gzip.GzipFile(fileobj=raw, mode='rb')
+        # GzipFile leaves a file object it was given open
+        stream.myfileobj = raw
+    return io.BufferedReader(_DecompressingReader(stream), buffer_size)
+
+
+def open_stored_file(path, buffer_size=256 * 1024):
+    """Binary file object reading a stored file's original content"""
+    codec = codec_for_path(path)
+    if codec is None:
+        return open(path, 'rb')
+    return decompressing_stream(open(path, 'rb'), codec, buffer_size)
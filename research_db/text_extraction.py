@@ -0,0 +1,143 @@
+"""
+Plain-text extraction from uploaded documents
+Runs in worker processes, so it imports nothing from the app; documents in
+object storage are fetched to a temp file first. Office Open XML files are
+read straight from their zip parts with the standard library; PDFs need the
+optional pypdf package and yield only their text layer.
+"""
+import html
+import re
+import zipfile
+
+from storage_backends import local_copy
+from storage_compression import open_stored_file
+
+try:
+    import pypdf
+except ImportError:  # PDF extraction is optional
+    pypdf = None
+
+# Text beyond this is not indexed; the start of a document is what search snippets show anyway
+MAX_TEXT_CHARS = 2_000_000
+
+_TAG = re.compile(r'<[^>]+>')
+_WHITESPACE = re.compile(r'[ \t\r\f\v]+')
+_BLANK_LINES = re.compile(r'\n\s*\n+')
+
+
+class UnsupportedDocument(Exception):
+    """No extractor for this file type (or its optional dependency is missing)"""
+
+
+def _xml_text(xml, break_tags):
+    """Text content of an XML part, with a line break after each of break_tags"""
+    for tag in break_tags:
+        xml = xml.replace(f'</{tag}>', '\n')
+    return html.unescape(_TAG.sub(' ', xml))
+
+
+def _zip_parts(archive, pattern):
+    def sort_key(name):
+        # slide2.xml before slide10.xml
+        return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+    return sorted((name for name in archive.namelist() if re.fullmatch(pattern, name)), key=sort_key)
+
+
+def _extract_docx(path):
+    with zipfile.ZipFile(path) as archive:
+        parts = ['word/document.xml'] + _zip_parts(archive, r'word/(header|footer|footnotes|endnotes)\d*\.xml')
+        return '\n'.join(
+            _xml_text(archive.read(name).decode('utf-8', 'replace'), ['w:p'])
+            for name in parts if name in archive.namelist()
+        )
+
+
+def _extract_pptx(path):
+    with zipfile.ZipFile(path) as archive:
+        return '\n'.join(
+            _xml_text(archive.read(name).decode('utf-8', 'replace'), ['a:p'])
+            for name in _zip_parts(archive, r'ppt/(slides/slide|notesSlides/notesSlide)\d+\.xml')
+        )
+
+
+def _extract_xlsx(path):
+    # Cell text lives in the shared string table; inline strings are rare but possible
+    with zipfile.ZipFile(path) as archive:
+        parts = [name for name in ['xl/sharedStrings.xml'] if name in archive.namelist()]
+        parts += _zip_parts(archive, r'xl/worksheets/sheet\d+\.xml')
+        texts = []
+        for name in parts:
+            xml = archive.read(name).decode('utf-8', 'replace')
+            texts.extend(html.unescape(value) for value in re.findall(r'<t(?:\s[^>]*)?>([^<]*)</t>', xml))
+        return '\n'.join(texts)
+
+
+def _extract_pdf(path):
+    reader = pypdf.PdfReader(path)
+    texts, length = [], 0
+    for page in reader.pages:
+        text = page.extract_text() or ''
+        texts.append(text)
+        length += len(text)
+        if length >= MAX_TEXT_CHARS:
+            break
+    return '\n'.join(texts)
+
+
+def _extract_txt(path):
+    # Text files may be compressed at rest
+    with open_stored_file(path) as f:
+        data = f.read(MAX_TEXT_CHARS * 4)
+    for encoding in ['utf-8', 'cp1252']:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', 'replace')
+
+
+EXTRACTORS = {
+    'txt': _extract_txt,
+    'docx': _extract_docx,
+    'pptx': _extract_pptx,
+    'xlsx': _extract_xlsx,
+    'pdf': _extract_pdf,
+}
+
+
+def normalize_text(text):
+    text = _WHITESPACE.sub(' ', text.replace('\x00', ''))
+    return _BLANK_LINES.sub('\n\n', text).strip()[:MAX_TEXT_CHARS]
+
+
+def _extractor(file_type):
+    extractor = EXTRACTORS.get((file_type or '').lower())
+    if extractor is None:
+        raise UnsupportedDocument(f'No text extractor for .{file_type} files')
+    if extractor is _extract_pdf and pypdf is None:
+        raise UnsupportedDocument('PDF extraction needs the pypdf package')
+    return extractor
+
+
+def extract_text(path, file_type):
+    """Extracted, whitespace-normalized text of a document file"""
+    return normalize_text(_extractor(file_type)(path))
+
+
+def extract_for_index(task):
+    """
+    Process pool entry point: (document_id, storage backend, location,
+    file_type) -> (document_id, status, text, error). Never raises, so one
+    bad file can't break a batch.
+    """
+    document_id, backend, location, file_type = task
+    try:
+        # Checked first, so unsupported files are never fetched from object storage
+        extractor = _extractor(file_type)
+        with local_copy(backend, location) as path:
+            text = normalize_text(extractor(path))
+    except UnsupportedDocument as e:
+        return document_id, 'unsupported', '', str(e)
+    except Exception as e:
+        return document_id, 'failed', '', f'{type(e).__name__}: {e}'[:500]
+    return document_id, 'indexed' if text else 'empty', text, None
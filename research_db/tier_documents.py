@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Document Tiering Script
+Moves the stored files of documents used only by projects that were
+completed or cancelled more than --months ago into the archive tier
+(DOCUMENT_ARCHIVE_DIR), compressed where that saves space, and moves
+archived files that an open project uses again back. Downloads keep working
+throughout. Run it from cron; backups of the hot store and storage checks
+then skip everything archived.
+"""
+import argparse
+import os
+import sys
+
+# Add the current directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, document_store
+from document_tiers import tier_documents
+from memory_diagnostics import format_bytes
+from models import db, Document
+
+
+def main():
+    """Run the document tiering job"""
+    parser = argparse.ArgumentParser(description='Move documents of long-closed projects to the archive tier')
+    parser.add_argument('--months', type=int, default=app.config['DOCUMENT_ARCHIVE_AFTER_MONTHS'],
+                        help='Archive documents of projects closed longer than this')
+    parser.add_argument('--workers', type=int, default=4, help='Files copied at a time')
+    parser.add_argument('--batch-size', type=int, default=200, help='Blob rows read per query')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would move without moving it')
+    args = parser.parse_args()
+
+    with app.app_context():
+        legacy_count = Document.query.filter(Document.content_hash.is_(None)).count()
+        if legacy_count:
+            print(f"⚠️  {legacy_count} documents predate the blob store and stay where they are; "
+                  f"run migrate_document_blobs.py first")
+
+        print(f"Tiering documents of projects closed more than {args.months} months ago "
+              f"in {document_store.backend.describe()}")
+        try:
+            results = tier_documents(document_store, args.months, args.workers, args.batch_size,
+                                     dry_run=args.dry_run,
+                                     report=lambda storage_key, error: print(f"   ❌ Blob {storage_key}: {error}"))
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Tiering failed: {e}")
+            return False
+
+        if args.dry_run:
+            print(f"✅ Would archive {results['archived']} blobs ({format_bytes(results['archived_bytes'])} stored) "
+                  f"and restore {results['restored']} ({format_bytes(results['restored_bytes'])})")
+        else:
+            print(f"✅ Archived {results['archived']} blobs: {format_bytes(results['archived_bytes'])} off the hot "
+                  f"store, {format_bytes(results['archive_bytes'])} in the archive; restored {results['restored']} "
+                  f"({format_bytes(results['restored_bytes'])}); {results['failed']} failures")
+        return results['failed'] == 0
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)